@@ -1,30 +1,116 @@
 import os
 import hashlib
-from langchain_community.document_loaders import PyPDFLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_openai import OpenAIEmbeddings
-from langchain_community.vectorstores import Chroma
-from langchain.chains import RetrievalQA, ConversationalRetrievalChain
-from langchain_openai import ChatOpenAI
-from langchain_core.messages import HumanMessage, SystemMessage
-from groq import Groq
+import html
+import time
+import threading
+from contextlib import contextmanager
 from config import Config
-from models import db, PDFDocument
-import re # For basic HTML to text conversion
-
-# Initialize OpenAI embeddings
-try:
-    embeddings = OpenAIEmbeddings(openai_api_key=Config.OPENAI_API_KEY, model="text-embedding-3-small")
-except Exception as e:
-    print(f"Error initializing OpenAIEmbeddings: {e}")
-    embeddings = None
-
-# Initialize ChatOpenAI model
-try:
-    llm = ChatOpenAI(openai_api_key=Config.OPENAI_API_KEY, model_name="gpt-4.1-nano", temperature=0.7)
-except Exception as e:
-    print(f"Error initializing ChatOpenAI: {e}")
-    llm = None
+from models import db, PDFDocument, PDFPage, User
+from html_text import html_to_text
+from metrics import llm_call, record_llm_route, LLMCall
+from tracing import traced, span, current_span, langchain_callback, traced_embeddings
+from usage import metered_call, count_tokens, Meter, QuotaExceededError, LLMBusyError
+from llm_providers import create_chat_model, create_embeddings, estimate_cost, is_configured, model_name, LEGACY_EMBEDDING_SPEC
+from resilience import resilient_call, resilient_embeddings, get_policy
+import vector_store
+from retrieval import reranking_retriever
+
+# langchain and Chroma are imported where they are used and the clients below are built
+# on first use, so importing this module (and every blueprint that does) stays cheap.
+# `python startup_report.py` tracks the import cost of the app.
+_clients = {}
+_clients_lock = threading.Lock()
+
+# PDF chunking for the vector store, in characters
+CHUNK_SIZE = 4000
+CHUNK_OVERLAP = 400
+
+QA_PROMPT_TEMPLATE = """Aşağıdaki bağlamı kullanarak son kullanıcı sorusuna cevap ver. Eğer cevabı bilmiyorsan, bilmediğini söyle, cevap uydurmaya çalışma. Cevabını mümkün olduğunca kısa ve öz tut.
+
+                **Bağlam**:
+                {context}
+
+                **Soru**: {question}
+
+                Yardımcı Cevap:"""
+
+def _get_client(name, factory):
+    """Returns the shared client `name`, creating it once across threads; None if creation fails."""
+    client = _clients.get(name)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(name)
+            if client is None:
+                try:
+                    client = factory()
+                except Exception as e:
+                    print(f"Error initializing {name}: {e}")
+                    return None
+                _clients[name] = client
+    return client
+
+def get_embeddings(spec=None):
+    """Embeddings for a "provider:model" spec (see llm_providers.py); defaults to EMBEDDING_MODEL for new PDFs."""
+    spec = spec or Config.EMBEDDING_MODEL
+    def create():
+        # Retries, deadline and circuit breaker come from resilience.py, not the client. The same
+        # object is returned on every call, which lets vector_store reuse collection handles.
+        embeddings = create_embeddings(spec, timeout=get_policy("embedding").attempt_timeout, max_retries=0)
+        return traced_embeddings(resilient_embeddings(embeddings, spec))
+    return _get_client(f"Embeddings ({spec})", create)
+
+class Route:
+    """A routing decision: the backend ("provider:model", see llm_providers.py) and parameters for one call."""
+
+    def __init__(self, task, name, spec, **params):
+        self.task = task # Also the resilience policy
+        self.name = name
+        self.spec = spec
+        self.params = params
+
+    @property
+    def model(self):
+        return model_name(self.spec)
+
+def route_llm(task, prompt_tokens=0, document_kind=None, user_tier="standard"):
+    """
+    Picks the model for a call:
+      chat  - questions whose text and history fit in LLM_ROUTE_SHORT_CHAT_TOKENS are lookups and go to
+              LLM_CHAT_FAST with a low temperature and a capped answer; longer conversations go to LLM_CHAT
+      draft - LLM_DRAFT_STRONG for 'pro' users, the kinds in LLM_ROUTE_STRONG_KINDS and prompts over
+              LLM_ROUTE_LONG_DRAFT_TOKENS; LLM_DRAFT otherwise
+      title - LLM_TITLE
+    Latency and estimated cost are recorded per route on /metrics (llm_route_*).
+    """
+    if task == "chat":
+        if prompt_tokens <= Config.LLM_ROUTE_SHORT_CHAT_TOKENS:
+            return Route("chat", "chat_short", Config.LLM_CHAT_FAST, temperature=0.2, max_tokens=400)
+        return Route("chat", "chat_long", Config.LLM_CHAT, temperature=0.7)
+    if task == "draft":
+        if (user_tier == "pro" or document_kind in Config.LLM_ROUTE_STRONG_KINDS
+                or prompt_tokens > Config.LLM_ROUTE_LONG_DRAFT_TOKENS):
+            return Route("draft", "draft_strong", Config.LLM_DRAFT_STRONG, temperature=0.7)
+        return Route("draft", "draft", Config.LLM_DRAFT, temperature=0.7)
+    return Route("title", "title", Config.LLM_TITLE, temperature=0.3, max_tokens=20)
+
+def get_llm(route):
+    """The shared chat model serving a route. Calls go through resilient_call, so the client does not retry."""
+    timeout = get_policy(route.task).attempt_timeout
+    return _get_client(f"LLM {route.name} ({route.spec})",
+                       lambda: create_chat_model(route.spec, timeout=timeout, max_retries=0, **route.params))
+
+def _user_tier(user_id):
+    # current_user is already in the session's identity map, so this does not query
+    user = User.query.get(user_id) if user_id is not None else None
+    return user.tier if user else "standard"
+
+@contextmanager
+def _record_route(route, meter):
+    """Times the enclosed call and records it, with the cost of the meter's tokens, under the route."""
+    started = time.perf_counter()
+    yield
+    record_llm_route(route.name, route.model, time.perf_counter() - started,
+                     estimate_cost(route.model, meter.input_tokens, meter.output_tokens))
 
 def get_pdf_hash(file_stream):
     """Calculates SHA256 hash of a file stream."""
@@ -35,32 +121,42 @@ def get_pdf_hash(file_stream):
     file_stream.seek(0)
     return sha256_hash.hexdigest()
 
+@traced("pdf.ingest")
 def process_and_store_pdf(pdf_file_path, user_id, original_filename, file_hash):
     """
     Processes a PDF file, extracts text, splits it, creates embeddings,
     and stores them in ChromaDB. Updates the PDFDocument record.
     """
+    embedding_spec = Config.EMBEDDING_MODEL
+    embeddings = get_embeddings(embedding_spec)
     if not embeddings:
         print("Embeddings model not initialized. Cannot process PDF.")
         return False, "Embeddings model not initialized."
 
     try:
-        loader = PyPDFLoader(pdf_file_path)
-        raw_documents = loader.load()
+        from langchain_community.document_loaders import PyPDFLoader
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+        with span("pdf.load") as load_span:
+            loader = PyPDFLoader(pdf_file_path)
+            raw_documents = loader.load()
+            load_span.set_attribute("pages", len(raw_documents))
 
         if not raw_documents:
             print(f"No documents could be loaded from {original_filename}.")
             return False, "PDF'den belge yüklenemedi."
 
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=4000, chunk_overlap=400)
+        text_splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP,
+                                                       add_start_index=True) # Offset in the page, for citations
         all_split_texts = []
         page_block_size = 100
 
         print(f"Processing PDF '{original_filename}' in blocks of {page_block_size} pages.")
-        for i in range(0, len(raw_documents), page_block_size):
-            page_block = raw_documents[i:i + page_block_size]
-            texts_from_block = text_splitter.split_documents(page_block)
-            all_split_texts.extend(texts_from_block)
+        with span("pdf.split") as split_span:
+            for i in range(0, len(raw_documents), page_block_size):
+                page_block = raw_documents[i:i + page_block_size]
+                texts_from_block = text_splitter.split_documents(page_block)
+                all_split_texts.extend(texts_from_block)
+            split_span.set_attribute("chunks", len(all_split_texts))
 
         if not all_split_texts:
             print(f"No text could be extracted and split from {original_filename} after processing all blocks.")
@@ -72,19 +168,23 @@ def process_and_store_pdf(pdf_file_path, user_id, original_filename, file_hash):
 
         collection_name = f"user_{user_id}_pdf_{pdf_doc_record.id}"
 
-        if not os.path.exists(Config.CHROMA_DB_PATH):
-            os.makedirs(Config.CHROMA_DB_PATH)
+        def metered_batch(batch):
+            # Metered per batch: a call slot is held for one batch at a time, and a large PDF is
+            # charged as it goes rather than checked against the daily budget all at once
+            return metered_call(user_id, "embedding", [doc.page_content for doc in batch],
+                                model=model_name(embedding_spec), rate_limited=False)
 
-        vector_store = Chroma.from_documents(
-            documents=all_split_texts,
-            embedding=embeddings,
-            persist_directory=Config.CHROMA_DB_PATH,
-            collection_name=collection_name
-        )
-        vector_store.persist()
+        # The embed steps are child spans of pdf.index; the rest of pdf.index is Chroma's writes
+        with llm_call("process_and_store_pdf", kind="embedding"), span("pdf.index", embedding_model=embedding_spec):
+            vector_store.add_documents(collection_name, embeddings, all_split_texts,
+                                       collection_metadata={"embedding_model": embedding_spec},
+                                       batch_context=metered_batch)
 
+        with span("pdf.page_index"):
+            save_page_index(pdf_doc_record, raw_documents)
         pdf_doc_record.processed = True
         pdf_doc_record.vector_db_collection_name = collection_name
+        pdf_doc_record.embedding_model = embedding_spec # Queries must use the same model
         db.session.commit()
 
         return True, f"PDF '{original_filename}' başarıyla işlendi ve vektör veritabanına kaydedildi."
@@ -93,29 +193,55 @@ def process_and_store_pdf(pdf_file_path, user_id, original_filename, file_hash):
         print(f"Error processing PDF {original_filename}: {e}")
         return False, f"PDF işlenirken bir hata oluştu: {e}"
 
-def get_qa_chain(user_id, pdf_document_id):
-    if not embeddings or not llm:
+def save_page_index(pdf_doc, pages):
+    """Stores the text of each loaded page (PyPDFLoader documents) as PDFPage rows; the caller commits."""
+    PDFPage.query.filter_by(pdf_document_id=pdf_doc.id).delete()
+    db.session.add_all(PDFPage(pdf_document_id=pdf_doc.id, page_number=page.metadata.get("page", i) + 1,
+                               text=page.page_content) for i, page in enumerate(pages))
+
+def get_page_text(pdf_doc, page_number):
+    """Text of a page from the page index, built from the file for PDFs ingested before it existed."""
+    page = PDFPage.query.filter_by(pdf_document_id=pdf_doc.id, page_number=page_number).first()
+    if page is not None:
+        return page.text
+    if PDFPage.query.filter_by(pdf_document_id=pdf_doc.id).first() is not None or not os.path.exists(pdf_doc.filepath):
         return None
+    from langchain_community.document_loaders import PyPDFLoader
+    pages = PyPDFLoader(pdf_doc.filepath).load()
+    save_page_index(pdf_doc, pages)
+    db.session.commit()
+    return next((p.page_content for i, p in enumerate(pages) if p.metadata.get("page", i) + 1 == page_number), None)
+
+def answer_sources(documents):
+    """Citations of the chunks an answer used: 1-based page and character range within the page text."""
+    sources, seen = [], set()
+    for document in documents:
+        page = document.metadata.get("page")
+        start = document.metadata.get("start_index") # Missing for PDFs ingested before offsets were kept
+        source = {"page": page + 1 if page is not None else None, "start": start,
+                  "end": start + len(document.page_content) if start is not None else None}
+        key = (source["page"], source["start"])
+        if key not in seen:
+            seen.add(key)
+            sources.append(source)
+    return sources
+
+def get_qa_chain(user_id, pdf_document_id, route=None):
     pdf_doc = PDFDocument.query.filter_by(id=pdf_document_id, user_id=user_id).first()
     if not pdf_doc or not pdf_doc.processed or not pdf_doc.vector_db_collection_name:
         return None
+    embeddings = get_embeddings(pdf_doc.embedding_model or LEGACY_EMBEDDING_SPEC)
+    llm = get_llm(route or route_llm("chat"))
+    if not embeddings or not llm:
+        return None
     try:
-        vector_store = Chroma(
-            persist_directory=Config.CHROMA_DB_PATH,
-            embedding_function=embeddings,
-            collection_name=pdf_doc.vector_db_collection_name
-        )
-        retriever = vector_store.as_retriever(search_kwargs={"k": 3})
+        from langchain.chains import ConversationalRetrievalChain
+        with span("chroma.open"):
+            store = vector_store.get_store(pdf_doc.vector_db_collection_name, embeddings)
+        # Many candidates, cross-encoder re-ranking and a context token budget (see retrieval.py)
+        retriever = reranking_retriever(store)
         from langchain.prompts import PromptTemplate
-        prompt_template = """Aşağıdaki bağlamı kullanarak son kullanıcı sorusuna cevap ver. Eğer cevabı bilmiyorsan, bilmediğini söyle, cevap uydurmaya çalışma. Cevabını mümkün olduğunca kısa ve öz tut.
-
-                **Bağlam**:
-                {context}
-
-                **Soru**: {question}
-
-                Yardımcı Cevap:"""
-        QA_PROMPT = PromptTemplate(template=prompt_template, input_variables=["context", "question"])
+        QA_PROMPT = PromptTemplate(template=QA_PROMPT_TEMPLATE, input_variables=["context", "question"])
         qa_chain = ConversationalRetrievalChain.from_llm(
             llm=llm,
             retriever=retriever,
@@ -128,76 +254,134 @@ def get_qa_chain(user_id, pdf_document_id):
         print(f"Error creating QA chain for PDF {pdf_document_id}: {e}")
         return None
 
+@traced("chat.answer")
 def ask_question_on_pdf(user_id, pdf_document_id, question, chat_history=None):
+    """Returns (answer, updated chat history, sources); see answer_sources for the sources."""
     if chat_history is None: chat_history = []
-    qa_chain = get_qa_chain(user_id, pdf_document_id)
+    # Routing and the quota estimate use the question and history; the callback then counts the
+    # real prompts (history, retrieved chunks) and answers of every LLM call in the chain
+    history_texts = [text for pair in chat_history for text in pair]
+    prompt_tokens = count_tokens([question] + history_texts)
+    route = route_llm("chat", prompt_tokens, user_tier=_user_tier(user_id))
+    current_span().set_attribute("route", route.name)
+    qa_chain = get_qa_chain(user_id, pdf_document_id, route)
     if not qa_chain:
-        return "Üzgünüm, bu belge için soru cevaplama sistemi şu anda kullanılamıyor.", chat_history
+        return "Üzgünüm, bu belge için soru cevaplama sistemi şu anda kullanılamıyor.", chat_history, []
     try:
-        result = qa_chain.invoke({"question": question, "chat_history": chat_history})
+        # Covers the question-condensing call, retrieval (query embedding) and the answer
+        with metered_call(user_id, "chat", extra_input_tokens=prompt_tokens, model=route.model,
+                          counted_by_callback=True) as meter, \
+                llm_call("ask_question_on_pdf") as call, _record_route(route, meter):
+            trace_callbacks = [langchain_callback()] if current_span().sampled else [] # Condense, retrieval, generation spans
+
+            def attempt():
+                # Retries and the hedged second chain (see resilience.py) each count into their own
+                # meter, so only the attempt whose answer is used is charged and recorded
+                attempt_meter, attempt_call = Meter(route.model, 0), LLMCall(call.function, call.kind)
+                result = qa_chain.invoke({"question": question, "chat_history": chat_history}, config={
+                    "callbacks": [attempt_call.callback(), attempt_meter.callback()] + trace_callbacks})
+                return result, attempt_meter, attempt_call
+
+            result, attempt_meter, attempt_call = resilient_call(route.spec, "chat", attempt)
+            meter.input_tokens += attempt_meter.input_tokens
+            meter.output_tokens += attempt_meter.output_tokens
+            call.add_tokens(attempt_call.input_tokens, attempt_call.output_tokens)
         answer = result.get("answer", "Cevap alınırken bir sorun oluştu.")
         updated_chat_history = chat_history + [(question, answer)]
-        return answer, updated_chat_history
+        return answer, updated_chat_history, answer_sources(result.get("source_documents") or [])
+    except (QuotaExceededError, LLMBusyError):
+        raise # Shown to the user by the route instead of being saved as an answer
     except Exception as e:
         print(f"Error during Conversational QA chain invocation: {e}")
-        return f"Soruya cevap verilirken bir hata oluştu: {e}", chat_history
+        return f"Soruya cevap verilirken bir hata oluştu: {e}", chat_history, []
 
-def generate_chat_title_with_groq(first_message_content):
-    if not Config.GROQ_API_KEY:
+@traced("chat.title")
+def generate_chat_title(first_message_content, user_id=None):
+    # Runs on the LLM_TITLE backend (Groq by default)
+    route = route_llm("title")
+    if not is_configured(route.spec):
         return "Sohbet Başlığı"
     try:
-        client = Groq(api_key=Config.GROQ_API_KEY)
-        chat_completion = client.chat.completions.create(
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant that generates a very short, concise title (3-7 words) for a given user query or statement. The title should capture the main topic of the query. Respond only with the title itself, nothing else."},
-                {"role": "user", "content": f"Generate a short title for this query: \"{first_message_content}\""}
-            ],
-            model="llama3-8b-8192", temperature=0.3, max_tokens=20, top_p=1, stream=False
-        )
-        title = chat_completion.choices[0].message.content.strip()
+        from langchain_core.messages import HumanMessage, SystemMessage
+        llm = get_llm(route)
+        if not llm:
+            return "Sohbet Başlığı"
+        messages = [
+            SystemMessage(content="You are a helpful assistant that generates a very short, concise title (3-7 words) for a given user query or statement. The title should capture the main topic of the query. Respond only with the title itself, nothing else."),
+            HumanMessage(content=f"Generate a short title for this query: \"{first_message_content}\"")
+        ]
+        with metered_call(user_id, "chat_title", [m.content for m in messages], model=route.model) as meter, \
+                llm_call("generate_chat_title") as call, span("llm.generate", route=route.name), \
+                _record_route(route, meter):
+            response = resilient_call(route.spec, "title", lambda: llm.invoke(messages))
+            call.record_usage(response)
+            meter.add_output(response.content)
+        title = response.content.strip()
         if title.startswith('"') and title.endswith('"'): title = title[1:-1]
         if title.startswith("'") and title.endswith("'"): title = title[1:-1]
         return title if title else "Sohbet Başlığı"
     except Exception as e:
-        print(f"Error generating chat title with Groq: {e}")
+        print(f"Error generating chat title: {e}")
         return "Sohbet Başlığı"
 
-def html_to_text(html_content):
-    """Basic HTML to text conversion."""
-    if not html_content:
-        return ""
-    text = html_content
-    text = re.sub(r'<style[^>]*?>.*?</style>', '', text, flags=re.DOTALL | re.IGNORECASE) # Remove style blocks
-    text = re.sub(r'<script[^>]*?>.*?</script>', '', text, flags=re.DOTALL | re.IGNORECASE) # Remove script blocks
-    text = re.sub(r'<h1>(.*?)</h1>', r'\1\n\n', text, flags=re.IGNORECASE)
-    text = re.sub(r'<h2>(.*?)</h2>', r'\1\n\n', text, flags=re.IGNORECASE)
-    text = re.sub(r'<h3>(.*?)</h3>', r'\1\n', text, flags=re.IGNORECASE)
-    text = re.sub(r'</p>\s*<p>', '\n\n', text, flags=re.IGNORECASE) # Handle paragraph spacing
-    text = re.sub(r'<p>', '', text, flags=re.IGNORECASE)
-    text = re.sub(r'</p>', '\n', text, flags=re.IGNORECASE)
-    text = re.sub(r'<br\s*/?>', '\n', text, flags=re.IGNORECASE)
-    text = re.sub(r'<li>', '\n- ', text, flags=re.IGNORECASE)
-    text = re.sub(r'<[^>]+>', ' ', text) # Remove all other tags, replace with space
-    text = re.sub(r'\n\s*\n', '\n\n', text) # Consolidate multiple newlines
-    text = text.replace('&nbsp;', ' ')
-    text = text.replace('&', '&')
-    text = text.replace('<', '<')
-    text = text.replace('>', '>')
-    text = text.replace('"', '"')
-    text = text.replace('&#39;', "'")
-    return text.strip()
-
-def generate_contract_with_ai(contract_type_name, form_inputs_dict, custom_prompt_text):
+CONTRACT_DISCLAIMER_TEXT = (
+    "İşbu sözleşme taslağı yapay zeka tarafından oluşturulmuştur ve yalnızca bir örnek teşkil eder. "
+    "Hukuki geçerliliği ve özel durumunuza uygunluğu için mutlaka bir hukuk danışmanına başvurunuz. "
+    "Oluşturulan metin üzerinde değişiklik yapabilir ve ihtiyaçlarınıza göre uyarlayabilirsiniz."
+)
+
+def render_contract_boilerplate(contract_type_name, parties):
+    """
+    Renders the static parts of a contract (title, parties, notice addresses, jurisdiction,
+    signature blocks and disclaimer) directly from the form inputs.
+    Returns (header_html, footer_html) to be placed around the LLM-generated clauses.
+    """
+    party_items = "\n".join(
+        f"<li><strong>{html.escape(role)}:</strong> {html.escape(str(value or '................'))}</li>"
+        for role, value in parties
+    )
+    header_html = (
+        f"<h1>{html.escape(contract_type_name)}</h1>\n"
+        "<h2>1. Taraflar</h2>\n"
+        "<p>İşbu sözleşme aşağıda bilgileri yazılı taraflar arasında, aşağıdaki şartlarla akdedilmiştir.</p>\n"
+        f"<ul>\n{party_items}\n</ul>"
+    )
+
+    signature_cells = "".join(
+        f"<td><p><strong>{html.escape(role)}</strong></p>"
+        f"<p>{html.escape(str(value or ''))}</p>"
+        "<p>İmza: ........................</p></td>"
+        for role, value in parties
+    )
+    footer_html = (
+        "<h2>Tebligat Adresleri</h2>\n"
+        "<p>Taraflar, işbu sözleşmede ve kimlik bilgilerinde yazılı adreslerin yasal tebligat adresleri "
+        "olduğunu, adres değişikliklerini karşı tarafa yazılı olarak bildirmedikçe bu adreslere yapılacak "
+        "tebligatların geçerli sayılacağını kabul ederler.</p>\n"
+        "<h2>Uygulanacak Hukuk ve Yetkili Mahkeme</h2>\n"
+        "<p>İşbu sözleşmeye Türk hukuku uygulanır. Sözleşmeden doğabilecek uyuşmazlıkların çözümünde "
+        "................ Mahkemeleri ve İcra Daireleri yetkilidir.</p>\n"
+        "<h2>İmzalar</h2>\n"
+        "<p>İşbu sözleşme taraflarca okunarak ..../..../........ tarihinde imza altına alınmıştır.</p>\n"
+        f"<table><tr>{signature_cells}</tr></table>\n"
+        f"<hr><p><em>{CONTRACT_DISCLAIMER_TEXT}</em></p>"
+    )
+    return header_html, footer_html
+
+@traced("contract.generate")
+def generate_contract_with_ai(contract_type_name, form_inputs_dict, custom_prompt_text, parties=None, user_id=None,
+                              document_kind=None):
     """
     Generates contract content using an LLM based on type, inputs, and custom prompts.
+    If `parties` ([(role, value), ...]) is given and template fill is enabled, the boilerplate
+    sections are rendered from templates and the LLM only writes the variable clauses.
+    Tokens are charged to `user_id` (see usage.py); QuotaExceededError/LLMBusyError propagate.
+    `document_kind` (the contract type key) and the prompt size pick the model (see route_llm).
     Returns HTML and plain text versions.
     """
-    if not llm:
-        print("LLM not initialized. Cannot generate contract.")
-        error_html = "<p>Yapay zeka modeli başlatılamadığı için sözleşme oluşturulamadı. Lütfen sistem yöneticisine başvurun.</p>"
-        return error_html, "Yapay zeka modeli başlatılamadığı için sözleşme oluşturulamadı."
+    template_fill = bool(parties) and Config.CONTRACT_TEMPLATE_FILL
 
-    print(f"AI: Generating contract for '{contract_type_name}'")
+    print(f"AI: Generating contract for '{contract_type_name}' (template fill: {template_fill})")
     print(f"Form Inputs: {form_inputs_dict}")
     if custom_prompt_text:
         print(f"Custom Prompt: {custom_prompt_text}")
@@ -208,9 +392,12 @@ def generate_contract_with_ai(contract_type_name, form_inputs_dict, custom_promp
         "Sözleşme metnini HTML formatında, iyi yapılandırılmış ve okunabilir bir şekilde sunmalısın. "
         "HTML içeriği başlıklar (örn: <h1>, <h2>), paragraflar (<p>), listeler (<ul>, <ol>, <li>) ve "
         "metin biçimlendirmesi (<strong>, <em>) gibi temel HTML etiketlerini kullanmalıdır. "
-        "Sözleşmenin sonuna, bunun yapay zeka tarafından oluşturulmuş bir taslak olduğu ve bir hukuk uzmanı "
-        "tarafından incelenmesi gerektiğine dair bir feragatname eklemeyi unutma."
     )
+    if not template_fill:
+        system_prompt += (
+            "Sözleşmenin sonuna, bunun yapay zeka tarafından oluşturulmuş bir taslak olduğu ve bir hukuk uzmanı "
+            "tarafından incelenmesi gerektiğine dair bir feragatname eklemeyi unutma."
+        )
 
     formatted_inputs = "\n".join([f"- {key.replace('_', ' ').title()}: {value}" for key, value in form_inputs_dict.items()])
 
@@ -223,39 +410,61 @@ def generate_contract_with_ai(contract_type_name, form_inputs_dict, custom_promp
     if custom_prompt_text:
         user_prompt_content += f"**Ek Notlar / Özel İstekler:**\n{custom_prompt_text}\n\n"
 
-    user_prompt_content += (
-        "Lütfen sözleşmeyi Türkçe olarak, HTML formatında oluşturun. "
-        "Genel Türk hukuk kurallarına ve belirtilen sözleşme türü için yaygın maddelere (tarafların tam unvan ve adresleri, sözleşmenin konusu, "
-        "temel hak ve yükümlülükler, bedel (varsa), süre, fesih şartları, tebligat adresleri, yetkili mahkeme ve uygulanacak hukuk gibi) uyun. "
-        "Taraflar için imza alanları ekleyin. "
-        "Son olarak, sözleşmenin altına şu feragatnameyi ekleyin: "
-        "'İşbu sözleşme taslağı yapay zeka tarafından oluşturulmuştur ve yalnızca bir örnek teşkil eder. "
-        "Hukuki geçerliliği ve özel durumunuza uygunluğu için mutlaka bir hukuk danışmanına başvurunuz. "
-        "Oluşturulan metin üzerinde değişiklik yapabilir ve ihtiyaçlarınıza göre uyarlayabilirsiniz.'"
-    )
+    if template_fill:
+        user_prompt_content += (
+            "Lütfen yalnızca sözleşmenin değişken maddelerini Türkçe olarak, HTML formatında oluşturun: "
+            "sözleşmenin konusu, temel hak ve yükümlülükler, bedel ve ödeme (varsa), süre, fesih şartları ve "
+            "bu sözleşme türüne özgü diğer maddeler. Her madde için <h2> başlığı kullanın ve numaralandırmaya "
+            "'2.' ile başlayın. Sözleşme başlığını (<h1>), taraflar bölümünü, tebligat adreslerini, yetkili mahkeme "
+            "ve uygulanacak hukuk maddesini, imza alanlarını ve feragatnameyi EKLEMEYİN; bunlar ayrıca eklenecektir."
+        )
+    else:
+        user_prompt_content += (
+            "Lütfen sözleşmeyi Türkçe olarak, HTML formatında oluşturun. "
+            "Genel Türk hukuk kurallarına ve belirtilen sözleşme türü için yaygın maddelere (tarafların tam unvan ve adresleri, sözleşmenin konusu, "
+            "temel hak ve yükümlülükler, bedel (varsa), süre, fesih şartları, tebligat adresleri, yetkili mahkeme ve uygulanacak hukuk gibi) uyun. "
+            "Taraflar için imza alanları ekleyin. "
+            "Son olarak, sözleşmenin altına şu feragatnameyi ekleyin: "
+            f"'{CONTRACT_DISCLAIMER_TEXT}'"
+        )
     
     print(f"--- AI Prompt for Contract Generation ---")
     print(f"System: {system_prompt}")
     print(f"User: {user_prompt_content}")
     print(f"--- End AI Prompt ---")
 
+    prompt_tokens = count_tokens([system_prompt, user_prompt_content])
+    route = route_llm("draft", prompt_tokens, document_kind, _user_tier(user_id))
+    current_span().set_attribute("route", route.name)
+    llm = get_llm(route)
+    if not llm:
+        print("LLM not initialized. Cannot generate contract.")
+        error_html = "<p>Yapay zeka modeli başlatılamadığı için sözleşme oluşturulamadı. Lütfen sistem yöneticisine başvurun.</p>"
+        return error_html, "Yapay zeka modeli başlatılamadığı için sözleşme oluşturulamadı."
+
     try:
+        from langchain_core.messages import HumanMessage, SystemMessage
         messages = [
             SystemMessage(content=system_prompt),
             HumanMessage(content=user_prompt_content)
         ]
-        response = llm.invoke(messages)
+        with metered_call(user_id, "contract", extra_input_tokens=prompt_tokens, model=route.model) as meter, \
+                llm_call("generate_contract_with_ai") as call, span("llm.generate", route=route.name), _record_route(route, meter):
+            response = resilient_call(route.spec, "draft", lambda: llm.invoke(messages))
+            call.record_usage(response)
+            meter.add_output(response.content)
         html_content = response.content
 
+        if template_fill:
+            header_html, footer_html = render_contract_boilerplate(contract_type_name, parties)
+            html_content = f"{header_html}\n{html_content}\n{footer_html}"
         # Basic check if LLM returned something that looks like HTML
-        if not ("<html" in html_content.lower() or "<body" in html_content.lower() or "<p>" in html_content.lower() or "<h1>" in html_content.lower()):
+        elif not ("<html" in html_content.lower() or "<body" in html_content.lower() or "<p>" in html_content.lower() or "<h1>" in html_content.lower()):
             # If not, wrap it in basic HTML structure
             print("AI response doesn't look like full HTML, wrapping it.")
             wrapped_html = f"<h1>{contract_type_name}</h1>\n{html_content}"
             # Ensure the disclaimer is present
-            disclaimer = ("<hr><p><em>İşbu sözleşme taslağı yapay zeka tarafından oluşturulmuştur ve yalnızca bir örnek teşkil eder. "
-                          "Hukuki geçerliliği ve özel durumunuza uygunluğu için mutlaka bir hukuk danışmanına başvurunuz. "
-                          "Oluşturulan metin üzerinde değişiklik yapabilir ve ihtiyaçlarınıza göre uyarlayabilirsiniz.</em></p>")
+            disclaimer = f"<hr><p><em>{CONTRACT_DISCLAIMER_TEXT}</em></p>"
             if "hukuk danışmanına başvurunuz" not in html_content:
                  wrapped_html += f"\n{disclaimer}"
             html_content = wrapped_html
@@ -268,6 +477,8 @@ def generate_contract_with_ai(contract_type_name, form_inputs_dict, custom_promp
 
         return html_content, text_content
 
+    except (QuotaExceededError, LLMBusyError):
+        raise # Nothing was generated; the route tells the user to retry later
     except Exception as e:
         print(f"Error during LLM call for contract generation: {e}")
         error_html = (f"<h1>{contract_type_name} - Hata</h1>"
@@ -278,16 +489,12 @@ def generate_contract_with_ai(contract_type_name, form_inputs_dict, custom_promp
                       "Lütfen daha sonra tekrar deneyin veya sistem yöneticisine başvurun.")
         return error_html, error_text
 
-def generate_dilekce_with_ai(dilekce_type_name, form_inputs_dict, custom_prompt_text=""):
+@traced("dilekce.generate")
+def generate_dilekce_with_ai(dilekce_type_name, form_inputs_dict, custom_prompt_text="", user_id=None):
     """
     Generates dilekce content using an LLM based on type, inputs, and custom prompts.
     Returns HTML and plain text versions.
     """
-    if not llm:
-        print("LLM not initialized. Cannot generate dilekce.")
-        error_html = "<p>Yapay zeka modeli başlatılamadığı için dilekçe oluşturulamadı. Lütfen sistem yöneticisine başvurun.</p>"
-        return error_html, "Yapay zeka modeli başlatılamadığı için dilekçe oluşturulamadı."
-
     print(f"AI: Generating dilekce for '{dilekce_type_name}'")
     print(f"Form Inputs: {form_inputs_dict}")
     if custom_prompt_text:
@@ -341,12 +548,26 @@ def generate_dilekce_with_ai(dilekce_type_name, form_inputs_dict, custom_prompt_
     print(f"User: {user_prompt_content}")
     print(f"--- End AI Prompt ---")
 
+    prompt_tokens = count_tokens([system_prompt, user_prompt_content])
+    route = route_llm("draft", prompt_tokens, dilekce_type_name, _user_tier(user_id))
+    current_span().set_attribute("route", route.name)
+    llm = get_llm(route)
+    if not llm:
+        print("LLM not initialized. Cannot generate dilekce.")
+        error_html = "<p>Yapay zeka modeli başlatılamadığı için dilekçe oluşturulamadı. Lütfen sistem yöneticisine başvurun.</p>"
+        return error_html, "Yapay zeka modeli başlatılamadığı için dilekçe oluşturulamadı."
+
     try:
+        from langchain_core.messages import HumanMessage, SystemMessage
         messages = [
             SystemMessage(content=system_prompt),
             HumanMessage(content=user_prompt_content)
         ]
-        response = llm.invoke(messages)
+        with metered_call(user_id, "dilekce", extra_input_tokens=prompt_tokens, model=route.model) as meter, \
+                llm_call("generate_dilekce_with_ai") as call, span("llm.generate", route=route.name), _record_route(route, meter):
+            response = resilient_call(route.spec, "draft", lambda: llm.invoke(messages))
+            call.record_usage(response)
+            meter.add_output(response.content)
         html_content = response.content
 
         # Basic check if LLM returned something that looks like HTML
@@ -367,6 +588,8 @@ def generate_dilekce_with_ai(dilekce_type_name, form_inputs_dict, custom_prompt_
 
         return html_content, text_content
 
+    except (QuotaExceededError, LLMBusyError):
+        raise # Nothing was generated; the route tells the user to retry later
     except Exception as e:
         print(f"Error during LLM call for dilekce generation: {e}")
         error_html = (f"<h1>{readable_dilekce_type_name} - Hata</h1>"
@@ -377,16 +600,12 @@ def generate_dilekce_with_ai(dilekce_type_name, form_inputs_dict, custom_prompt_
                       "Lütfen daha sonra tekrar deneyin veya sistem yöneticisine başvurun.")
         return error_html, error_text
 
-def generate_ifade_with_ai(ifade_type_name, form_inputs_dict, custom_prompt_text=""):
+@traced("ifade.generate")
+def generate_ifade_with_ai(ifade_type_name, form_inputs_dict, custom_prompt_text="", user_id=None, document_kind=None):
     """
     Generates ifade (statement) content using an LLM based on type, inputs, and custom prompts.
     Returns HTML and plain text versions.
     """
-    if not llm:
-        print("LLM not initialized. Cannot generate ifade.")
-        error_html = "<p>Yapay zeka modeli başlatılamadığı için ifade oluşturulamadı. Lütfen sistem yöneticisine başvurun.</p>"
-        return error_html, "Yapay zeka modeli başlatılamadığı için ifade oluşturulamadı."
-
     print(f"AI: Generating ifade for '{ifade_type_name}'")
     print(f"Form Inputs: {form_inputs_dict}")
     if custom_prompt_text:
@@ -438,12 +657,26 @@ def generate_ifade_with_ai(ifade_type_name, form_inputs_dict, custom_prompt_text
     print(f"User: {user_prompt_content}")
     print(f"--- End AI Prompt ---")
 
+    prompt_tokens = count_tokens([system_prompt, user_prompt_content])
+    route = route_llm("draft", prompt_tokens, document_kind, _user_tier(user_id))
+    current_span().set_attribute("route", route.name)
+    llm = get_llm(route)
+    if not llm:
+        print("LLM not initialized. Cannot generate ifade.")
+        error_html = "<p>Yapay zeka modeli başlatılamadığı için ifade oluşturulamadı. Lütfen sistem yöneticisine başvurun.</p>"
+        return error_html, "Yapay zeka modeli başlatılamadığı için ifade oluşturulamadı."
+
     try:
+        from langchain_core.messages import HumanMessage, SystemMessage
         messages = [
             SystemMessage(content=system_prompt),
             HumanMessage(content=user_prompt_content)
         ]
-        response = llm.invoke(messages)
+        with metered_call(user_id, "ifade", extra_input_tokens=prompt_tokens, model=route.model) as meter, \
+                llm_call("generate_ifade_with_ai") as call, span("llm.generate", route=route.name), _record_route(route, meter):
+            response = resilient_call(route.spec, "draft", lambda: llm.invoke(messages))
+            call.record_usage(response)
+            meter.add_output(response.content)
         html_content = response.content
 
         # Basic check if LLM returned something that looks like HTML
@@ -464,6 +697,8 @@ def generate_ifade_with_ai(ifade_type_name, form_inputs_dict, custom_prompt_text
 
         return html_content, text_content
 
+    except (QuotaExceededError, LLMBusyError):
+        raise # Nothing was generated; the route tells the user to retry later
     except Exception as e:
         print(f"Error during LLM call for ifade generation: {e}")
         error_html = (f"<h1>{readable_ifade_type_name} - Hata</h1>"
@@ -475,4 +710,23 @@ def generate_ifade_with_ai(ifade_type_name, form_inputs_dict, custom_prompt_text
         return error_html, error_text
 
 if __name__ == '__main__':
-    pass
+    # Benchmark: full LLM generation vs. template fill for the same contract.
+    # Usage: python ai.py  (requires OPENAI_API_KEY)
+    import tiktoken
+    encoding = tiktoken.get_encoding("cl100k_base")
+    sample_parties = [("İşveren", "ABC Yazılım A.Ş."), ("İşçi", "Ayşe Yılmaz")]
+    sample_inputs = {
+        "sirket_adi": "ABC Yazılım A.Ş.", "calisan_adi": "Ayşe Yılmaz", "pozisyon": "Yazılım Geliştirici",
+        "maas": "60000", "baslangic_tarihi": "2025-01-01", "sure": "Belirsiz süreli",
+    }
+    for mode_name, mode_parties in (("full", None), ("template_fill", sample_parties)):
+        started = time.perf_counter()
+        bench_html, _ = generate_contract_with_ai("İş Sözleşmesi", sample_inputs, "", parties=mode_parties)
+        elapsed = time.perf_counter() - started
+        if mode_parties:
+            header, footer = render_contract_boilerplate("İş Sözleşmesi", mode_parties)
+            generated_part = bench_html[len(header):len(bench_html) - len(footer)]
+        else:
+            generated_part = bench_html
+        print(f"[bench] {mode_name}: {elapsed:.2f}s, ~{len(encoding.encode(generated_part))} LLM output tokens, "
+              f"{len(bench_html)} chars total")
@@ -1,6 +1,7 @@
 import os
 import datetime # Added import for datetime
 import re # For nl2br filter
+import click # Options of the CLI commands
 from markupsafe import Markup, escape # For nl2br filter
 from flask import Flask, render_template # render_template for custom error pages
 from flask_login import LoginManager
@@ -20,6 +21,9 @@ from chat_routes import chat_bp
 from contract_routes import contract_bp # Import the new contract blueprint
 from dilekce_routes import dilekce_bp # Import the new dilekce blueprint
 from ifade_routes import ifade_bp # Import the new ifade blueprint
+from export_routes import export_bp # Shared PDF/DOCX/zip exports
+import metrics # Request/DB/LLM timings on /metrics
+import usage # Per-user token accounting
 
 # Initialize extensions (outside of create_app for global access if needed, or inside)
 login_manager = LoginManager()
@@ -36,21 +40,10 @@ def create_app(config_name=None):
         config_name = os.getenv('FLASK_ENV', 'default')
     app.config.from_object(get_config()) # Use selected config object
 
-    # Ensure the instance folder exists (Flask standard way)
-    # This is where app.db will be created by SQLAlchemy if it's configured to be there.
-    # Your SQLALCHEMY_DATABASE_URI in config.py already points to an absolute path
-    # project_root/instance/app.db, which is consistent with app.instance_path.
-    try:
-        if not os.path.exists(app.instance_path):
-            os.makedirs(app.instance_path)
-            print(f"Created instance folder at: {app.instance_path}")
-        else:
-            # This print is for confirmation, can be removed in production
-            print(f"Instance folder already exists at: {app.instance_path}")
-    except OSError as e:
-        # Log this error properly in a real application
-        print(f"Error creating instance folder {app.instance_path}: {e}")
-        # Depending on the app's needs, you might raise the error or handle it.
+    # create_app has no filesystem or schema side effects, so every worker boots the same way.
+    # The instance folder (where app.db lives), other data folders and the tables are set up
+    # once with `flask init-db` (or migrations); upload/vector/export folders are also created
+    # on first use.
 
     # Ensure SQLALCHEMY_DATABASE_URI is an absolute path if it's SQLite
     # This handles cases where DATABASE_URL in .env might be a relative SQLite path.
@@ -71,16 +64,6 @@ def create_app(config_name=None):
             # e.g., 'instance/site.db' becomes '/abs/path/to/project/instance/site.db'
             absolute_db_path = os.path.join(app.root_path, path_part)
             app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + absolute_db_path # Note: 4 slashes for absolute
-            print(f"App: Converted relative SQLite URI from .env to absolute: {app.config['SQLALCHEMY_DATABASE_URI']}")
-        elif path_part == ':memory:':
-            print(f"App: Using SQLite in-memory database: {db_uri}")
-        else:
-            # Path was already absolute (e.g. sqlite:////path/to/db)
-            print(f"App: Using already absolute SQLite URI: {db_uri}")
-    elif db_uri:
-        # For other database types like PostgreSQL, MySQL, etc.
-        print(f"App: Using non-SQLite DATABASE_URL: {db_uri}")
-
 
     # Initialize Flask extensions
     db.init_app(app)
@@ -105,6 +88,9 @@ def create_app(config_name=None):
     app.register_blueprint(contract_bp)  # Register the contract blueprint (prefix is in the blueprint)
     app.register_blueprint(dilekce_bp)   # Register the dilekce blueprint (prefix is in the blueprint)
     app.register_blueprint(ifade_bp)     # Register the ifade blueprint (prefix is in the blueprint)
+    app.register_blueprint(export_bp)    # Prefix is already in export_bp
+    metrics.init_app(app)                # Request timing hooks and the /metrics endpoint
+    usage.init_app(app)                  # Token usage rows of the request, saved when it ends
 
     # Context processors (can also be defined in blueprints if specific)
     @app.context_processor
@@ -124,18 +110,59 @@ def create_app(config_name=None):
         # Log the error e
         return render_template('errors/500.html', title="Sunucu Hatası"), 500
         
-    # Create database tables if they don't exist
-    # This is usually handled by migrations in a production app (Flask-Migrate)
-    # For simplicity in development, we can create them here.
-    with app.app_context():
-        # The instance folder should now reliably exist due to the code above
-        # and the code in config.py.
-        db.create_all() 
-        print(f"Database checked/created at: {app.config['SQLALCHEMY_DATABASE_URI']}")
+    # Explicit setup step, run once per deployment instead of on every worker boot:
+    # `flask init-db` creates the data folders and any missing tables, and marks a new database
+    # as up to date with the migrations. Schema changes on an existing database go through
+    # `flask db upgrade` (revisions in migrations/versions).
+    @app.cli.command('init-db')
+    def init_db_command():
+        for folder in (app.instance_path, app.config['UPLOAD_FOLDER'], app.config['CHROMA_DB_PATH'],
+                       app.config['EXPORT_CACHE_PATH']):
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+        is_new = not db.inspect(db.engine).get_table_names()
+        db.create_all()
+        if is_new: # create_all built the current schema, indexes included
+            from flask_migrate import stamp
+            stamp()
+        print(f"Database tables created or already exist at: {app.config['SQLALCHEMY_DATABASE_URI']}")
         # You might want to create a default admin user here for first run
         # from auth_routes import create_admin_user # If you have such a helper
         # create_admin_user(app)
 
+    # Query-plan regression check: `flask check-query-plans` exits non-zero if a hot query
+    # (see query_plans.hot_queries) would scan instead of using an index
+    @app.cli.command('check-query-plans')
+    def check_query_plans_command():
+        from query_plans import check_query_plans
+        failures = check_query_plans()
+        for name, plan in failures.items():
+            print(f"SCAN: {name}")
+            for line in plan:
+                print(f"    {line}")
+        if failures:
+            raise SystemExit(1)
+        print("All hot queries use an index.")
+
+    # Orphan vector collections and storage compaction: `flask vector-gc` (see vector_gc.py),
+    # e.g. nightly from cron; --dry-run only reports what would be dropped
+    @app.cli.command('vector-gc')
+    @click.option('--dry-run', is_flag=True, help="Report orphan collections without deleting them.")
+    @click.option('--batch-size', type=int, default=None, help="Collections deleted per batch.")
+    @click.option('--time-budget', type=float, default=None, help="Seconds after which no new batch starts.")
+    @click.option('--no-vacuum', is_flag=True, help="Skip compacting the on-disk store.")
+    def vector_gc_command(dry_run, batch_size, time_budget, no_vacuum):
+        from vector_gc import collect_garbage
+        report = collect_garbage(batch_size=batch_size, time_budget_seconds=time_budget,
+                                 dry_run=dry_run, vacuum=not no_vacuum)
+        print(f"Collections: {report['collections']}, orphans: {report['orphans']}, deleted: {report['deleted']}, "
+              f"failed: {report['failed']}, left for next run: {report['remaining']}"
+              + (" (dry run)" if dry_run else ""))
+        if report['reclaimed_bytes'] is not None:
+            print(f"Storage: {report['bytes_before'] / 1024 / 1024:.1f} MB -> {report['bytes_after'] / 1024 / 1024:.1f} MB, "
+                  f"reclaimed {report['reclaimed_bytes'] / 1024 / 1024:.1f} MB"
+                  + (" (compacted)" if report['compacted'] else ""))
+        print(f"Took {report['seconds']:.1f}s.")
 
     # Shell context for Flask CLI (flask shell)
     @app.shell_context_processor
@@ -1,10 +1,12 @@
 import uuid
 import datetime # Moved import to the top
-from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify
+from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, current_app, g, abort
+from sqlalchemy.orm import joinedload
 from flask_login import current_user, login_required
 from models import db, PDFDocument, ChatMessage, User, ChatSession # Added ChatSession
 from forms import ChatMessageForm
-from ai import ask_question_on_pdf, generate_chat_title_with_groq # Added Groq title generation
+from ai import ask_question_on_pdf, generate_chat_title, get_page_text
+from usage import QuotaExceededError, LLMBusyError
 
 chat_bp = Blueprint('chat', __name__, url_prefix='/chat', template_folder='templates')
 
@@ -13,9 +15,42 @@ chat_bp = Blueprint('chat', __name__, url_prefix='/chat', template_folder='templ
 def require_login():
     pass
 
+def _get_chat_context(pdf_id):
+    """
+    Loads the PDF together with the user's live chat sessions for it (newest first) in one
+    joined query, cached on g so every helper in the request reuses the same objects.
+    """
+    cache = g.setdefault('chat_contexts', {})
+    if pdf_id not in cache:
+        pdf = PDFDocument.query.options(
+            joinedload(PDFDocument.chat_sessions.and_(ChatSession.user_id == current_user.id,
+                                                      ChatSession.is_deleted == False))
+        ).filter_by(id=pdf_id, user_id=current_user.id, is_deleted=False).one_or_none()
+        if pdf is None:
+            abort(404)
+        sessions = sorted(pdf.chat_sessions, key=lambda s: s.updated_at, reverse=True)
+        cache[pdf_id] = (pdf, sessions)
+    return cache[pdf_id]
+
+
+def _find_session(sessions, session_uuid):
+    return next((s for s in sessions if s.session_uuid == session_uuid), None)
+
+
+def _live_messages(chat_session):
+    return ChatMessage.query.filter_by(
+        chat_session_id=chat_session.id,
+        is_deleted=False
+    ).order_by(ChatMessage.timestamp.asc()).all()
+
+
 @chat_bp.route('/pdf/<int:pdf_id>', methods=['GET', 'POST'])
 def chat_with_pdf(pdf_id):
-    pdf = PDFDocument.query.filter_by(id=pdf_id, user_id=current_user.id, is_deleted=False).first_or_404()
+    """
+    Chat page. A GET costs two queries: the PDF with its sessions, and the current session's
+    messages. Without a session_uuid the latest session is shown directly instead of redirecting.
+    """
+    pdf, all_chat_sessions = _get_chat_context(pdf_id)
     if not pdf.processed: # This check remains valid for non-deleted, but unprocessed PDFs
         flash(f"'{pdf.original_filename}' henüz işlenmedi. Lütfen daha sonra tekrar deneyin.", "warning")
         return redirect(url_for('dashboard.index'))
@@ -24,43 +59,29 @@ def chat_with_pdf(pdf_id):
     
     # session_uuid is the unique identifier for the chat session instance
     session_uuid = request.args.get('session_uuid')
-    chat_session = None
+    chat_session = _find_session(all_chat_sessions, session_uuid) if session_uuid else None
 
-    if session_uuid:
-        chat_session = ChatSession.query.filter_by(
-            session_uuid=session_uuid,
-            user_id=current_user.id,
-            pdf_document_id=pdf.id,
-            is_deleted=False
-        ).first()
-    
     if not chat_session and not session_uuid and request.method == 'GET':
-        # If no session_uuid is provided on GET, try to find the latest one or create a new one
-        latest_session = ChatSession.query.filter_by(
-            user_id=current_user.id,
-            pdf_document_id=pdf.id,
-            is_deleted=False
-        ).order_by(ChatSession.updated_at.desc()).first()
-        if latest_session:
-            return redirect(url_for('chat.chat_with_pdf', pdf_id=pdf.id, session_uuid=latest_session.session_uuid))
+        if all_chat_sessions:
+            chat_session = all_chat_sessions[0]
+            session_uuid = chat_session.session_uuid
         else:
             # No existing sessions, generate a new UUID for a potential new session
             # This new session will be created upon the first POST message
-            new_session_uuid = str(uuid.uuid4())
-            return redirect(url_for('chat.chat_with_pdf', pdf_id=pdf.id, session_uuid=new_session_uuid))
-
+            session_uuid = str(uuid.uuid4())
 
     if form.validate_on_submit() and request.method == 'POST':
         user_message_content = form.message.data
         
-        if not session_uuid: # Should not happen if redirected correctly
+        if not session_uuid: # The chat form always posts with a session_uuid
             flash("Sohbet oturumu bulunamadı.", "danger")
             return redirect(url_for('dashboard.index'))
 
         # Find or create ChatSession
+        session_created = not chat_session
         if not chat_session:
             # This is the first message for this session_uuid
-            session_title = generate_chat_title_with_groq(user_message_content)
+            session_title = generate_chat_title(user_message_content, user_id=current_user.id)
             chat_session = ChatSession(
                 session_uuid=session_uuid,
                 user_id=current_user.id,
@@ -76,6 +97,9 @@ def chat_with_pdf(pdf_id):
                 flash(f"Sohbet oturumu oluşturulurken hata: {e}", "danger")
                 return redirect(url_for('chat.chat_with_pdf', pdf_id=pdf.id, session_uuid=session_uuid))
         
+        # History for the chain, loaded before the new message is added
+        previous_messages = [] if session_created else _live_messages(chat_session)
+
         # Save user's message
         user_chat_message = ChatMessage(
             chat_session_id=chat_session.id,
@@ -86,13 +110,6 @@ def chat_with_pdf(pdf_id):
         )
         db.session.add(user_chat_message)
         
-        # Prepare chat history for the chain
-        # Fetch previous messages for this session to pass to the chain
-        previous_messages = ChatMessage.query.filter_by(
-            chat_session_id=chat_session.id,
-            is_deleted=False
-        ).order_by(ChatMessage.timestamp.asc()).all()
-
         chat_history_for_chain = []
         # Group messages by user and AI to form (user_q, ai_a) tuples
         # This assumes user messages are always followed by AI messages.
@@ -106,40 +123,44 @@ def chat_with_pdf(pdf_id):
                 temp_user_msg = None # Reset for the next pair
 
         # Call the updated ask_question_on_pdf function
-        ai_response_content, _ = ask_question_on_pdf(
-            current_user.id, 
-            pdf.id, 
-            user_message_content,
-            chat_history=chat_history_for_chain # Pass the formatted history
-        )
+        try:
+            ai_response_content, _, sources = ask_question_on_pdf(
+                current_user.id, 
+                pdf.id, 
+                user_message_content,
+                chat_history=chat_history_for_chain # Pass the formatted history
+            )
+        except (QuotaExceededError, LLMBusyError) as e:
+            db.session.rollback() # Not answered, so the question is not kept either
+            if _wants_json():
+                return jsonify({"status": "error", "errors": {"message": [str(e)]}}), 429
+            flash(str(e), "warning")
+            return redirect(url_for('chat.chat_with_pdf', pdf_id=pdf.id, session_uuid=chat_session.session_uuid))
         
         ai_chat_message = ChatMessage(
             chat_session_id=chat_session.id,
             user_id=current_user.id, # Or a system user ID
             pdf_document_id=pdf.id,
             sender_type='ai',
-            message_content=ai_response_content
+            message_content=ai_response_content,
+            sources=sources or None # Page citations shown under the answer
         )
         db.session.add(ai_chat_message)
         
         # Update session's updated_at timestamp
         chat_session.updated_at = datetime.datetime.utcnow()
         db.session.commit()
-        
+
+        if _wants_json():
+            # The chat page posts with fetch and appends the new messages via the history API
+            return jsonify({"status": "success", "session_uuid": chat_session.session_uuid,
+                            "session_created": session_created})
         return redirect(url_for('chat.chat_with_pdf', pdf_id=pdf.id, session_uuid=chat_session.session_uuid))
 
-    chat_history = []
-    if chat_session:
-        chat_history = ChatMessage.query.filter_by(
-            chat_session_id=chat_session.id,
-            is_deleted=False
-        ).order_by(ChatMessage.timestamp.asc()).all()
+    if request.method == 'POST' and _wants_json():
+        return jsonify({"status": "error", "errors": form.errors}), 400
 
-    all_chat_sessions = ChatSession.query.filter_by(
-        user_id=current_user.id,
-        pdf_document_id=pdf.id,
-        is_deleted=False
-    ).order_by(ChatSession.updated_at.desc()).all()
+    chat_history = _live_messages(chat_session) if chat_session else []
 
     return render_template('chat_interface.html',
                            title=f"Sohbet: {pdf.original_filename}",
@@ -147,34 +168,101 @@ def chat_with_pdf(pdf_id):
                            form=form,
                            chat_history=chat_history,
                            current_chat_session=chat_session, # Pass the whole session object
+                           session_uuid=session_uuid,
                            all_chat_sessions=all_chat_sessions)
 
 
 @chat_bp.route('/pdf/<int:pdf_id>/history', methods=['GET'])
 @login_required
 def get_chat_history_api(pdf_id):
-    """API endpoint to fetch chat history for a specific session_uuid."""
-    pdf = PDFDocument.query.filter_by(id=pdf_id, user_id=current_user.id, is_deleted=False).first_or_404()
+    """
+    API endpoint to fetch chat history for a specific session_uuid.
+    Pass after_id (last message id the client has) or since (ISO timestamp) to get only newer
+    messages, and compact=1 for [id, sender_type, message_content, timestamp] arrays instead of
+    objects (AI answers then also carry their page citations as a fifth element / "sources").
+    Responses carry an ETag; a matching If-None-Match gets a 304 without loading messages.
+    """
     session_uuid = request.args.get('session_uuid')
     if not session_uuid:
         return jsonify({"error": "Session UUID is required"}), 400
 
-    chat_session = ChatSession.query.filter_by(session_uuid=session_uuid, user_id=current_user.id, pdf_document_id=pdf.id, is_deleted=False).first()
+    after_id = request.args.get('after_id', type=int)
+    since = None
+    if request.args.get('since'):
+        try:
+            since = datetime.datetime.fromisoformat(request.args['since'].replace('Z', '+00:00'))
+        except ValueError:
+            return jsonify({"error": "since must be an ISO 8601 timestamp"}), 400
+        if since.tzinfo is not None: # Message timestamps are stored as naive UTC
+            since = since.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    compact = request.args.get('compact') == '1'
+
+    # Session lookup by its unique uuid, with the PDF ownership checks in the same query
+    chat_session = ChatSession.query.join(ChatSession.pdf_document).filter(
+        ChatSession.session_uuid == session_uuid,
+        ChatSession.user_id == current_user.id,
+        ChatSession.pdf_document_id == pdf_id,
+        ChatSession.is_deleted == False,
+        PDFDocument.user_id == current_user.id,
+        PDFDocument.is_deleted == False
+    ).first()
     if not chat_session:
         return jsonify({"error": "Chat session not found"}), 404
-        
-    chat_history = ChatMessage.query.filter_by(
-        chat_session_id=chat_session.id,
-        is_deleted=False 
-    ).order_by(ChatMessage.timestamp.asc()).all()
 
-    history_data = [{
+    # updated_at moves with every new message, so it versions the session's history
+    etag = f"{chat_session.id}-{chat_session.updated_at.timestamp():.6f}-{after_id}-{since}-{int(compact)}"
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+    else:
+        history_query = ChatMessage.query.filter_by(chat_session_id=chat_session.id, is_deleted=False)
+        if since is not None:
+            history_query = history_query.filter(ChatMessage.timestamp > since)
+        if after_id is not None:
+            # A range on the (chat_session_id, id) index, so a poll reads only the new messages.
+            # A session's messages are inserted in order, so id order is also time order.
+            history_query = history_query.filter(ChatMessage.id > after_id).order_by(ChatMessage.id.asc())
+        else:
+            history_query = history_query.order_by(ChatMessage.timestamp.asc(), ChatMessage.id.asc())
+        chat_history = history_query.all()
+        response = jsonify([_message_json(msg, compact) for msg in chat_history])
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache' # Revalidate with the ETag on every poll
+    return response
+
+
+def _message_json(msg, compact=False):
+    timestamp = msg.timestamp.isoformat()
+    if compact:
+        return [msg.id, msg.sender_type, msg.message_content, timestamp, msg.sources]
+    return {
+        "id": msg.id,
         "sender_type": msg.sender_type,
         "message_content": msg.message_content,
-        "timestamp": msg.timestamp.isoformat()
-    } for msg in chat_history]
-    
-    return jsonify(history_data)
+        "timestamp": timestamp,
+        "sources": msg.sources
+    }
+
+
+@chat_bp.route('/pdf/<int:pdf_id>/pages/<int:page_number>', methods=['GET'])
+@login_required
+def get_pdf_page_api(pdf_id, page_number):
+    """
+    Text of one PDF page from the page index, for showing an answer's source with its
+    start/end character range highlighted. Page text never changes, so browsers may cache it.
+    """
+    pdf = PDFDocument.query.filter_by(id=pdf_id, user_id=current_user.id, is_deleted=False).first()
+    if pdf is None:
+        return jsonify({"error": "PDF not found"}), 404
+    text = get_page_text(pdf, page_number)
+    if text is None:
+        return jsonify({"error": "Page not found"}), 404
+    response = jsonify({"page_number": page_number, "text": text})
+    response.headers['Cache-Control'] = 'private, max-age=86400'
+    return response
+
+
+def _wants_json():
+    return request.accept_mimetypes.best == 'application/json'
 
 # Route to start a new chat session (clears old one or generates new ID)
 @chat_bp.route('/pdf/<int:pdf_id>/new_session')
@@ -9,26 +9,132 @@ if os.path.exists(dotenv_path):
 else:
     print("Warning: .env file not found. Using default or environment-set configurations.")
 
+def engine_options(database_uri):
+    """SQLALCHEMY_ENGINE_OPTIONS for the given database; pool sizes are per worker process."""
+    if database_uri.startswith('sqlite'):
+        # Waiting on a lock is handled by the busy_timeout pragma (see models.py)
+        return {}
+    return {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+        'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 30)),
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)), # Seconds, below typical server/proxy idle timeouts
+        'pool_pre_ping': os.environ.get('DB_POOL_PRE_PING', 'true').lower() in ('1', 'true', 'yes'),
+    }
+
+
 class Config:
     """Base configuration."""
     SECRET_KEY = os.environ.get('FLASK_SECRET_KEY') or 'you-will-never-guess'
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
         'sqlite:///' + os.path.join(basedir, 'instance', 'app.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(SQLALCHEMY_DATABASE_URI)
+    # Applied to every SQLite connection: WAL lets readers run alongside the single writer,
+    # busy_timeout makes writers wait for the lock instead of failing with "database is locked"
+    SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+    SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 15000))
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL') # NORMAL is durable in WAL mode except on power loss
     OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY')
     GROQ_API_KEY = os.environ.get('GROQ_API_KEY')
     GEMINI_API_KEY  = os.environ.get('GEMINI_API_KEY')
+    # LLM backends as "provider:model"; providers are openai, groq and local (see llm_providers.py).
+    # ai.route_llm picks one per call from the task, prompt size, document kind and user tier
+    LLM_CHAT_FAST = os.environ.get('LLM_CHAT_FAST', 'openai:gpt-4.1-nano') # Short PDF chat questions
+    LLM_CHAT = os.environ.get('LLM_CHAT', 'openai:gpt-4.1-nano')   # Longer PDF chat conversations
+    LLM_DRAFT = os.environ.get('LLM_DRAFT', 'openai:gpt-4.1-nano') # Contract, dilekce and ifade drafts
+    LLM_DRAFT_STRONG = os.environ.get('LLM_DRAFT_STRONG', 'openai:gpt-4.1-mini') # Long/demanding drafts, 'pro' users
+    LLM_TITLE = os.environ.get('LLM_TITLE', 'groq:llama3-8b-8192') # Chat session titles
+    LLM_ROUTE_SHORT_CHAT_TOKENS = int(os.environ.get('LLM_ROUTE_SHORT_CHAT_TOKENS', 400)) # Question + history
+    LLM_ROUTE_LONG_DRAFT_TOKENS = int(os.environ.get('LLM_ROUTE_LONG_DRAFT_TOKENS', 1500)) # Draft prompt
+    LLM_ROUTE_STRONG_KINDS = tuple(kind.strip() for kind in os.environ.get(
+        'LLM_ROUTE_STRONG_KINDS', 'is_sozlesmesi,isyeri_kira_sozlesmesi,tasinmaz_satis_vaadi_sozlesmesi,supheli_ifadesi'
+    ).split(',') if kind.strip())
+    OPENAI_BASE_URL = os.environ.get('OPENAI_BASE_URL') # None: api.openai.com
+    GROQ_BASE_URL = os.environ.get('GROQ_BASE_URL', 'https://api.groq.com/openai/v1')
+    LOCAL_LLM_BASE_URL = os.environ.get('LOCAL_LLM_BASE_URL') # OpenAI-compatible server, e.g. http://127.0.0.1:8080/v1
+    LOCAL_LLM_API_KEY = os.environ.get('LOCAL_LLM_API_KEY')
+    LLM_HTTP_MAX_CONNECTIONS = int(os.environ.get('LLM_HTTP_MAX_CONNECTIONS', 20)) # Per provider and worker process
+    LLM_HTTP_KEEPALIVE_CONNECTIONS = int(os.environ.get('LLM_HTTP_KEEPALIVE_CONNECTIONS', 10))
+    LLM_HTTP_TIMEOUT_SECONDS = float(os.environ.get('LLM_HTTP_TIMEOUT_SECONDS', 120))
+    # Deadlines, retries, hedging and circuit breaking of AI calls (see resilience.py)
+    LLM_DEADLINE_CHAT_SECONDS = float(os.environ.get('LLM_DEADLINE_CHAT_SECONDS', 30))
+    LLM_DEADLINE_DRAFT_SECONDS = float(os.environ.get('LLM_DEADLINE_DRAFT_SECONDS', 120))
+    LLM_DEADLINE_TITLE_SECONDS = float(os.environ.get('LLM_DEADLINE_TITLE_SECONDS', 8))
+    EMBEDDING_DEADLINE_SECONDS = float(os.environ.get('EMBEDDING_DEADLINE_SECONDS', 60)) # Per embedding batch
+    LLM_HEDGE_AFTER_SECONDS = float(os.environ.get('LLM_HEDGE_AFTER_SECONDS', 6)) # Chat only; roughly the p95 latency
+    LLM_RETRY_BASE_SECONDS = float(os.environ.get('LLM_RETRY_BASE_SECONDS', 0.5))
+    LLM_RETRY_MAX_SECONDS = float(os.environ.get('LLM_RETRY_MAX_SECONDS', 8))
+    CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get('CIRCUIT_FAILURE_THRESHOLD', 5)) # Consecutive failures
+    CIRCUIT_RESET_SECONDS = float(os.environ.get('CIRCUIT_RESET_SECONDS', 30))
+    AI_CALL_THREADS = int(os.environ.get('AI_CALL_THREADS', 32)) # Per worker process
+
+    # Embedding model for new PDFs: openai:<model> or huggingface:<sentence-transformers model> (runs locally);
+    # a trailing @<dimensions> stores shorter vectors, e.g. openai:text-embedding-3-small@512
+    EMBEDDING_MODEL = os.environ.get('EMBEDDING_MODEL', 'openai:text-embedding-3-small')
+    LOCAL_EMBEDDING_BATCH_SIZE = int(os.environ.get('LOCAL_EMBEDDING_BATCH_SIZE', 64)) # Chunks per forward pass
+    LOCAL_EMBEDDING_THREADS = int(os.environ.get('LOCAL_EMBEDDING_THREADS', 0)) # CPU threads; 0 = library default
+    LOCAL_EMBEDDING_BACKEND = os.environ.get('LOCAL_EMBEDDING_BACKEND', 'torch') # torch or onnx
     UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER') or os.path.join(basedir, 'uploads')
     CHROMA_DB_PATH = os.environ.get('CHROMA_DB_PATH') or os.path.join(basedir, 'chroma_data')
+    # embedded: each worker opens CHROMA_DB_PATH; http: workers share a `chroma run` server
+    CHROMA_MODE = os.environ.get('CHROMA_MODE', 'embedded')
+    CHROMA_HOST = os.environ.get('CHROMA_HOST', '127.0.0.1')
+    CHROMA_PORT = int(os.environ.get('CHROMA_PORT', 8000))
+    CHROMA_SSL = os.environ.get('CHROMA_SSL', 'false').lower() in ('1', 'true', 'yes')
+    CHROMA_HANDLE_POOL_SIZE = int(os.environ.get('CHROMA_HANDLE_POOL_SIZE', 64)) # Open collection handles kept per worker
+    CHROMA_ADD_BATCH_SIZE = int(os.environ.get('CHROMA_ADD_BATCH_SIZE', 256)) # Chunks per embedding request and Chroma write
+    # PDF chat retrieval (retrieval.py): vector search candidates, cross-encoder re-ranking on the
+    # CPU (RERANK_MODEL empty = off), chunks kept and the token budget of the retrieved context
+    RETRIEVAL_CANDIDATES = int(os.environ.get('RETRIEVAL_CANDIDATES', 30))
+    RETRIEVAL_KEEP = int(os.environ.get('RETRIEVAL_KEEP', 4))
+    RETRIEVAL_CONTEXT_TOKENS = int(os.environ.get('RETRIEVAL_CONTEXT_TOKENS', 3000))
+    RERANK_MODEL = os.environ.get('RERANK_MODEL', 'cross-encoder/mmarco-mMiniLMv2-L12-H384-v1') # Multilingual, Turkish included
+    RERANK_BATCH_SIZE = int(os.environ.get('RERANK_BATCH_SIZE', 16)) # (question, chunk) pairs per forward pass
+    RERANK_MAX_LENGTH = int(os.environ.get('RERANK_MAX_LENGTH', 512)) # Tokens of each pair the cross-encoder reads
+    # flask vector-gc: orphan collections dropped per batch, run time limit, and how long a
+    # collection of a PDF still being ingested is protected
+    VECTOR_GC_BATCH_SIZE = int(os.environ.get('VECTOR_GC_BATCH_SIZE', 50))
+    VECTOR_GC_TIME_BUDGET_SECONDS = float(os.environ.get('VECTOR_GC_TIME_BUDGET_SECONDS', 600))
+    VECTOR_GC_GRACE_SECONDS = int(os.environ.get('VECTOR_GC_GRACE_SECONDS', 6 * 3600))
+    # Render parties, notice/jurisdiction clauses, signatures and disclaimer from templates
+    # and ask the LLM only for the variable clauses of a contract
+    CONTRACT_TEMPLATE_FILL = os.environ.get('CONTRACT_TEMPLATE_FILL', 'true').lower() in ('1', 'true', 'yes')
+
+    # Rendered PDF/DOCX exports are cached on disk, keyed by document id and content hash
+    EXPORT_CACHE_PATH = os.environ.get('EXPORT_CACHE_PATH') or os.path.join(basedir, 'export_cache')
+    EXPORT_CACHE_MAX_BYTES = int(os.environ.get('EXPORT_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+    EXPORT_EVICT_MIN_AGE_SECONDS = int(os.environ.get('EXPORT_EVICT_MIN_AGE_SECONDS', 300)) # Recently used files are kept while being served
+    EXPORT_ASYNC_THRESHOLD_CHARS = int(os.environ.get('EXPORT_ASYNC_THRESHOLD_CHARS', 50000)) # Larger documents render off the request thread
+    EXPORT_RENDER_WAIT_SECONDS = float(os.environ.get('EXPORT_RENDER_WAIT_SECONDS', 20))
+    EXPORT_RENDER_WORKERS = int(os.environ.get('EXPORT_RENDER_WORKERS', 2)) # Render processes per web worker
+    EXPORT_MAX_CONCURRENT_RENDERS = int(os.environ.get('EXPORT_MAX_CONCURRENT_RENDERS', 4))
+    EXPORT_QUEUE_WAIT_SECONDS = float(os.environ.get('EXPORT_QUEUE_WAIT_SECONDS', 5))
+    EXPORT_ZIP_MAX_DOCUMENTS = int(os.environ.get('EXPORT_ZIP_MAX_DOCUMENTS', 50))
+
+    LIST_PAGE_SIZE = int(os.environ.get('LIST_PAGE_SIZE', 25)) # Rows per page on hub/dashboard listings
+
+    # Prometheus metrics on /metrics, only answered with "Authorization: Bearer <METRICS_TOKEN>";
+    # without a token the endpoint is off (timings are still recorded)
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+    # AI pipeline tracing (see tracing.py): fraction of traces kept, and where they go
+    TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', 0.01))
+    TRACE_EXPORTERS = os.environ.get('TRACE_EXPORTERS', 'jsonl') # Comma separated: jsonl, otlp
+    TRACE_JSONL_PATH = os.environ.get('TRACE_JSONL_PATH') or os.path.join(basedir, 'instance', 'traces.jsonl')
+    TRACE_OTLP_ENDPOINT = os.environ.get('TRACE_OTLP_ENDPOINT') # e.g. http://localhost:4318/v1/traces
+    TRACE_OTLP_PATH = os.environ.get('TRACE_OTLP_PATH') or os.path.join(basedir, 'instance', 'traces.otlp.jsonl')
+
+    # Per-user LLM quotas and call scheduling (see usage.py); 0 disables a limit
+    USER_DAILY_TOKEN_BUDGET = int(os.environ.get('USER_DAILY_TOKEN_BUDGET', 500000))
+    USER_TOKENS_PER_MINUTE = int(os.environ.get('USER_TOKENS_PER_MINUTE', 60000))
+    USER_TOKEN_BURST = int(os.environ.get('USER_TOKEN_BURST', 120000)) # Bucket size: tokens usable at once
+    LLM_MAX_CONCURRENT_CALLS = int(os.environ.get('LLM_MAX_CONCURRENT_CALLS', 8)) # Per worker process
+    LLM_QUEUE_WAIT_SECONDS = float(os.environ.get('LLM_QUEUE_WAIT_SECONDS', 30))
 
-    # Ensure instance and upload folders exist
+    # Folders are created by `flask init-db` (and on first use), not when this module is imported
     INSTANCE_FOLDER_PATH = os.path.join(basedir, 'instance')
-    if not os.path.exists(INSTANCE_FOLDER_PATH):
-        os.makedirs(INSTANCE_FOLDER_PATH)
-    if not os.path.exists(UPLOAD_FOLDER):
-        os.makedirs(UPLOAD_FOLDER)
-    if not os.path.exists(CHROMA_DB_PATH) and CHROMA_DB_PATH: # CHROMA_DB_PATH might be empty if not set
-        os.makedirs(CHROMA_DB_PATH)
 
 
 class DevelopmentConfig(Config):
@@ -40,6 +146,7 @@ class TestingConfig(Config):
     """Testing configuration."""
     TESTING = True
     SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:' # Use in-memory SQLite for tests
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(SQLALCHEMY_DATABASE_URI)
     WTF_CSRF_ENABLED = False # Disable CSRF for tests
 
 class ProductionConfig(Config):
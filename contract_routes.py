@@ -1,12 +1,12 @@
-from flask import Blueprint, render_template, request, flash, redirect, url_for, jsonify, current_app, send_file
+from flask import Blueprint, render_template, request, flash, redirect, url_for, jsonify, current_app
 from flask_login import current_user, login_required
-from flask_weasyprint import HTML, CSS # For PDF generation
-from docx import Document # For DOCX generation
-from io import BytesIO # For handling byte streams
+from sqlalchemy.orm import defer
 from models import db, Contract, User 
+from pagination import keyset_paginate
+import export_service
 import datetime
 import json 
-import re # For cleaning HTML for text extraction
+from html_text import html_to_text
 
 # Define contract_types_data here or import from a config file
 # This data will be used to populate the UI and validate contract types
@@ -21,7 +21,8 @@ CONTRACT_TYPES_DATA = {
             {"name": "maas", "label": "Maaş", "type": "number", "required": True},
             {"name": "baslangic_tarihi", "label": "Başlangıç Tarihi", "type": "date", "required": True},
             {"name": "sure", "label": "Süre (Belirli/Belirsiz)", "type": "text", "required": False, "placeholder": "Belirsiz süreli"},
-        ]
+        ],
+        "parties": [{"field": "sirket_adi", "role": "İşveren"}, {"field": "calisan_adi", "role": "İşçi"}]
     },
     "gizlilik_sozlesmesi": {
         "name": "Gizlilik Sözleşmesi",
@@ -31,7 +32,8 @@ CONTRACT_TYPES_DATA = {
             {"name": "amac", "label": "Sözleşmenin Amacı", "type": "textarea", "required": True},
             {"name": "gizli_bilgi_tanimi", "label": "Gizli Bilgi Tanımı", "type": "textarea", "required": True},
             {"name": "sure", "label": "Süre", "type": "text", "required": True, "placeholder": "Örn: 2 yıl"},
-        ]
+        ],
+        "parties": [{"field": "taraflar", "role": "Taraflar"}]
     },
     "freelance_is_sozlesmesi": {
         "name": "Freelance İş Sözleşmesi",
@@ -42,7 +44,8 @@ CONTRACT_TYPES_DATA = {
             {"name": "is_tanimi", "label": "İş Tanımı", "type": "textarea", "required": True},
             {"name": "ucret", "label": "Ücret", "type": "number", "required": True},
             {"name": "teslim_suresi", "label": "Teslim Süresi", "type": "text", "required": True, "placeholder": "Örn: 30 gün"},
-        ]
+        ],
+        "parties": [{"field": "isveren", "role": "İşveren"}, {"field": "freelancer", "role": "Hizmet Sağlayıcı (Freelancer)"}]
     },
     "staj_sozlesmesi": {
         "name": "Staj Sözleşmesi",
@@ -53,7 +56,8 @@ CONTRACT_TYPES_DATA = {
             {"name": "staj_suresi", "label": "Staj Süresi", "type": "text", "required": True, "placeholder": "Örn: 3 ay"},
             {"name": "calisma_saatleri", "label": "Çalışma Saatleri", "type": "text", "required": False, "placeholder": "Örn: 09:00 - 17:00"},
             {"name": "odeme_varsa", "label": "Ödeme (Varsa)", "type": "text", "required": False, "placeholder": "Yok"},
-        ]
+        ],
+        "parties": [{"field": "sirket_adi", "role": "İşletme"}, {"field": "stajyer_adi", "role": "Stajyer"}]
     },
     "uzaktan_calisma_sozlesmesi": {
         "name": "Uzaktan Çalışma Sözleşmesi",
@@ -64,7 +68,8 @@ CONTRACT_TYPES_DATA = {
             {"name": "pozisyon", "label": "Pozisyon", "type": "text", "required": True},
             {"name": "maas", "label": "Maaş", "type": "number", "required": True},
             {"name": "calisma_yeri", "label": "Çalışma Yeri", "type": "text", "required": True, "placeholder": "Evden"},
-        ]
+        ],
+        "parties": [{"field": "sirket_adi", "role": "İşveren"}, {"field": "calisan_adi", "role": "İşçi"}]
     },
     "konut_kira_sozlesmesi": {
         "name": "Konut Kira Sözleşmesi",
@@ -77,7 +82,8 @@ CONTRACT_TYPES_DATA = {
             {"name": "depozito_miktari", "label": "Depozito Miktarı", "type": "number", "required": False},
             {"name": "kira_suresi", "label": "Kira Süresi", "type": "text", "required": True, "placeholder": "Örn: 1 yıl"},
             {"name": "diger_kosullar", "label": "Diğer Koşullar", "type": "textarea", "required": False, "placeholder": "Aidat, bakım vb."},
-        ]
+        ],
+        "parties": [{"field": "kiraya_veren", "role": "Kiraya Veren"}, {"field": "kiraci", "role": "Kiracı"}]
     },
     "isyeri_kira_sozlesmesi": {
         "name": "İşyeri Kira Sözleşmesi",
@@ -90,7 +96,8 @@ CONTRACT_TYPES_DATA = {
             {"name": "stopaj_durumu", "label": "Stopaj Durumu", "type": "text", "required": False, "placeholder": "Kiracı tarafından ödenecektir"},
             {"name": "kira_suresi", "label": "Kira Süresi", "type": "text", "required": True, "placeholder": "Örn: 3 yıl"},
             {"name": "depozito", "label": "Depozito", "type": "number", "required": False},
-        ]
+        ],
+        "parties": [{"field": "kiraya_veren_unvan", "role": "Kiraya Veren"}, {"field": "kiraci_unvan", "role": "Kiracı"}]
     },
     "tasinmaz_satis_vaadi_sozlesmesi": {
         "name": "Taşınmaz Satış Vaadi Sözleşmesi",
@@ -102,7 +109,8 @@ CONTRACT_TYPES_DATA = {
             {"name": "satis_bedeli", "label": "Satış Bedeli", "type": "number", "required": True},
             {"name": "odeme_sekli", "label": "Ödeme Şekli", "type": "textarea", "required": True},
             {"name": "teslim_tarihi", "label": "Teslim Tarihi", "type": "date", "required": False},
-        ]
+        ],
+        "parties": [{"field": "vaad_eden", "role": "Satış Vaadinde Bulunan"}, {"field": "vaad_alan", "role": "Lehine Satış Vaadinde Bulunulan"}]
     },
     "temizlik_hizmet_sozlesmesi": {
         "name": "Temizlik Hizmet Sözleşmesi",
@@ -114,7 +122,8 @@ CONTRACT_TYPES_DATA = {
             {"name": "hizmet_periyodu", "label": "Hizmet Periyodu", "type": "text", "required": True, "placeholder": "Haftada 2 kez, Aylık vb."},
             {"name": "ucret", "label": "Ücret", "type": "number", "required": True},
             {"name": "malzemeler", "label": "Malzemeler", "type": "text", "required": False, "placeholder": "Hizmet veren tarafından temin edilecektir"},
-        ]
+        ],
+        "parties": [{"field": "hizmet_alan", "role": "Hizmet Alan"}, {"field": "hizmet_veren", "role": "Hizmet Veren"}]
     },
     "avukatlik_sozlesmesi": {
         "name": "Avukatlık Sözleşmesi",
@@ -125,7 +134,8 @@ CONTRACT_TYPES_DATA = {
             {"name": "is_konusu", "label": "İşin Konusu (Dava/Danışmanlık)", "type": "textarea", "required": True},
             {"name": "vekalet_ucreti", "label": "Vekalet Ücreti", "type": "text", "required": True, "placeholder": "Örn: 10.000 TL + KDV"},
             {"name": "masraflar", "label": "Masraflar", "type": "text", "required": False, "placeholder": "Müvekkil tarafından karşılanacaktır"},
-        ]
+        ],
+        "parties": [{"field": "muvekkil", "role": "Müvekkil"}, {"field": "avukat", "role": "Avukat"}]
     },
     "mal_alim_satim_sozlesmesi": {
         "name": "Mal Alım Satım Sözleşmesi",
@@ -137,7 +147,8 @@ CONTRACT_TYPES_DATA = {
             {"name": "birim_fiyat_toplam_bedel", "label": "Birim Fiyat ve Toplam Bedel", "type": "text", "required": True},
             {"name": "teslim_yeri_sekli", "label": "Teslim Yeri ve Şekli", "type": "text", "required": True},
             {"name": "odeme_vadesi", "label": "Ödeme Vadesi", "type": "text", "required": True},
-        ]
+        ],
+        "parties": [{"field": "satici", "role": "Satıcı"}, {"field": "alici", "role": "Alıcı"}]
     },
     "danismanlik_hizmet_sozlesmesi": {
         "name": "Danışmanlık Hizmet Sözleşmesi",
@@ -148,7 +159,8 @@ CONTRACT_TYPES_DATA = {
             {"name": "danismanlik_konusu", "label": "Danışmanlık Konusu", "type": "textarea", "required": True},
             {"name": "sure", "label": "Süre", "type": "text", "required": True, "placeholder": "Örn: 6 ay"},
             {"name": "ucret_odeme_kosullari", "label": "Ücret ve Ödeme Koşulları", "type": "textarea", "required": True},
-        ]
+        ],
+        "parties": [{"field": "danisan", "role": "Danışan"}, {"field": "danisman", "role": "Danışman"}]
     },
     "genel_amacli_sozlesme": {
         "name": "Genel Amaçlı Sözleşme Taslağı",
@@ -160,7 +172,8 @@ CONTRACT_TYPES_DATA = {
             {"name": "temel_sartlar", "label": "Temel Şartlar ve Yükümlülükler", "type": "textarea", "required": True},
             {"name": "sure_bedel_opsiyonel", "label": "Süre / Bedel (Varsa)", "type": "text", "required": False},
             {"name": "ek_maddeler", "label": "Ek Maddeler (Varsa)", "type": "textarea", "required": False},
-        ]
+        ],
+        "parties": [{"field": "taraf_1", "role": "Taraf 1"}, {"field": "taraf_2", "role": "Taraf 2"}]
     }
 }
 
@@ -174,10 +187,6 @@ def require_login():
 @contract_bp.route('/')
 def index():
     """Displays the main page for selecting contract types."""
-    print("--- contract_routes.py: index route CALLED ---") 
-    print(f"DEBUG: Type of CONTRACT_TYPES_DATA: {type(CONTRACT_TYPES_DATA)}") 
-    print(f"DEBUG: Length of CONTRACT_TYPES_DATA: {len(CONTRACT_TYPES_DATA) if isinstance(CONTRACT_TYPES_DATA, dict) else 'Not a dict'}") 
-    
     categorized_contracts = {}
     try:
         for key, value in CONTRACT_TYPES_DATA.items():
@@ -200,16 +209,19 @@ def index():
     except Exception as e:
         print(f"DEBUG: Error during categorization loop: {e}")
 
-    print(f"DEBUG: categorized_contracts POPULATED: {json.dumps(categorized_contracts, indent=2, ensure_ascii=False)}") 
-    
-    user_contracts = Contract.query.filter_by(user_id=current_user.id, is_deleted=False).order_by(Contract.created_at.desc()).all()
-    print(f"DEBUG: Fetched {len(user_contracts)} user_contracts.")
+    # The listing only shows titles and dates, so the large content columns are never loaded
+    contracts_query = Contract.query.filter_by(user_id=current_user.id, is_deleted=False).options(
+        defer(Contract.generated_content_html), defer(Contract.generated_content_text))
+    contracts_page = keyset_paginate(contracts_query, Contract.created_at, Contract.id,
+                                     cursor=request.args.get('after'),
+                                     per_page=current_app.config['LIST_PAGE_SIZE'])
+    user_contracts = contracts_page.items
 
-    print("--- contract_routes.py: index route RENDERING TEMPLATE ---")
     return render_template('contracts/contract_hub.html',
                            title='Sözleşme Hazırla',
                            categorized_contracts=categorized_contracts,
                            user_contracts=user_contracts,
+                           next_cursor=contracts_page.next_cursor,
                            CONTRACT_TYPES_DATA=CONTRACT_TYPES_DATA)
 
 @contract_bp.route('/get_contract_form/<string:contract_type_key>', methods=['GET'])
@@ -244,12 +256,23 @@ def generate_contract():
         return jsonify({"error": "Geçersiz sözleşme türü."}), 400
 
     from ai import generate_contract_with_ai 
+    from usage import QuotaExceededError, LLMBusyError
     
-    ai_generated_html_content, ai_generated_text_content = generate_contract_with_ai(
-        contract_template_info['name'], 
-        form_inputs,
-        custom_prompt 
-    )
+    # Parties are rendered from a static template; only the variable clauses go to the LLM
+    parties = [(party['role'], form_inputs.get(party['field'], ''))
+               for party in contract_template_info.get('parties', [])]
+
+    try:
+        ai_generated_html_content, ai_generated_text_content = generate_contract_with_ai(
+            contract_template_info['name'], 
+            form_inputs,
+            custom_prompt,
+            parties=parties,
+            user_id=current_user.id,
+            document_kind=contract_type_key
+        )
+    except (QuotaExceededError, LLMBusyError) as e:
+        return jsonify({"error": str(e)}), 429
 
     try:
         new_contract = Contract(
@@ -290,6 +313,7 @@ def delete_contract(contract_id):
         contract_to_delete.is_deleted = True
         contract_to_delete.deleted_at = datetime.datetime.utcnow()
         db.session.commit()
+        export_service.invalidate('contract', contract_to_delete.id)
         flash(f"'{contract_to_delete.title}' başlıklı sözleşme başarıyla silindi.", 'success')
     except Exception as e:
         db.session.rollback()
@@ -301,64 +325,8 @@ def delete_contract(contract_id):
 @login_required
 def export_pdf(contract_id):
     contract = Contract.query.filter_by(id=contract_id, user_id=current_user.id, is_deleted=False).first_or_404()
-    
-    html_content = contract.generated_content_html
-    if not html_content:
-        flash('Sözleşme içeriği bulunamadı, PDF oluşturulamıyor.', 'danger')
-        return redirect(url_for('contract.view_contract', contract_id=contract_id))
-
-    try:
-        # Add some basic styling for the PDF if not already in html_content
-        # You might want to link a CSS file or embed styles for better PDF appearance
-        html_for_pdf = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <meta charset="UTF-8">
-            <title>{contract.title}</title>
-            <style>
-                body {{ font-family: 'DejaVu Sans', sans-serif; line-height: 1.6; }}
-                h1, h2, h3, h4, h5, h6 {{ page-break-after: avoid; }}
-                p {{ margin-bottom: 0.5em; }}
-                /* Add more specific styles as needed */
-            </style>
-        </head>
-        <body>
-            <h1>{contract.title}</h1>
-            {html_content}
-        </body>
-        </html>
-        """
-        pdf_file = HTML(string=html_for_pdf).write_pdf()
-        
-        return send_file(
-            BytesIO(pdf_file),
-            mimetype='application/pdf',
-            as_attachment=True,
-            download_name=f"{contract.title.replace(' ', '_').lower()}_{contract_id}.pdf"
-        )
-    except Exception as e:
-        current_app.logger.error(f"PDF oluşturulurken hata: {e}")
-        flash(f"PDF oluşturulurken bir hata oluştu: {str(e)}", 'danger')
-        return redirect(url_for('contract.view_contract', contract_id=contract_id) if contract_id else url_for('contract.index'))
-
-
-def clean_html_for_docx(html_content):
-    """Basic HTML tag removal for DOCX conversion. More sophisticated parsing might be needed."""
-    if not html_content:
-        return ""
-    # Remove HTML tags
-    text = re.sub(r'<[^>]+>', ' ', html_content)
-    # Replace common HTML entities
-    text = text.replace('&nbsp;', ' ')
-    text = text.replace('&', '&')
-    text = text.replace('<', '<')
-    text = text.replace('>', '>')
-    text = text.replace('"', '"')
-    text = text.replace('&#39;', "'")
-    # Collapse multiple spaces
-    text = re.sub(r'\s+', ' ', text).strip()
-    return text
+    return export_service.export_response('contract', contract, 'pdf',
+                                          url_for('contract.view_contract', contract_id=contract_id))
 
 @contract_bp.route('/edit/<int:contract_id>', methods=['GET', 'POST'])
 @login_required
@@ -380,11 +348,12 @@ def edit_contract(contract_id):
         
         contract_to_edit.title = new_title.strip()
         contract_to_edit.generated_content_html = new_html_content
-        contract_to_edit.generated_content_text = clean_html_for_docx(new_html_content) # Update plain text version
+        contract_to_edit.generated_content_text = html_to_text(new_html_content) # Update plain text version
         contract_to_edit.updated_at = datetime.datetime.utcnow()
         
         try:
             db.session.commit()
+            export_service.invalidate('contract', contract_to_edit.id)
             flash(f"'{contract_to_edit.title}' başlıklı sözleşme başarıyla güncellendi.", 'success')
             return redirect(url_for('contract.view_contract', contract_id=contract_to_edit.id))
         except Exception as e:
@@ -406,40 +375,5 @@ def edit_contract(contract_id):
 @login_required
 def export_docx(contract_id):
     contract = Contract.query.filter_by(id=contract_id, user_id=current_user.id, is_deleted=False).first_or_404()
-    
-    # Prefer text content if available, otherwise clean HTML
-    text_content = contract.generated_content_text
-    if not text_content and contract.generated_content_html:
-        text_content = clean_html_for_docx(contract.generated_content_html)
-    elif not text_content and not contract.generated_content_html:
-        flash('Sözleşme içeriği bulunamadı, Word belgesi oluşturulamıyor.', 'danger')
-        return redirect(url_for('contract.view_contract', contract_id=contract_id))
-
-    try:
-        document = Document()
-        document.add_heading(contract.title, level=1)
-        
-        # Split content into paragraphs. This is a basic split.
-        # For better formatting, you might need to parse HTML structure more carefully.
-        paragraphs = text_content.split('\n')
-        for para_text in paragraphs:
-            if para_text.strip(): # Add non-empty paragraphs
-                document.add_paragraph(para_text)
-            else: # Add an empty paragraph for line breaks if desired
-                document.add_paragraph()
-
-
-        file_stream = BytesIO()
-        document.save(file_stream)
-        file_stream.seek(0) # Reset stream position to the beginning
-
-        return send_file(
-            file_stream,
-            mimetype='application/vnd.openxmlformats-officedocument.wordprocessingml.document',
-            as_attachment=True,
-            download_name=f"{contract.title.replace(' ', '_').lower()}_{contract_id}.docx"
-        )
-    except Exception as e:
-        current_app.logger.error(f"Word belgesi oluşturulurken hata: {e}")
-        flash(f"Word belgesi oluşturulurken bir hata oluştu: {str(e)}", 'danger')
-        return redirect(url_for('contract.view_contract', contract_id=contract_id) if contract_id else url_for('contract.index'))
+    return export_service.export_response('contract', contract, 'docx',
+                                          url_for('contract.view_contract', contract_id=contract_id))
@@ -3,9 +3,9 @@ import datetime # Added datetime import
 from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app
 from flask_login import current_user, login_required
 from werkzeug.utils import secure_filename
-from langchain_community.vectorstores import Chroma # Added Chroma import
-from models import db, PDFDocument, User
+from models import db, PDFDocument, PDFPage, User
 from forms import PDFUploadForm
+from pagination import keyset_paginate
 from ai import process_and_store_pdf, get_pdf_hash # AI logic for processing
 
 dashboard_bp = Blueprint('dashboard', __name__, url_prefix='/dashboard', template_folder='templates')
@@ -18,8 +18,12 @@ def require_login():
 @dashboard_bp.route('/')
 @dashboard_bp.route('/index')
 def index():
-    user_pdfs = PDFDocument.query.filter_by(user_id=current_user.id, is_deleted=False).order_by(PDFDocument.upload_date.desc()).all()
-    return render_template('dashboard.html', title='Kullanıcı Paneli', user_pdfs=user_pdfs)
+    pdfs_page = keyset_paginate(PDFDocument.query.filter_by(user_id=current_user.id, is_deleted=False),
+                                PDFDocument.upload_date, PDFDocument.id,
+                                cursor=request.args.get('after'),
+                                per_page=current_app.config['LIST_PAGE_SIZE'])
+    return render_template('dashboard.html', title='Kullanıcı Paneli', user_pdfs=pdfs_page.items,
+                           next_cursor=pdfs_page.next_cursor)
 
 @dashboard_bp.route('/upload_pdf', methods=['GET', 'POST'])
 def upload_pdf():
@@ -109,30 +113,13 @@ def delete_pdf(pdf_id):
         collection_name = pdf_to_delete.vector_db_collection_name
         if collection_name and pdf_to_delete.processed: # Only if processed and has a collection
             try:
-                # Need to import Chroma and embeddings from ai.py or pass them
-                from ai import embeddings as ai_embeddings # Assuming embeddings is accessible
-                if ai_embeddings: # Ensure embeddings were initialized
-                    chroma_client = Chroma(
-                        persist_directory=current_app.config['CHROMA_DB_PATH'],
-                        embedding_function=ai_embeddings
-                    )
-                    # Check if collection exists before trying to delete
-                    # This part of Chroma's API can be tricky; often get_collection then delete_collection
-                    # For simplicity, we'll try to delete. If it fails, log it.
-                    # A more robust way is to list collections and check.
-                    try:
-                        chroma_client.delete_collection(name=collection_name)
-                        print(f"ChromaDB collection '{collection_name}' deleted successfully.")
-                    except Exception as chroma_exc: # Catch specific ChromaDB exceptions if known
-                        print(f"Could not delete ChromaDB collection '{collection_name}': {chroma_exc}. It might not exist or an error occurred.")
-                        # flash(f"Vektör veritabanı koleksiyonu '{collection_name}' silinirken hata oluştu veya bulunamadı.", "warning")
-
-                else:
-                    print("Embeddings model not available for ChromaDB deletion.")
-                    # flash("Embeddings modeli yüklenemediği için vektör veritabanı silinemedi.", "warning")
+                import vector_store # Imports Chroma on first use, keeps the dashboard import light
+                # Deleted by name on the shared client; no embeddings model is needed
+                if vector_store.delete_collection(collection_name):
+                    print(f"ChromaDB collection '{collection_name}' deleted successfully.")
 
             except ImportError:
-                 print("Could not import 'embeddings' from 'ai' module for ChromaDB deletion.")
+                 print("Could not import Chroma for ChromaDB deletion.")
             except Exception as e:
                 print(f"Error during ChromaDB collection deletion for '{collection_name}': {e}")
                 flash(f"Vektör veritabanından '{collection_name}' silinirken bir hata oluştu: {e}", "warning")
@@ -141,6 +128,8 @@ def delete_pdf(pdf_id):
         if os.path.exists(pdf_to_delete.filepath):
             os.remove(pdf_to_delete.filepath)
             print(f"File '{pdf_to_delete.filepath}' deleted from server.")
+        # The page text index is a copy of the file's content, so it goes with the file
+        PDFPage.query.filter_by(pdf_document_id=pdf_to_delete.id).delete()
             
         # Soft delete the metadata record (Item 6)
         pdf_to_delete.is_deleted = True
@@ -1,7 +1,9 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify
+from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, abort
 from flask_login import login_required, current_user
 from models import db, Dilekce 
 from ai import generate_dilekce_with_ai # Import the AI function
+from usage import QuotaExceededError, LLMBusyError
+import export_service
 import datetime
 
 # The template_folder should be relative to the blueprint's location,
@@ -12,11 +14,9 @@ dilekce_bp = Blueprint('dilekce', __name__, url_prefix='/dilekce', template_fold
 @dilekce_bp.route('/') # This will be the main page for dilekce, perhaps listing them
 @login_required
 def dilekce_hub():
-    # This can list existing dilekceler or redirect to the creation form
-    user_dilekceler = Dilekce.query.filter_by(user_id=current_user.id, is_deleted=False).order_by(Dilekce.created_at.desc()).all()
-    # For now, let's make it redirect to the creation form, or you can create a separate hub page.
-    # return render_template('dilekce_hub.html', title="Dilekçe Merkezi", dilekceler=user_dilekceler)
-    # For now, let's assume this is the page that shows the form to select dilekce type
+    # This can list existing dilekceler or redirect to the creation form.
+    # A listing page should page with keyset_paginate and defer the content columns, as the
+    # contract and ifade hubs do; the redirect does not need the user's dilekceler at all.
     return redirect(url_for('dilekce.create_dilekce_form'))
 
 
@@ -50,8 +50,12 @@ def create_dilekce_handler():
         html_content, text_content = generate_dilekce_with_ai(
             dilekce_type_name=dilekce_type, 
             form_inputs_dict=input_data, 
-            custom_prompt_text=custom_prompt
+            custom_prompt_text=custom_prompt,
+            user_id=current_user.id
         )
+    except (QuotaExceededError, LLMBusyError) as e:
+        flash(str(e), 'warning')
+        return redirect(url_for('dilekce.create_dilekce_form'))
     except Exception as e:
         flash(f"Dilekçe içeriği oluşturulurken bir hata oluştu: {str(e)}", "danger")
         return redirect(url_for('dilekce.create_dilekce_form'))
@@ -213,4 +217,13 @@ def get_form_fields(dilekce_type):
     
     return jsonify({'html': fields_html})
 
-# Add other routes like edit, delete, export_pdf, export_word as needed
+@dilekce_bp.route('/export/<string:fmt>/<int:dilekce_id>')
+@login_required
+def export_dilekce(fmt, dilekce_id):
+    if fmt not in export_service.EXPORT_FORMATS:
+        abort(404)
+    dilekce = Dilekce.query.filter_by(id=dilekce_id, user_id=current_user.id, is_deleted=False).first_or_404()
+    return export_service.export_response('dilekce', dilekce, fmt,
+                                          url_for('dilekce.view_dilekce', dilekce_id=dilekce_id))
+
+# Add other routes like edit, delete as needed
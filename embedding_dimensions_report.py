@@ -0,0 +1,117 @@
+"""
+Index size, query latency and recall@k of reduced-dimension embeddings (EMBEDDING_MODEL with
+an @<dimensions> suffix) against the full-size ones.
+
+The PDFs are chunked like ingestion and embedded once with the full-size model. Each reduced
+size is derived by truncating and re-normalizing the vectors, which is what the
+text-embedding-3 `dimensions` parameter (and truncate_dim on Matryoshka models) returns. Every
+size is loaded into its own Chroma store; recall@k is the overlap of its top k with an exact
+search on the full vectors, so the full-size row shows what HNSW alone loses.
+
+Usage: python embedding_dimensions_report.py file.pdf [file.pdf ...] [--dimensions 1024,512,256]
+                                             [--k 3] [--queries 100] [--questions questions.txt]
+                                             [--spec openai:text-embedding-3-small]
+"""
+import argparse
+import random
+import re
+import shutil
+import tempfile
+import time
+
+
+def load_chunks(paths):
+    from langchain_community.document_loaders import PyPDFLoader
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    from ai import CHUNK_SIZE, CHUNK_OVERLAP
+    splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+    chunks = []
+    for path in paths:
+        chunks.extend(document.page_content for document in splitter.split_documents(PyPDFLoader(path).load()))
+    return chunks
+
+
+def sample_questions(chunks, count, rng):
+    """Known-item queries: (chunk index, one sentence of that chunk) for `count` random chunks."""
+    questions = []
+    for index in rng.sample(range(len(chunks)), min(count, len(chunks))):
+        sentences = [s.strip() for s in re.split(r"(?<=[.!?])\s+", chunks[index]) if len(s.strip()) > 40]
+        questions.append((index, (rng.choice(sentences) if sentences else chunks[index])[:300]))
+    return questions
+
+
+def embed(embeddings, texts, batch_size=256):
+    import numpy as np
+    vectors = []
+    for start in range(0, len(texts), batch_size):
+        vectors.extend(embeddings.embed_documents(texts[start:start + batch_size]))
+    return np.asarray(vectors, dtype=np.float32)
+
+
+def reduce(vectors, dimensions):
+    import numpy as np
+    reduced = vectors[:, :dimensions]
+    return reduced / np.linalg.norm(reduced, axis=1, keepdims=True)
+
+
+def measure(chunk_vectors, query_vectors, exact_top_k, k):
+    """(store bytes, query latencies in seconds, recall@k) of one Chroma store holding chunk_vectors."""
+    import chromadb
+    from chromadb.config import Settings
+    from config import Config
+    import vector_store
+    path = tempfile.mkdtemp(prefix="chroma_dims_")
+    try:
+        client = chromadb.PersistentClient(path=path, settings=Settings(anonymized_telemetry=False))
+        collection = client.create_collection("dims")
+        batch_size = client.get_max_batch_size()
+        for start in range(0, len(chunk_vectors), batch_size):
+            batch = chunk_vectors[start:start + batch_size]
+            collection.add(ids=[str(i) for i in range(start, start + len(batch))], embeddings=batch.tolist())
+        latencies, hits = [], 0
+        for query_vector, exact in zip(query_vectors, exact_top_k):
+            started = time.perf_counter()
+            result = collection.query(query_embeddings=[query_vector.tolist()], n_results=k)
+            latencies.append(time.perf_counter() - started)
+            hits += len({int(i) for i in result["ids"][0]} & exact)
+        Config.CHROMA_DB_PATH = path
+        return vector_store.storage_bytes(), sorted(latencies), hits / (k * len(query_vectors))
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    from config import Config
+    from llm_providers import create_embeddings, split_dimensions
+    parser = argparse.ArgumentParser(description="Reduced-dimension embeddings: size, latency and recall@k")
+    parser.add_argument("pdfs", nargs="+")
+    parser.add_argument("--spec", default=split_dimensions(Config.EMBEDDING_MODEL)[0], help="full-size embedding model")
+    parser.add_argument("--dimensions", default="1024,512,256")
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--questions", help="file with one question per line, instead of sampled sentences")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    chunks = load_chunks(args.pdfs)
+    if args.questions:
+        with open(args.questions, encoding="utf-8") as questions_file:
+            questions = [line.strip() for line in questions_file if line.strip()]
+    else:
+        questions = [question for _, question in sample_questions(chunks, args.queries, rng)]
+    embeddings = create_embeddings(args.spec)
+    chunk_vectors = reduce(embed(embeddings, chunks), None) # Normalized full-size vectors
+    query_vectors = reduce(embed(embeddings, questions), None)
+    k = min(args.k, len(chunks))
+    exact_top_k = [set(row) for row in (-(query_vectors @ chunk_vectors.T)).argsort(axis=1)[:, :k]]
+
+    full_size = chunk_vectors.shape[1]
+    sizes = [full_size] + sorted({int(d) for d in args.dimensions.split(",") if 0 < int(d) < full_size}, reverse=True)
+    print(f"[dims] {args.spec}: {len(chunks)} chunks, {len(questions)} queries, k={k}")
+    for dimensions in sizes:
+        store_bytes, latencies, recall = measure(reduce(chunk_vectors, dimensions), reduce(query_vectors, dimensions),
+                                                 exact_top_k, k)
+        label = args.spec if dimensions == full_size else f"{args.spec}@{dimensions}"
+        print(f"[dims] {label}: vectors {len(chunks) * dimensions * 4 / 1024 / 1024:.1f} MB, "
+              f"store {store_bytes / 1024 / 1024:.1f} MB, query p50 {latencies[len(latencies) // 2] * 1000:.2f} ms, "
+              f"p95 {latencies[int(len(latencies) * 0.95)] * 1000:.2f} ms, recall@{k} {recall:.3f}")
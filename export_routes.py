@@ -0,0 +1,56 @@
+from flask import Blueprint, request, flash, redirect, url_for, send_file, current_app
+from flask_login import current_user, login_required
+from models import Contract, Dilekce, Ifade
+from config import Config
+import export_service
+
+export_bp = Blueprint('export', __name__, url_prefix='/export')
+
+# Query-string key -> (model, export kind)
+EXPORTABLE_MODELS = {
+    'contract': Contract,
+    'dilekce': Dilekce,
+    'ifade': Ifade,
+}
+
+@export_bp.before_request
+@login_required # Ensures all routes in this blueprint require login
+def require_login():
+    pass
+
+@export_bp.route('/zip')
+def export_zip():
+    """
+    Downloads many documents as one zip, e.g. /export/zip?format=pdf&contract=1&contract=2&ifade=5
+    """
+    fmt = request.args.get('format', 'pdf')
+    back_url = request.referrer or url_for('dashboard.index')
+    if fmt not in export_service.EXPORT_FORMATS:
+        flash('Geçersiz dosya formatı.', 'danger')
+        return redirect(back_url)
+
+    documents = []
+    for kind, model in EXPORTABLE_MODELS.items():
+        ids = request.args.getlist(kind, type=int)
+        if ids:
+            docs = model.query.filter(model.id.in_(ids), model.user_id == current_user.id, model.is_deleted == False).all()
+            documents.extend((kind, doc) for doc in docs)
+
+    if not documents:
+        flash('Dışa aktarılacak belge bulunamadı.', 'warning')
+        return redirect(back_url)
+    if len(documents) > Config.EXPORT_ZIP_MAX_DOCUMENTS:
+        flash(f'Tek seferde en fazla {Config.EXPORT_ZIP_MAX_DOCUMENTS} belge indirilebilir.', 'warning')
+        return redirect(back_url)
+
+    try:
+        archive = export_service.build_zip(documents, fmt)
+    except export_service.ExportBusyError:
+        flash('Sistem şu anda yoğun, lütfen birkaç saniye sonra tekrar deneyin.', 'warning')
+        return redirect(back_url)
+    except Exception as e:
+        current_app.logger.error(f"Zip arşivi oluşturulurken hata: {e}")
+        flash(f"Zip arşivi oluşturulurken bir hata oluştu: {str(e)}", 'danger')
+        return redirect(back_url)
+
+    return send_file(archive, mimetype='application/zip', as_attachment=True, download_name=f"belgeler_{fmt}.zip")
@@ -0,0 +1,401 @@
+import os
+import re
+import glob
+import html
+import hashlib
+import zipfile
+import threading
+import time
+from collections import deque
+from io import BytesIO
+from html.parser import HTMLParser
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from flask import current_app, flash, redirect, send_file
+from config import Config
+
+# Bump when the export HTML/CSS template changes so stale cached files are not served
+EXPORT_TEMPLATE_VERSION = 1
+
+PDF_HTML_TEMPLATE = """
+<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="UTF-8">
+    <title>{title}</title>
+    <style>
+        body {{ font-family: 'DejaVu Sans', sans-serif; line-height: 1.6; }}
+        h1, h2, h3, h4, h5, h6 {{ page-break-after: avoid; }}
+        p {{ margin-bottom: 0.5em; }}
+        /* Add more specific styles as needed */
+    </style>
+</head>
+<body>
+    <h1>{title}</h1>
+    {content}
+</body>
+</html>
+"""
+
+# Rendering runs in a process pool shared by all document kinds. The semaphore caps how many
+# renders one web worker can have in flight so exports can't starve chat traffic.
+_render_executor = None
+_executor_lock = threading.Lock()
+_render_slots = threading.BoundedSemaphore(Config.EXPORT_MAX_CONCURRENT_RENDERS)
+_pending_renders = {} # cache path -> Future, so concurrent downloads share one render
+_pending_lock = threading.Lock()
+
+
+class ExportBusyError(Exception):
+    """Raised when all render slots stay busy for EXPORT_QUEUE_WAIT_SECONDS."""
+
+
+def _get_executor():
+    """Creates the process pool on first use, never at import time (e.g. before gunicorn forks)."""
+    global _render_executor
+    if _render_executor is None:
+        with _executor_lock:
+            if _render_executor is None:
+                _render_executor = ProcessPoolExecutor(max_workers=Config.EXPORT_RENDER_WORKERS)
+    return _render_executor
+
+
+def content_hash(title, html_content):
+    """SHA256 of everything that ends up in the rendered document."""
+    sha256_hash = hashlib.sha256()
+    sha256_hash.update((title or "").encode("utf-8"))
+    sha256_hash.update(b"\0")
+    sha256_hash.update((html_content or "").encode("utf-8"))
+    return sha256_hash.hexdigest()
+
+
+def _cache_path(kind, doc_id, digest, extension):
+    filename = f"{kind}_{doc_id}_{digest[:16]}_v{EXPORT_TEMPLATE_VERSION}.{extension}"
+    return os.path.join(Config.EXPORT_CACHE_PATH, filename)
+
+
+def invalidate(kind, doc_id):
+    """Removes every cached export of a document (e.g. after it was edited or deleted)."""
+    for path in glob.glob(os.path.join(Config.EXPORT_CACHE_PATH, f"{kind}_{doc_id}_*")):
+        try:
+            os.remove(path)
+        except OSError as e:
+            print(f"Could not remove cached export '{path}': {e}")
+
+
+def _evict_if_needed():
+    """
+    Deletes least recently used files until the cache fits in EXPORT_CACHE_MAX_BYTES. Files
+    rendered or requested in the last EXPORT_EVICT_MIN_AGE_SECONDS are never deleted: a request
+    may have the path but not yet have sent it (send_file) or written it into a zip.
+    """
+    entries = []
+    total_size = 0
+    protected_after = time.time() - Config.EXPORT_EVICT_MIN_AGE_SECONDS
+    for entry in os.scandir(Config.EXPORT_CACHE_PATH):
+        if entry.is_file() and not entry.name.endswith(".tmp"):
+            stat = entry.stat()
+            last_used = max(stat.st_atime, stat.st_mtime) # os.utime on cache hits sets both
+            entries.append((last_used, stat.st_size, entry.path))
+            total_size += stat.st_size
+    if total_size <= Config.EXPORT_CACHE_MAX_BYTES:
+        return
+    for last_used, size, path in sorted(entries):
+        if last_used >= protected_after:
+            break # Sorted oldest first, so every remaining file is in use too
+        try:
+            os.remove(path)
+            total_size -= size
+        except OSError:
+            continue
+        if total_size <= Config.EXPORT_CACHE_MAX_BYTES:
+            break
+
+
+def render_pdf_bytes(title, html_content):
+    """Renders a document to PDF bytes with WeasyPrint."""
+    from weasyprint import HTML # Imported lazily, font setup is expensive
+    html_for_pdf = PDF_HTML_TEMPLATE.format(title=html.escape(title or ""), content=html_content)
+    return HTML(string=html_for_pdf).write_pdf()
+
+
+def _render_to_cache(path, render_func, title, html_content):
+    data = render_func(title, html_content)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path) # Atomic, readers never see a partial file
+    _evict_if_needed()
+    return path
+
+
+def _submit_render(kind, doc_id, title, html_content, fmt, slot_timeout=Config.EXPORT_QUEUE_WAIT_SECONDS):
+    """
+    Returns (path, future) for an export. future is None on a cache hit, otherwise it is the
+    (possibly shared) pending render of that exact content. A new render waits up to
+    slot_timeout seconds for a render slot (None waits until one frees up).
+    """
+    os.makedirs(Config.EXPORT_CACHE_PATH, exist_ok=True)
+    path = _cache_path(kind, doc_id, content_hash(title, html_content), fmt)
+    if os.path.exists(path):
+        os.utime(path) # Mark as recently used for eviction
+        return path, None
+
+    with _pending_lock:
+        future = _pending_renders.get(path)
+    if future is not None:
+        return path, future
+    # Waited for outside _pending_lock, so requests joining an existing render never queue behind it
+    if not _render_slots.acquire(timeout=slot_timeout):
+        raise ExportBusyError("Tüm belge oluşturma kapasitesi şu anda kullanımda.")
+    with _pending_lock:
+        # Another request may have started (or finished) the same render while we waited.
+        # A render's file exists before its future leaves _pending_renders, so check in this order.
+        future = _pending_renders.get(path)
+        if future is None and os.path.exists(path):
+            _render_slots.release()
+            return path, None
+        if future is not None:
+            _render_slots.release()
+            return path, future
+        try:
+            render_func = EXPORT_FORMATS[fmt]["render"]
+            future = _get_executor().submit(_render_to_cache, path, render_func, title, html_content)
+        except Exception:
+            _render_slots.release()
+            raise
+        _pending_renders[path] = future
+
+    def _on_done(_):
+        _pending_renders.pop(path, None)
+        _render_slots.release()
+    future.add_done_callback(_on_done)
+    return path, future
+
+
+def get_export(kind, doc_id, title, html_content, fmt):
+    """
+    Returns the path of the cached export, rendering it first if needed.
+    Returns None if a large document is still being rendered in the background.
+    """
+    path, future = _submit_render(kind, doc_id, title, html_content, fmt)
+    if future is None:
+        return path
+    # Small documents are waited for; large ones get a bounded wait and land in the cache later
+    timeout = None if len(html_content) < Config.EXPORT_ASYNC_THRESHOLD_CHARS else Config.EXPORT_RENDER_WAIT_SECONDS
+    try:
+        return future.result(timeout=timeout)
+    except FutureTimeoutError:
+        return None
+
+
+def document_html(doc):
+    """HTML of a Contract/Dilekce/Ifade, falling back to its text version."""
+    if doc.generated_content_html:
+        return doc.generated_content_html
+    if doc.generated_content_text:
+        return text_to_html(doc.generated_content_text)
+    return None
+
+
+def download_name(doc, fmt):
+    title = doc.title or "belge"
+    return f"{title.replace(' ', '_').lower()}_{doc.id}.{fmt}"
+
+
+def export_response(kind, doc, fmt, back_url):
+    """Shared export endpoint body: sends the cached file or flashes a Turkish message and redirects."""
+    label = EXPORT_FORMATS[fmt]["label"]
+    html_content = document_html(doc)
+    if not html_content:
+        flash(f'Belge içeriği bulunamadı, {label} oluşturulamıyor.', 'danger')
+        return redirect(back_url)
+    try:
+        path = get_export(kind, doc.id, doc.title, html_content, fmt)
+    except ExportBusyError:
+        flash('Sistem şu anda yoğun, lütfen birkaç saniye sonra tekrar deneyin.', 'warning')
+        return redirect(back_url)
+    except Exception as e:
+        current_app.logger.error(f"{label} oluşturulurken hata ({kind} {doc.id}): {e}")
+        flash(f"{label} oluşturulurken bir hata oluştu: {str(e)}", 'danger')
+        return redirect(back_url)
+    if path is None:
+        flash(f'{label} hazırlanıyor, lütfen birkaç saniye sonra tekrar deneyin.', 'info')
+        return redirect(back_url)
+    return send_file(path, mimetype=EXPORT_FORMATS[fmt]["mimetype"], as_attachment=True,
+                     download_name=download_name(doc, fmt))
+
+
+def build_zip(documents, fmt):
+    """
+    Renders many (kind, doc) pairs in parallel on the pool and returns a zip archive as BytesIO.
+    Documents without content are skipped. At most EXPORT_MAX_CONCURRENT_RENDERS of the zip's
+    renders are in flight; further documents wait for a slot instead of failing the zip.
+    """
+    archive = BytesIO()
+    used_names = set()
+    in_flight = deque()
+
+    def add(doc, path, future):
+        if future is not None:
+            future.result()
+        name = download_name(doc, fmt)
+        if name in used_names:
+            name = f"{len(used_names)}_{name}"
+        used_names.add(name)
+        zf.write(path, arcname=name)
+
+    # PDF and DOCX are already compressed, storing avoids burning CPU for nothing
+    with zipfile.ZipFile(archive, "w", compression=zipfile.ZIP_STORED) as zf:
+        for kind, doc in documents:
+            html_content = document_html(doc)
+            if not html_content:
+                continue
+            if len(in_flight) >= Config.EXPORT_MAX_CONCURRENT_RENDERS:
+                add(*in_flight.popleft())
+            path, future = _submit_render(kind, doc.id, doc.title, html_content, fmt, slot_timeout=None)
+            if future is None:
+                add(doc, path, None)
+            else:
+                in_flight.append((doc, path, future))
+        while in_flight:
+            add(*in_flight.popleft())
+    archive.seek(0)
+    return archive
+
+
+class _DocxBuilder(HTMLParser):
+    """
+    Single-pass HTML -> python-docx converter. Maps h1-h3 to Word headings, p to Normal,
+    ul/ol/li to List Bullet/List Number (nested up to 3 levels), strong/b and em/i to runs.
+    """
+    HEADING_TAGS = {"h1": 1, "h2": 2, "h3": 3, "h4": 3, "h5": 3, "h6": 3}
+    BLOCK_TAGS = {"p", "div", "td", "th", "blockquote", "pre"}
+    SKIP_TAGS = {"style", "script", "head", "title"}
+
+    def __init__(self, document):
+        super().__init__(convert_charrefs=True)
+        self.document = document
+        self.paragraph = None
+        self.list_stack = [] # 'ul' / 'ol' for each open list
+        self.bold = 0
+        self.italic = 0
+        self.skip = 0
+        self.style_ids = {} # style name -> style id, resolving by name is the slow part of python-docx
+
+    def _new_paragraph(self, style=None):
+        self.paragraph = self.document.add_paragraph()
+        if style:
+            style_id = self.style_ids.get(style)
+            if style_id is None:
+                style_id = self.style_ids[style] = self.document.styles[style].style_id
+            self.paragraph._p.style = style_id
+        return self.paragraph
+
+    def _list_style(self):
+        base = "List Number" if self.list_stack and self.list_stack[-1] == "ol" else "List Bullet"
+        depth = min(len(self.list_stack), 3)
+        return base if depth <= 1 else f"{base} {depth}"
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP_TAGS:
+            self.skip += 1
+        elif tag in self.HEADING_TAGS:
+            self._new_paragraph(style=f"Heading {self.HEADING_TAGS[tag]}")
+        elif tag in self.BLOCK_TAGS:
+            self._new_paragraph()
+        elif tag in ("ul", "ol"):
+            self.list_stack.append(tag)
+            self.paragraph = None
+        elif tag == "li":
+            self._new_paragraph(style=self._list_style())
+        elif tag in ("strong", "b"):
+            self.bold += 1
+        elif tag in ("em", "i"):
+            self.italic += 1
+        elif tag == "br":
+            if self.paragraph is not None:
+                self.paragraph.add_run().add_break()
+        elif tag == "hr":
+            self._new_paragraph()
+            self.paragraph = None
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in ("br", "hr"):
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP_TAGS:
+            self.skip = max(self.skip - 1, 0)
+        elif tag in self.HEADING_TAGS or tag in self.BLOCK_TAGS or tag == "li":
+            self.paragraph = None
+        elif tag in ("ul", "ol"):
+            if self.list_stack:
+                self.list_stack.pop()
+            self.paragraph = None
+        elif tag in ("strong", "b"):
+            self.bold = max(self.bold - 1, 0)
+        elif tag in ("em", "i"):
+            self.italic = max(self.italic - 1, 0)
+
+    def handle_data(self, data):
+        if self.skip:
+            return
+        text = re.sub(r"\s+", " ", data)
+        if self.paragraph is None:
+            text = text.lstrip()
+            if not text:
+                return
+            self._new_paragraph(style=self._list_style() if self.list_stack else None)
+        elif not self.paragraph.runs:
+            text = text.lstrip()
+        if not text:
+            return
+        run = self.paragraph.add_run(text)
+        if self.bold:
+            run.bold = True
+        if self.italic:
+            run.italic = True
+
+
+def render_docx_bytes(title, html_content):
+    """Renders a document to DOCX bytes, preserving headings, lists and emphasis."""
+    from docx import Document # Imported lazily, only needed when rendering
+    document = Document()
+    document.add_heading(title or "", level=1)
+    builder = _DocxBuilder(document)
+    builder.feed(html_content)
+    builder.close()
+    file_stream = BytesIO()
+    document.save(file_stream)
+    return file_stream.getvalue()
+
+
+def text_to_html(text_content):
+    """Wraps plain text lines in paragraphs for documents that only have a text version."""
+    return "\n".join(f"<p>{html.escape(line)}</p>" for line in (text_content or "").split("\n"))
+
+
+EXPORT_FORMATS = {
+    "pdf": {"label": "PDF", "mimetype": "application/pdf", "render": render_pdf_bytes},
+    "docx": {"label": "Word belgesi",
+             "mimetype": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+             "render": render_docx_bytes},
+}
+
+
+if __name__ == '__main__':
+    # Throughput benchmark for the HTML -> DOCX converter.
+    # Usage: python export_service.py
+    import time
+    section = ("<h2>Madde {n}</h2><p>Taraflar <strong>işbu madde</strong> kapsamında <em>aşağıdaki</em> "
+               "yükümlülükleri kabul eder &amp; taahhüt eder.</p><ul><li>Birinci yükümlülük</li>"
+               "<li>İkinci yükümlülük<ol><li>Alt madde</li></ol></li></ul>")
+    sample_html = "<h1>Örnek Sözleşme</h1>" + "".join(section.format(n=n) for n in range(1, 301))
+    runs = 5
+    started = time.perf_counter()
+    for _ in range(runs):
+        output = render_docx_bytes("Örnek Sözleşme", sample_html)
+    elapsed = (time.perf_counter() - started) / runs
+    print(f"[bench] html->docx: {len(sample_html) / 1024:.0f} KB HTML in {elapsed * 1000:.1f} ms "
+          f"({len(sample_html) / 1024 / 1024 / elapsed:.2f} MB/s), {len(output) / 1024:.0f} KB DOCX")
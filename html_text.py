@@ -0,0 +1,179 @@
+"""
+HTML to plain text for generated documents (contracts, dilekçeler, ifadeler) and their edits.
+
+The document is tokenized once: whitespace is collapsed, then a single split on tags gives
+[text, tag, text, tag, ..., text] and each tag is mapped to the text it stands for ("\n\n" for
+paragraph-level blocks, "\n" for line-level ones, "" for inline tags). Lists carry state
+(nesting, numbering), so their tags map to markers resolved in a second walk over the tags
+only. Entities are decoded with html.unescape after the tags are gone.
+
+Benchmark against the regex chain it replaced, on ~100 KB documents:
+    python html_text.py
+"""
+import re
+from html import unescape
+from itertools import compress
+
+_INDENT = "\x03" # One nesting level of a list item, kept out of whitespace handling
+_LIST_ITEM = "\x05"
+_ORDERED_LIST = "\x06"
+_UNORDERED_LIST = "\x07"
+_LIST_END = "\x08"
+_LIST_MARKERS = {_LIST_ITEM, _ORDERED_LIST, _UNORDERED_LIST, _LIST_END}
+_REPARSE = "\x0e" # <style>, <script> or a comment: their contents are not text and may contain '>'
+
+_PARAGRAPH_TAGS = ("p", "h1", "h2", "table", "blockquote", "pre", "hr")
+_LINE_TAGS = ("h3", "h4", "h5", "h6", "div", "dl")
+_NAME_TEXT = {}
+for _name in _PARAGRAPH_TAGS:
+    _NAME_TEXT[_name] = _NAME_TEXT["/" + _name] = "\n\n"
+for _name in _LINE_TAGS:
+    _NAME_TEXT[_name] = _NAME_TEXT["/" + _name] = "\n"
+# Rows/terms break before they start, so consecutive ones stay on consecutive lines
+_NAME_TEXT.update({"tr": "\n", "dt": "\n", "dd": "\n", "br": "\n", "td": " ", "th": " ",
+                   "li": _LIST_ITEM, "ol": _ORDERED_LIST, "ul": _UNORDERED_LIST,
+                   "/ol": _LIST_END, "/ul": _LIST_END, "style": _REPARSE, "script": _REPARSE})
+_TAG_TEXT = dict(_NAME_TEXT) # Whole tag contents ('p', 'p class="x"', 'br/') -> text, filled as seen
+
+# Splitting on whole tags and looking their contents up is several times faster than a
+# pattern that captures the tag name
+_TAG_SPLIT_RE = re.compile(r"<([^>]*)>")
+_NOT_TEXT_RE = re.compile(r"<!--.*?-->|<(style|script)\b[^>]*>.*?</\1\s*>", re.DOTALL | re.IGNORECASE)
+_MULTI_SPACE_RE = re.compile("  +")
+_BLANK_LINES_RE = re.compile("\n\n\n+")
+
+
+def _tag_text(tag):
+    """The text a tag stands for, from its contents between '<' and '>'."""
+    if tag.startswith("!--"):
+        return _REPARSE
+    name = tag.split(None, 1)[0].rstrip("/").lower() if tag.strip() else ""
+    text = _NAME_TEXT.get(name, "")
+    if len(_TAG_TEXT) < 10000: # Attributes make contents unbounded; the cache is not
+        _TAG_TEXT[tag] = text
+    return text
+
+
+def _collapse_spaces(text):
+    # str.replace plus a literal-prefixed regex is several times faster than re.sub(r"\s+", ...)
+    for char in "\n\t\r\f\v\xa0":
+        if char in text:
+            text = text.replace(char, " ")
+    return _MULTI_SPACE_RE.sub(" ", text)
+
+
+def _tokenize(text):
+    """([text, tag text, text, tag text, ..., text], [tag text, ...]) with whitespace collapsed."""
+    pieces = _TAG_SPLIT_RE.split(_collapse_spaces(text))
+    tags = list(map(_TAG_TEXT.get, pieces[1::2])) # map() with a C function, no per-tag bytecode
+    if None in tags: # Tags not seen before
+        tags = [_tag_text(tag) if known is None else known for tag, known in zip(pieces[1::2], tags)]
+    pieces[1::2] = tags
+    return pieces, tags
+
+
+def _resolve_lists(pieces, tags):
+    """Replaces list markers with item prefixes in place; returns True if any item is nested."""
+    nested = False
+    lists = [] # One entry per open list: None for <ul>, the next item number for <ol>
+    for i in compress(range(1, len(pieces), 2), map(_LIST_MARKERS.__contains__, tags)):
+        marker = pieces[i]
+        if marker is _LIST_ITEM:
+            depth = len(lists) - 1 if lists else 0
+            indent = ""
+            if depth:
+                nested = True
+                indent = _INDENT * depth
+            if lists and lists[-1] is not None:
+                pieces[i] = f"\n{indent}{lists[-1]}. "
+                lists[-1] += 1
+            else:
+                pieces[i] = f"\n{indent}- "
+            continue
+        if marker is _LIST_END:
+            if lists:
+                lists.pop()
+        else:
+            lists.append(1 if marker is _ORDERED_LIST else None)
+        # Nested lists continue on the next item's line; top-level lists are blocks
+        pieces[i] = "" if lists else "\n\n"
+    return nested
+
+
+def html_to_text(html_content):
+    """
+    Converts generated HTML to plain text in one tokenizing pass: headings and paragraphs become
+    blank-line separated blocks, list items become '- ' / '1. ' lines (indented when nested),
+    <br> becomes a line break, entities are decoded and whitespace is collapsed.
+    """
+    if not html_content:
+        return ""
+
+    pieces, tags = _tokenize(html_content)
+    if _REPARSE in tags: # Rare in generated content, so only pay for the regex when needed
+        pieces, tags = _tokenize(_NOT_TEXT_RE.sub("", html_content))
+    nested = _resolve_lists(pieces, tags) if _LIST_ITEM in tags else False
+    text = "".join(pieces)
+
+    if "&" in text:
+        if text.count("&") == text.count("&amp;"): # The only entity model output commonly has
+            text = text.replace("&amp;", "&")
+        else:
+            text = unescape(text)
+            if "\xa0" in text: # &nbsp;
+                text = _MULTI_SPACE_RE.sub(" ", text.replace("\xa0", " "))
+    # Whitespace next to a break (e.g. between '</li>' and '<li>'), then at most one blank line.
+    # Stripping split lines beats str.replace(" \n", ...): two-character searches are slow on
+    # non-ASCII (Turkish) text.
+    text = "\n".join([line.strip(" ") for line in text.split("\n")])
+    text = _BLANK_LINES_RE.sub("\n\n", text)
+    if nested:
+        text = text.replace(_INDENT, "  ")
+    return text.strip()
+
+
+if __name__ == '__main__':
+    # Benchmark against the previous regex chain (ai.html_to_text) on ~100 KB generated documents.
+    # Usage: python html_text.py
+    def regex_chain_html_to_text(html_content):
+        text = html_content
+        text = re.sub(r'<style[^>]*?>.*?</style>', '', text, flags=re.DOTALL | re.IGNORECASE)
+        text = re.sub(r'<script[^>]*?>.*?</script>', '', text, flags=re.DOTALL | re.IGNORECASE)
+        text = re.sub(r'<h1>(.*?)</h1>', r'\1\n\n', text, flags=re.IGNORECASE)
+        text = re.sub(r'<h2>(.*?)</h2>', r'\1\n\n', text, flags=re.IGNORECASE)
+        text = re.sub(r'<h3>(.*?)</h3>', r'\1\n', text, flags=re.IGNORECASE)
+        text = re.sub(r'</p>\s*<p>', '\n\n', text, flags=re.IGNORECASE)
+        text = re.sub(r'<p>', '', text, flags=re.IGNORECASE)
+        text = re.sub(r'</p>', '\n', text, flags=re.IGNORECASE)
+        text = re.sub(r'<br\s*/?>', '\n', text, flags=re.IGNORECASE)
+        text = re.sub(r'<li>', '\n- ', text, flags=re.IGNORECASE)
+        text = re.sub(r'<[^>]+>', ' ', text)
+        text = re.sub(r'\n\s*\n', '\n\n', text)
+        text = text.replace('&nbsp;', ' ')
+        text = text.replace('&', '&')
+        text = text.replace('<', '<')
+        text = text.replace('>', '>')
+        text = text.replace('"', '"')
+        text = text.replace('&#39;', "'")
+        return text.strip()
+
+    import timeit
+    prose = ("İşbu sözleşme kapsamında taraflar, karşılıklı olarak aşağıdaki yükümlülükleri kabul ve taahhüt eder; "
+             "yükümlülüklerin ifasında Türk Borçlar Kanunu hükümleri ve dürüstlük kuralı esas alınır. ")
+    sections = {
+        "tag-heavy": ("<h2>Madde {n} - Tarafların Yükümlülükleri</h2>\n<p>İşbu sözleşme kapsamında taraflar, "
+                      "<strong>karşılıklı olarak</strong> aşağıdaki yükümlülükleri kabul ve taahhüt eder &amp; "
+                      "<em>iyi niyet</em> kurallarına uygun davranır.</p>\n<ol>\n<li>Birinci yükümlülük.</li>\n"
+                      "<li>İkinci yükümlülük;<br>ayrıntılar.</li>\n</ol>\n"),
+        "prose": ("<h2>Madde {n}</h2>\n<p>" + prose * 3 + "<strong>Önemli:</strong> " + prose + "</p>\n<p>"
+                  + prose * 2 + "</p>\n<ul>\n<li>" + prose + "</li>\n<li>" + prose + "</li>\n</ul>\n"),
+    }
+    for doc_name, section in sections.items():
+        sample_html = "<h1>Örnek Sözleşme</h1>\n"
+        n = 1
+        while len(sample_html.encode("utf-8")) < 100 * 1024:
+            sample_html += section.format(n=n)
+            n += 1
+        for name, func in (("regex chain", regex_chain_html_to_text), ("single pass", html_to_text)):
+            elapsed = min(timeit.repeat(lambda: func(sample_html), number=10, repeat=7)) / 10
+            print(f"[bench] {doc_name} {len(sample_html.encode('utf-8')) / 1024:.0f} KB, {name}: {elapsed * 1000:.2f} ms")
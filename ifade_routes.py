@@ -1,7 +1,12 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, abort, current_app
 from flask_login import login_required, current_user
+from sqlalchemy.orm import defer
 from models import db, Ifade, User
+from pagination import keyset_paginate
 from ai import generate_ifade_with_ai
+from usage import QuotaExceededError, LLMBusyError
+import export_service
+from html_text import html_to_text
 import datetime
 import json # For handling JSON data if needed directly
 
@@ -21,8 +26,13 @@ def ifade_hub():
     """
     Displays the hub page for selecting a type of statement to create.
     """
-    user_ifadeler = Ifade.query.filter_by(user_id=current_user.id, is_deleted=False).order_by(Ifade.created_at.desc()).all()
-    return render_template('ifade/ifade_hub.html', title="İfade Hazırlama Merkezi", ifade_types=IFADE_TYPES, user_ifadeler=user_ifadeler)
+    ifadeler_query = Ifade.query.filter_by(user_id=current_user.id, is_deleted=False).options(
+        defer(Ifade.generated_content_html), defer(Ifade.generated_content_text))
+    ifadeler_page = keyset_paginate(ifadeler_query, Ifade.created_at, Ifade.id,
+                                    cursor=request.args.get('after'),
+                                    per_page=current_app.config['LIST_PAGE_SIZE'])
+    return render_template('ifade/ifade_hub.html', title="İfade Hazırlama Merkezi", ifade_types=IFADE_TYPES,
+                           user_ifadeler=ifadeler_page.items, next_cursor=ifadeler_page.next_cursor)
 
 @ifade_bp.route('/olustur/<ifade_type_key>', methods=['GET', 'POST'])
 @login_required
@@ -77,11 +87,17 @@ def create_ifade(ifade_type_key):
             ai_input_data['itham_edilen_suc'] = form_data.get('itham_edilen_suc', '')
 
 
-        generated_html, generated_text = generate_ifade_with_ai(
-            ifade_type_name=ifade_type_details['name'],
-            form_inputs_dict=ai_input_data,
-            custom_prompt_text=custom_prompt
-        )
+        try:
+            generated_html, generated_text = generate_ifade_with_ai(
+                ifade_type_name=ifade_type_details['name'],
+                form_inputs_dict=ai_input_data,
+                custom_prompt_text=custom_prompt,
+                user_id=current_user.id,
+                document_kind=ifade_type_key
+            )
+        except (QuotaExceededError, LLMBusyError) as e:
+            flash(str(e), 'warning')
+            return render_template('ifade/ifade_create.html', title=page_title, ifade_type_key=ifade_type_key, ifade_type_details=ifade_type_details, form_data=form_data, current_datetime=datetime.datetime.now())
 
         if "Yapay zeka modeli başlatılamadığı için" in generated_text or "bir hata meydana geldi" in generated_text:
             flash(f'İfade oluşturulurken bir hata oluştu: {generated_text}', 'danger')
@@ -148,16 +164,13 @@ def update_ifade_content(ifade_id):
     if new_html_content is None:
         return jsonify({'status': 'error', 'message': 'İçerik bulunamadı.'}), 400
 
-    # Potentially generate new text content from HTML if needed, or store as is
-    # from ai import html_to_text # Ensure html_to_text is accessible
-    # new_text_content = html_to_text(new_html_content)
-
     ifade.generated_content_html = new_html_content
-    # ifade.generated_content_text = new_text_content # If you re-generate text
+    ifade.generated_content_text = html_to_text(new_html_content)
     ifade.updated_at = datetime.datetime.utcnow()
     
     try:
         db.session.commit()
+        export_service.invalidate('ifade', ifade.id)
         return jsonify({'status': 'success', 'message': 'İfade başarıyla güncellendi.'})
     except Exception as e:
         db.session.rollback()
@@ -176,8 +189,20 @@ def delete_ifade(ifade_id):
     ifade_to_delete.is_deleted = True
     ifade_to_delete.deleted_at = datetime.datetime.utcnow()
     db.session.commit()
+    export_service.invalidate('ifade', ifade_to_delete.id)
     
     flash(f"'{ifade_to_delete.title or 'İsimsiz İfade'}' başarıyla silindi.", "success")
     return redirect(url_for('ifade.ifade_hub'))
 
+@ifade_bp.route('/disa-aktar/<string:fmt>/<int:ifade_id>')
+@login_required
+def export_ifade(fmt, ifade_id):
+    """
+    Downloads a statement as PDF or DOCX through the shared export service.
+    """
+    if fmt not in export_service.EXPORT_FORMATS:
+        abort(404)
+    ifade = Ifade.query.filter_by(id=ifade_id, user_id=current_user.id, is_deleted=False).first_or_404()
+    return export_service.export_response('ifade', ifade, fmt, url_for('ifade.view_ifade', ifade_id=ifade_id))
+
 # Add other routes as needed, e.g., for editing existing statements, listing all, etc.
@@ -0,0 +1,229 @@
+"""
+LLM backends behind one interface. Every provider speaks the OpenAI chat completions API, so
+each one is a ChatOpenAI pointed at a different base URL:
+  openai - api.openai.com (or OPENAI_BASE_URL)
+  groq   - Groq's OpenAI-compatible endpoint
+  local  - a llama.cpp / vLLM / Ollama server at LOCAL_LLM_BASE_URL, for offline and air-gapped installs
+The model for each call is picked by ai.route_llm from the specs in config (LLM_CHAT_FAST, LLM_CHAT,
+LLM_DRAFT, LLM_DRAFT_STRONG, LLM_TITLE), written as "provider:model". Calls to a
+provider share one pooled httpx.Client, so they reuse keep-alive connections instead of opening
+(and TLS-handshaking) a new one per call.
+
+Embeddings use the same spec format (EMBEDDING_MODEL):
+  openai      - OpenAI embeddings API
+  huggingface - a sentence-transformers model run in-process on the CPU, batched, no network
+An embedding spec may end in "@<dimensions>" (openai:text-embedding-3-small@512) to store
+shorter vectors: OpenAI's `dimensions` parameter, or truncate_dim for Matryoshka-trained
+sentence-transformers models. The spec a PDF was indexed with, dimensions included, is stored
+on PDFDocument.embedding_model, so its queries are always embedded the same way.
+
+Benchmark against a local stub server (or real backends given as specs):
+    python llm_providers.py [--requests N] [--concurrency C] [--delay-ms D] [provider:model ...]
+"""
+import threading
+from config import Config
+
+
+LLM_PROVIDERS = ("openai", "groq", "local")
+EMBEDDING_PROVIDERS = ("openai", "huggingface")
+# Collections indexed before embedding_model was recorded
+LEGACY_EMBEDDING_SPEC = "openai:text-embedding-3-small"
+
+
+def parse_spec(spec, providers=LLM_PROVIDERS):
+    provider, _, model = spec.partition(":")
+    if provider not in providers or not model:
+        raise ValueError(f"Invalid model spec '{spec}', expected {'|'.join(providers)}:<model>")
+    return provider, model
+
+
+def model_name(spec):
+    return split_dimensions(spec)[0].partition(":")[2]
+
+
+def split_dimensions(spec):
+    """"openai:text-embedding-3-small@512" -> ("openai:text-embedding-3-small", 512); no suffix -> (spec, None)."""
+    base, separator, dimensions = spec.partition("@")
+    if not separator:
+        return spec, None
+    if not dimensions.isdigit() or int(dimensions) <= 0:
+        raise ValueError(f"Invalid embedding dimensions in '{spec}', expected <provider>:<model>@<positive integer>")
+    return base, int(dimensions)
+
+
+# USD per million (input, output) tokens, for the per-route cost on /metrics; unknown and local models count as free
+MODEL_PRICES_PER_MILLION = {
+    "gpt-4.1-nano": (0.10, 0.40),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4.1": (2.00, 8.00),
+    "gpt-4o-mini": (0.15, 0.60),
+    "llama3-8b-8192": (0.05, 0.08),
+    "text-embedding-3-small": (0.02, 0.0),
+    "text-embedding-3-large": (0.13, 0.0),
+}
+
+
+def estimate_cost(model, input_tokens, output_tokens):
+    input_price, output_price = MODEL_PRICES_PER_MILLION.get(model, (0.0, 0.0))
+    return (input_tokens * input_price + output_tokens * output_price) / 1_000_000
+
+
+def _endpoint(provider):
+    """(base_url, api_key) of a provider; base_url None means the OpenAI default."""
+    if provider == "openai":
+        return Config.OPENAI_BASE_URL, Config.OPENAI_API_KEY
+    if provider == "groq":
+        return Config.GROQ_BASE_URL, Config.GROQ_API_KEY
+    return Config.LOCAL_LLM_BASE_URL, Config.LOCAL_LLM_API_KEY or "local" # Local servers usually ignore the key
+
+
+def is_configured(spec):
+    provider, _ = parse_spec(spec)
+    base_url, api_key = _endpoint(provider)
+    return bool(base_url if provider == "local" else api_key)
+
+
+_http_clients = {}
+_http_clients_lock = threading.Lock()
+
+
+def new_http_client(max_keepalive=None):
+    import httpx
+    return httpx.Client(
+        limits=httpx.Limits(max_connections=Config.LLM_HTTP_MAX_CONNECTIONS,
+                            max_keepalive_connections=Config.LLM_HTTP_KEEPALIVE_CONNECTIONS if max_keepalive is None else max_keepalive),
+        timeout=httpx.Timeout(Config.LLM_HTTP_TIMEOUT_SECONDS, connect=10.0),
+    )
+
+
+def get_http_client(provider):
+    """The connection pool shared by every model of a provider (per worker process)."""
+    client = _http_clients.get(provider)
+    if client is None:
+        with _http_clients_lock:
+            client = _http_clients.get(provider)
+            if client is None:
+                client = _http_clients[provider] = new_http_client()
+    return client
+
+
+def create_chat_model(spec, http_client=None, **params):
+    """A LangChain chat model for the spec; params (temperature, max_tokens, ...) go to ChatOpenAI."""
+    from langchain_openai import ChatOpenAI
+    provider, model = parse_spec(spec)
+    base_url, api_key = _endpoint(provider)
+    if not is_configured(spec):
+        raise ValueError(f"LLM provider '{provider}' is not configured")
+    return ChatOpenAI(model=model, api_key=api_key, base_url=base_url,
+                      http_client=http_client or get_http_client(provider), **params)
+
+
+def create_embeddings(spec, **client_params):
+    """A LangChain embeddings object for an EMBEDDING_PROVIDERS spec; client_params (timeout, ...) are for OpenAI."""
+    spec, dimensions = split_dimensions(spec)
+    provider, model = parse_spec(spec, EMBEDDING_PROVIDERS)
+    if provider == "openai":
+        from langchain_openai import OpenAIEmbeddings
+        return OpenAIEmbeddings(model=model, dimensions=dimensions, api_key=Config.OPENAI_API_KEY,
+                                base_url=Config.OPENAI_BASE_URL, http_client=get_http_client("openai"), **client_params)
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+    if Config.LOCAL_EMBEDDING_THREADS:
+        import torch
+        torch.set_num_threads(Config.LOCAL_EMBEDDING_THREADS)
+    return HuggingFaceEmbeddings(
+        model_name=model,
+        model_kwargs={"device": "cpu", "backend": Config.LOCAL_EMBEDDING_BACKEND,
+                      **({"truncate_dim": dimensions} if dimensions else {})},
+        # Whole batches go through the model at once; normalized vectors make distance cosine-like
+        encode_kwargs={"batch_size": Config.LOCAL_EMBEDDING_BATCH_SIZE, "normalize_embeddings": True},
+    )
+
+
+# --- Benchmark ---
+
+def run_stub_server(delay_seconds, completion_tokens=60, fail_rate=0.0, slow_rate=0.0, slow_seconds=0.0):
+    """
+    OpenAI-compatible /chat/completions stub answering after a fixed delay; returns (server, base_url).
+    For fault injection, fail_rate of the requests get a 503 and slow_rate hang for slow_seconds;
+    both can be changed on the returned server while it runs.
+    """
+    import json
+    import random
+    import time
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1" # Keep-alive, like real servers
+
+        def _send_json(self, status, body):
+            body = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            request_body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            roll = random.random()
+            if roll < self.server.fail_rate:
+                self._send_json(503, {"error": {"message": "Injected failure", "type": "server_error"}})
+                return
+            time.sleep(slow_seconds if roll < self.server.fail_rate + self.server.slow_rate else delay_seconds)
+            self._send_json(200, {
+                "id": "chatcmpl-stub", "object": "chat.completion", "created": int(time.time()),
+                "model": request_body.get("model", "stub"),
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": "Bu bir test cevabıdır. " * 10}}],
+                "usage": {"prompt_tokens": 20, "completion_tokens": completion_tokens, "total_tokens": 20 + completion_tokens},
+            })
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.fail_rate, server.slow_rate = fail_rate, slow_rate
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+def benchmark(spec, requests, concurrency, http_client=None):
+    """Runs `requests` one-line prompts with `concurrency` threads; returns sorted latencies and wall seconds."""
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+    llm = create_chat_model(spec, http_client=http_client, temperature=0, max_tokens=64, max_retries=0)
+
+    def one_call(_):
+        started = time.perf_counter()
+        llm.invoke("Türk Borçlar Kanunu'nda kira sözleşmesi nasıl tanımlanır? Tek cümleyle cevapla.")
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = sorted(pool.map(one_call, range(requests)))
+    return latencies, time.perf_counter() - started
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Latency/throughput of LLM backends")
+    parser.add_argument("specs", nargs="*", help="provider:model backends; defaults to the stub server")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--delay-ms", type=float, default=20, help="stub server response delay")
+    args = parser.parse_args()
+
+    runs = []
+    if not args.specs:
+        server, Config.LOCAL_LLM_BASE_URL = run_stub_server(args.delay_ms / 1000)
+        runs.append(("local:stub (pooled)", "local:stub", None))
+        runs.append(("local:stub (new connection per call)", "local:stub", new_http_client(max_keepalive=0)))
+    runs.extend((spec, spec, None) for spec in args.specs)
+
+    for label, spec, http_client in runs:
+        benchmark(spec, min(args.concurrency, args.requests), args.concurrency, http_client) # Warm-up
+        latencies, wall = benchmark(spec, args.requests, args.concurrency, http_client)
+        p50 = latencies[len(latencies) // 2]
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        print(f"[bench] {label}: p50 {p50 * 1000:.1f} ms, p95 {p95 * 1000:.1f} ms, "
+              f"{args.requests / wall:.1f} req/s ({args.requests} requests, concurrency {args.concurrency})")
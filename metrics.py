@@ -0,0 +1,230 @@
+"""
+In-process performance metrics exposed in Prometheus text format on /metrics.
+
+Records per-route latency, per-request DB query counts, DB statement latency (SQLAlchemy
+events) and LLM/embedding call latency and token usage. Metrics are kept per worker process;
+with several gunicorn workers each scrape sees the worker that served it.
+"""
+import bisect
+import hmac
+import threading
+import time
+from contextlib import contextmanager
+from flask import Blueprint, Response, current_app, g, has_request_context, request, abort
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from config import Config
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+QUERY_COUNT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_text(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name, help_text, labelnames=()):
+        self.name, self.help_text, self.labelnames = name, help_text, tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues, amount=1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labelvalues, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_label_text(self.labelnames, labelvalues)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help_text, self.labelnames = name, help_text, tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {} # labelvalues -> [per-bucket counts (+Inf last), sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labelvalues, (bucket_counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + ("+Inf",), bucket_counts):
+                    cumulative += bucket_count
+                    le = f'le="{bound}"'
+                    lines.append(f"{self.name}_bucket{_label_text(self.labelnames, labelvalues, le)} {cumulative}")
+                labels = _label_text(self.labelnames, labelvalues)
+                lines.append(f"{self.name}_sum{labels} {total}")
+                lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+REQUEST_LATENCY = Histogram("http_request_duration_seconds", "Request latency by endpoint.",
+                            ("endpoint", "method", "status"))
+REQUEST_DB_QUERIES = Histogram("http_request_db_queries", "SQL statements executed per request.",
+                               ("endpoint",), buckets=QUERY_COUNT_BUCKETS)
+DB_QUERY_LATENCY = Histogram("db_query_duration_seconds", "SQL statement latency by statement type.",
+                             ("statement",))
+LLM_CALL_LATENCY = Histogram("llm_call_duration_seconds", "LLM and embedding call latency.",
+                             ("function", "kind", "outcome"))
+LLM_TOKENS = Counter("llm_tokens_total", "Tokens reported by LLM providers.", ("function", "kind", "direction"))
+LLM_ROUTE_LATENCY = Histogram("llm_route_duration_seconds", "Successful LLM call latency by routing decision.",
+                              ("route", "model"))
+LLM_ROUTE_COST = Counter("llm_route_cost_usd_total", "Estimated LLM spend in USD by routing decision.", ("route", "model"))
+
+REGISTRY = [REQUEST_LATENCY, REQUEST_DB_QUERIES, DB_QUERY_LATENCY, LLM_CALL_LATENCY, LLM_TOKENS,
+            LLM_ROUTE_LATENCY, LLM_ROUTE_COST]
+
+
+def render_metrics():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# --- Database statements (every engine, like the SQLite pragma listener in models.py) ---
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start_times", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start_times = conn.info.get("query_start_times")
+    if not start_times:
+        return
+    elapsed = time.perf_counter() - start_times.pop()
+    DB_QUERY_LATENCY.observe(elapsed, statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "")
+    if has_request_context():
+        g.db_query_count = g.get("db_query_count", 0) + 1
+        g.db_query_seconds = g.get("db_query_seconds", 0.0) + elapsed
+
+
+# --- LLM and embedding calls ---
+
+class LLMCall:
+    """Handed out by llm_call(); collects token usage from whatever the provider returned."""
+
+    def __init__(self, function, kind):
+        self.function = function
+        self.kind = kind
+        self.input_tokens = 0
+        self.output_tokens = 0
+
+    def add_tokens(self, input_tokens=0, output_tokens=0):
+        self.input_tokens += input_tokens or 0
+        self.output_tokens += output_tokens or 0
+
+    def record_usage(self, response):
+        """Reads token usage from a LangChain message (usage_metadata) or an OpenAI-style response (usage)."""
+        usage = getattr(response, "usage_metadata", None)
+        if usage:
+            self.add_tokens(usage.get("input_tokens"), usage.get("output_tokens"))
+            return
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            self.add_tokens(getattr(usage, "prompt_tokens", 0), getattr(usage, "completion_tokens", 0))
+
+    def callback(self):
+        """A LangChain callback handler that adds the usage of every LLM run inside a chain."""
+        from langchain_core.callbacks import BaseCallbackHandler
+        call = self
+
+        class _UsageHandler(BaseCallbackHandler):
+            def on_llm_end(self, response, **kwargs):
+                token_usage = (response.llm_output or {}).get("token_usage") or {}
+                call.add_tokens(token_usage.get("prompt_tokens"), token_usage.get("completion_tokens"))
+
+        return _UsageHandler()
+
+
+@contextmanager
+def llm_call(function, kind="chat"):
+    """Times an LLM/embedding call and records its token usage, tagged by the calling function."""
+    call = LLMCall(function, kind)
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        yield call
+        outcome = "success"
+    finally:
+        LLM_CALL_LATENCY.observe(time.perf_counter() - start, function, kind, outcome)
+        if call.input_tokens:
+            LLM_TOKENS.inc(function, kind, "input", amount=call.input_tokens)
+        if call.output_tokens:
+            LLM_TOKENS.inc(function, kind, "output", amount=call.output_tokens)
+
+
+def record_llm_route(route, model, seconds, cost_usd):
+    """One call served by a route of ai.route_llm; the histogram count doubles as the route's call count."""
+    LLM_ROUTE_LATENCY.observe(seconds, route, model)
+    LLM_ROUTE_COST.inc(route, model, amount=cost_usd)
+
+
+# --- Requests ---
+
+metrics_bp = Blueprint('metrics', __name__)
+
+
+@metrics_bp.route('/metrics')
+def metrics_endpoint():
+    # A token rather than a client address check: behind a reverse proxy every request comes
+    # from the proxy's address. Unauthorized scrapes see the same 404 as a missing page.
+    supplied = request.headers.get("Authorization", "").encode()
+    if not Config.METRICS_TOKEN or not hmac.compare_digest(supplied, f"Bearer {Config.METRICS_TOKEN}".encode()):
+        abort(404)
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
+
+def init_app(app):
+    if not app.config.get('METRICS_ENABLED', True):
+        return
+
+    @app.before_request
+    def _start_timer():
+        g.request_start_time = time.perf_counter()
+        g.db_query_count = 0
+        g.db_query_seconds = 0.0
+
+    @app.after_request
+    def _note_response(response):
+        g.response_status = response.status_code
+        if current_app.debug and "request_start_time" in g:
+            response.headers["X-DB-Query-Count"] = str(g.db_query_count)
+            response.headers["X-DB-Query-Time-Ms"] = f"{g.db_query_seconds * 1000:.1f}"
+        return response
+
+    # Recorded on teardown, which also runs when a view raised and after_request was skipped
+    @app.teardown_request
+    def _record_request(exc):
+        start = g.pop("request_start_time", None)
+        if start is not None:
+            endpoint = request.endpoint or "unmatched"
+            status = 500 if exc is not None else g.get("response_status", 500)
+            REQUEST_LATENCY.observe(time.perf_counter() - start, endpoint, request.method, status)
+            REQUEST_DB_QUERIES.observe(g.db_query_count, endpoint)
+
+    app.register_blueprint(metrics_bp)
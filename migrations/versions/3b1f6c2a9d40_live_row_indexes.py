@@ -0,0 +1,50 @@
+"""live-row listing and lookup indexes
+
+Partial composite indexes over rows that are not soft-deleted (models.live_rows_index),
+replacing the single-column is_deleted indexes of the original schema and the full
+(user_id, is_deleted, created_at) listing indexes an earlier version of the models declared
+under the same names.
+
+Revision ID: 3b1f6c2a9d40
+Revises:
+Create Date: 2026-10-19 19:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b1f6c2a9d40'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+LIVE_ROW_INDEXES = (
+    ('ix_pdf_documents_user_listing', 'pdf_documents', ['user_id', 'upload_date']),
+    ('ix_pdf_documents_user_file_hash', 'pdf_documents', ['user_id', 'file_hash']),
+    ('ix_chat_sessions_user_pdf_updated', 'chat_sessions', ['user_id', 'pdf_document_id', 'updated_at']),
+    ('ix_chat_messages_session_timestamp', 'chat_messages', ['chat_session_id', 'timestamp']),
+    ('ix_contracts_user_listing', 'contracts', ['user_id', 'created_at']),
+    ('ix_dilekceler_user_listing', 'dilekceler', ['user_id', 'created_at']),
+    ('ix_ifadeler_user_listing', 'ifadeler', ['user_id', 'created_at']),
+)
+SOFT_DELETE_TABLES = ('users', 'pdf_documents', 'chat_sessions', 'chat_messages', 'contracts', 'dilekceler', 'ifadeler')
+
+
+def upgrade():
+    for table in SOFT_DELETE_TABLES:
+        op.drop_index(f'ix_{table}_is_deleted', table_name=table, if_exists=True)
+    for name, table, columns in LIVE_ROW_INDEXES:
+        # The listing indexes may exist with their old, non-partial definition
+        op.drop_index(name, table_name=table, if_exists=True)
+        op.create_index(name, table, columns,
+                        sqlite_where=sa.text('is_deleted = 0'),
+                        postgresql_where=sa.text('NOT is_deleted'))
+
+
+def downgrade():
+    for name, table, _ in LIVE_ROW_INDEXES:
+        op.drop_index(name, table_name=table)
+    for table in SOFT_DELETE_TABLES:
+        op.create_index(f'ix_{table}_is_deleted', table, ['is_deleted'])
@@ -0,0 +1,42 @@
+"""token_usage table for per-user token accounting
+
+Databases where `flask init-db` already ran after the model existed have the table;
+create_all only adds missing tables, so it is created only if it is not there.
+
+Revision ID: 5e9a0c3b7d21
+Revises: 8c4d2e7f1a53
+Create Date: 2026-10-19 21:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e9a0c3b7d21'
+down_revision = '8c4d2e7f1a53'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if 'token_usage' in sa.inspect(op.get_bind()).get_table_names():
+        return
+    op.create_table(
+        'token_usage',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('feature', sa.String(length=50), nullable=False),
+        sa.Column('model', sa.String(length=100), nullable=False),
+        sa.Column('input_tokens', sa.Integer(), nullable=False),
+        sa.Column('output_tokens', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id']),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_token_usage_user_created', 'token_usage', ['user_id', 'created_at'])
+
+
+def downgrade():
+    op.drop_index('ix_token_usage_user_created', table_name='token_usage')
+    op.drop_table('token_usage')
@@ -0,0 +1,29 @@
+"""pdf_documents.embedding_model
+
+NULL means the collection was embedded with the legacy openai:text-embedding-3-small.
+
+Revision ID: 6f1b2d4c8e90
+Revises: 5e9a0c3b7d21
+Create Date: 2026-10-19 21:15:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6f1b2d4c8e90'
+down_revision = '5e9a0c3b7d21'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    columns = [column['name'] for column in sa.inspect(op.get_bind()).get_columns('pdf_documents')]
+    if 'embedding_model' not in columns: # A database created by create_all after the model changed has it
+        op.add_column('pdf_documents', sa.Column('embedding_model', sa.String(length=200), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('pdf_documents') as batch_op: # SQLite before 3.35 cannot drop columns in place
+        batch_op.drop_column('embedding_model')
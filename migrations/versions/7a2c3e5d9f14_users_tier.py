@@ -0,0 +1,29 @@
+"""users.tier for LLM routing
+
+Existing users get the server default 'standard'.
+
+Revision ID: 7a2c3e5d9f14
+Revises: 6f1b2d4c8e90
+Create Date: 2026-10-19 21:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7a2c3e5d9f14'
+down_revision = '6f1b2d4c8e90'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    columns = [column['name'] for column in sa.inspect(op.get_bind()).get_columns('users')]
+    if 'tier' not in columns: # A database created by create_all after the model changed has it
+        op.add_column('users', sa.Column('tier', sa.String(length=20), nullable=False, server_default='standard'))
+
+
+def downgrade():
+    with op.batch_alter_table('users') as batch_op: # SQLite before 3.35 cannot drop columns in place
+        batch_op.drop_column('tier')
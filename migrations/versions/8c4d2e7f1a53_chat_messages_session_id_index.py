@@ -0,0 +1,26 @@
+"""chat_messages (chat_session_id, id) index for history polling
+
+Revision ID: 8c4d2e7f1a53
+Revises: 3b1f6c2a9d40
+Create Date: 2026-10-19 19:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c4d2e7f1a53'
+down_revision = '3b1f6c2a9d40'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_chat_messages_session_id', 'chat_messages', ['chat_session_id', 'id'],
+                    sqlite_where=sa.text('is_deleted = 0'),
+                    postgresql_where=sa.text('NOT is_deleted'))
+
+
+def downgrade():
+    op.drop_index('ix_chat_messages_session_id', table_name='chat_messages')
@@ -0,0 +1,40 @@
+"""pdf_pages and chat_messages.sources for chat answer citations
+
+Revision ID: 9d3e4f6a0b25
+Revises: 7a2c3e5d9f14
+Create Date: 2026-10-19 21:25:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d3e4f6a0b25'
+down_revision = '7a2c3e5d9f14'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # `flask init-db` on an existing database creates pdf_pages but cannot add the column
+    inspector = sa.inspect(op.get_bind())
+    if 'pdf_pages' not in inspector.get_table_names():
+        op.create_table(
+            'pdf_pages',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('pdf_document_id', sa.Integer(), nullable=False),
+            sa.Column('page_number', sa.Integer(), nullable=False),
+            sa.Column('text', sa.Text(), nullable=False),
+            sa.ForeignKeyConstraint(['pdf_document_id'], ['pdf_documents.id']),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('pdf_document_id', 'page_number', name='uq_pdf_pages_document_page'),
+        )
+    if 'sources' not in [column['name'] for column in inspector.get_columns('chat_messages')]:
+        op.add_column('chat_messages', sa.Column('sources', sa.JSON(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('chat_messages') as batch_op: # SQLite before 3.35 cannot drop columns in place
+        batch_op.drop_column('sources')
+    op.drop_table('pdf_pages')
@@ -1,11 +1,35 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
 import datetime
+import sqlite3
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import relationship
 from werkzeug.security import generate_password_hash, check_password_hash
+from config import Config
+from sqlite_tuning import apply_sqlite_pragmas
 
 db = SQLAlchemy()
 
+
+@event.listens_for(Engine, "connect")
+def _tune_sqlite_connection(dbapi_connection, connection_record):
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        apply_sqlite_pragmas(dbapi_connection, Config.SQLITE_JOURNAL_MODE,
+                             Config.SQLITE_BUSY_TIMEOUT_MS, Config.SQLITE_SYNCHRONOUS)
+
+
+def live_rows_index(name, *columns):
+    """
+    Partial index over rows that are not soft-deleted. Nearly every query filters on
+    is_deleted=False, so the deleted rows only bloat a full index. SQLite matches the
+    `is_deleted = ?` bound by filter_by against `is_deleted = 0`; PostgreSQL rewrites
+    `is_deleted = false` to `NOT is_deleted`.
+    """
+    return db.Index(name, *columns,
+                    sqlite_where=db.text('is_deleted = 0'),
+                    postgresql_where=db.text('NOT is_deleted'))
+
 class User(UserMixin, db.Model):
     __tablename__ = 'users'  # Explicit table name
 
@@ -14,7 +38,8 @@ class User(UserMixin, db.Model):
     email = db.Column(db.String(120), unique=True, nullable=False, index=True)
     password_hash = db.Column(db.String(256)) # Increased length for potentially stronger hashes
     created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
-    is_deleted = db.Column(db.Boolean, default=False, nullable=False, index=True)
+    tier = db.Column(db.String(20), default='standard', server_default='standard', nullable=False) # 'standard' or 'pro'; used for LLM routing
+    is_deleted = db.Column(db.Boolean, default=False, nullable=False)
     deleted_at = db.Column(db.DateTime, nullable=True)
 
     # Relationships
@@ -39,6 +64,10 @@ class User(UserMixin, db.Model):
 
 class PDFDocument(db.Model):
     __tablename__ = 'pdf_documents'
+    __table_args__ = (
+        live_rows_index('ix_pdf_documents_user_listing', 'user_id', 'upload_date'), # Dashboard, newest first
+        live_rows_index('ix_pdf_documents_user_file_hash', 'user_id', 'file_hash'), # Duplicate upload check
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
@@ -49,7 +78,8 @@ class PDFDocument(db.Model):
     upload_date = db.Column(db.DateTime, default=datetime.datetime.utcnow, index=True)
     processed = db.Column(db.Boolean, default=False, nullable=False) # To track if the PDF has been processed by Langchain
     vector_db_collection_name = db.Column(db.String(100)) # Name of the ChromaDB collection for this PDF
-    is_deleted = db.Column(db.Boolean, default=False, nullable=False, index=True) # For soft delete of metadata
+    embedding_model = db.Column(db.String(200), nullable=True) # "provider:model[@dimensions]" the collection was embedded with; NULL = openai:text-embedding-3-small
+    is_deleted = db.Column(db.Boolean, default=False, nullable=False) # For soft delete of metadata
     deleted_at = db.Column(db.DateTime, nullable=True)
 
 
@@ -57,21 +87,39 @@ class PDFDocument(db.Model):
     user = relationship("User", back_populates="pdf_documents")
     chat_messages = relationship("ChatMessage", back_populates="pdf_document") # Removed cascade, will be handled by ChatSession
     chat_sessions = relationship("ChatSession", back_populates="pdf_document", cascade="all, delete-orphan")
+    pages = relationship("PDFPage", back_populates="pdf_document", cascade="all, delete-orphan")
 
 
     def __repr__(self):
         return f"<PDFDocument {self.filename} (User: {self.user_id})>"
 
+class PDFPage(db.Model):
+    """Extracted text of one PDF page; the character offsets of chat answer sources point into it."""
+    __tablename__ = 'pdf_pages'
+    __table_args__ = (db.UniqueConstraint('pdf_document_id', 'page_number', name='uq_pdf_pages_document_page'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    pdf_document_id = db.Column(db.Integer, db.ForeignKey('pdf_documents.id'), nullable=False)
+    page_number = db.Column(db.Integer, nullable=False) # 1-based, as shown to users
+    text = db.Column(db.Text, nullable=False)
+
+    pdf_document = relationship("PDFDocument", back_populates="pages")
+
+    def __repr__(self):
+        return f"<PDFPage {self.page_number} (PDF: {self.pdf_document_id})>"
+
 class ChatSession(db.Model):
     __tablename__ = 'chat_sessions'
+    # A user's sessions for one PDF, most recently active first
+    __table_args__ = (live_rows_index('ix_chat_sessions_user_pdf_updated', 'user_id', 'pdf_document_id', 'updated_at'),)
     id = db.Column(db.Integer, primary_key=True)
     session_uuid = db.Column(db.String(36), unique=True, nullable=False, index=True) # For the UUID
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
     pdf_document_id = db.Column(db.Integer, db.ForeignKey('pdf_documents.id'), nullable=False, index=True)
-    title = db.Column(db.String(255), nullable=True) # Generated by Groq
+    title = db.Column(db.String(255), nullable=True) # Generated by the LLM_TITLE model
     created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow, index=True)
     updated_at = db.Column(db.DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow, index=True) # Last message time
-    is_deleted = db.Column(db.Boolean, default=False, nullable=False, index=True)
+    is_deleted = db.Column(db.Boolean, default=False, nullable=False)
     deleted_at = db.Column(db.DateTime, nullable=True)
 
     user = relationship("User", back_populates="chat_sessions")
@@ -84,6 +132,10 @@ class ChatSession(db.Model):
 
 class ChatMessage(db.Model):
     __tablename__ = 'chat_messages'
+    __table_args__ = (
+        live_rows_index('ix_chat_messages_session_timestamp', 'chat_session_id', 'timestamp'), # A session's history in order
+        live_rows_index('ix_chat_messages_session_id', 'chat_session_id', 'id'), # Messages after a given id (history polling)
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     chat_session_id = db.Column(db.Integer, db.ForeignKey('chat_sessions.id'), nullable=False, index=True)
@@ -93,8 +145,10 @@ class ChatMessage(db.Model):
 
     sender_type = db.Column(db.String(10), nullable=False)  # 'user' or 'ai'
     message_content = db.Column(db.Text, nullable=False)
+    # AI answers: the chunks the answer was based on, [{"page": 1-based, "start": char offset, "end": ...}] (see PDFPage)
+    sources = db.Column(db.JSON, nullable=True)
     timestamp = db.Column(db.DateTime, default=datetime.datetime.utcnow, index=True)
-    is_deleted = db.Column(db.Boolean, default=False, nullable=False, index=True)
+    is_deleted = db.Column(db.Boolean, default=False, nullable=False)
     deleted_at = db.Column(db.DateTime, nullable=True)
 
     # Relationships
@@ -109,6 +163,7 @@ class ChatMessage(db.Model):
 
 class Contract(db.Model):
     __tablename__ = 'contracts'
+    __table_args__ = (live_rows_index('ix_contracts_user_listing', 'user_id', 'created_at'),)
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
@@ -119,7 +174,7 @@ class Contract(db.Model):
     generated_content_text = db.Column(db.Text, nullable=True) # Plain text version, if needed
     created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow, index=True)
     updated_at = db.Column(db.DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
-    is_deleted = db.Column(db.Boolean, default=False, nullable=False, index=True)
+    is_deleted = db.Column(db.Boolean, default=False, nullable=False)
     deleted_at = db.Column(db.DateTime, nullable=True)
 
     # Relationships
@@ -131,6 +186,7 @@ class Contract(db.Model):
 
 class Dilekce(db.Model):
     __tablename__ = 'dilekceler' # Using 'dilekceler' as table name
+    __table_args__ = (live_rows_index('ix_dilekceler_user_listing', 'user_id', 'created_at'),)
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
@@ -141,7 +197,7 @@ class Dilekce(db.Model):
     generated_content_text = db.Column(db.Text, nullable=True) # Plain text version, if needed
     created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow, index=True)
     updated_at = db.Column(db.DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
-    is_deleted = db.Column(db.Boolean, default=False, nullable=False, index=True)
+    is_deleted = db.Column(db.Boolean, default=False, nullable=False)
     deleted_at = db.Column(db.DateTime, nullable=True)
 
     # Relationships
@@ -153,6 +209,7 @@ class Dilekce(db.Model):
 
 class Ifade(db.Model):
     __tablename__ = 'ifadeler' # Using 'ifadeler' as table name
+    __table_args__ = (live_rows_index('ix_ifadeler_user_listing', 'user_id', 'created_at'),)
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
@@ -163,7 +220,7 @@ class Ifade(db.Model):
     generated_content_text = db.Column(db.Text, nullable=True) # Plain text version, if needed
     created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow, index=True)
     updated_at = db.Column(db.DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
-    is_deleted = db.Column(db.Boolean, default=False, nullable=False, index=True)
+    is_deleted = db.Column(db.Boolean, default=False, nullable=False)
     deleted_at = db.Column(db.DateTime, nullable=True)
 
     # Relationships
@@ -173,13 +230,23 @@ class Ifade(db.Model):
         return f"<Ifade {self.id} (Type: {self.ifade_type}, User: {self.user_id})>"
 
 
+class TokenUsage(db.Model):
+    """Tokens spent by one LLM or embedding call (see usage.metered_call)."""
+    __tablename__ = 'token_usage'
+    __table_args__ = (db.Index('ix_token_usage_user_created', 'user_id', 'created_at'),) # Daily budget sum
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    feature = db.Column(db.String(50), nullable=False) # 'chat', 'chat_title', 'contract', 'dilekce', 'ifade', 'embedding'
+    model = db.Column(db.String(100), nullable=False)
+    input_tokens = db.Column(db.Integer, nullable=False, default=0)
+    output_tokens = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f"<TokenUsage {self.feature} {self.input_tokens}+{self.output_tokens} (User: {self.user_id})>"
+
+
 def init_app(app):
-    """Initializes the database with the Flask app."""
+    """Initializes the database with the Flask app. Tables are created by `flask init-db`."""
     db.init_app(app)
-
-    with app.app_context():
-        # Import models here to ensure they are registered with SQLAlchemy
-        # before create_all is called.
-        # from . import models # This line can cause circular import if not careful
-        db.create_all()
-        print("Database tables created or already exist.")
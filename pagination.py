@@ -0,0 +1,54 @@
+import datetime
+from sqlalchemy import literal, tuple_
+
+
+class KeysetPage:
+    """One page of a newest-first listing plus the cursor for the next (older) page."""
+
+    def __init__(self, items, next_cursor):
+        self.items = items
+        self.next_cursor = next_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+
+def encode_cursor(sort_value, row_id):
+    return f"{sort_value.isoformat()}_{row_id}"
+
+
+def decode_cursor(cursor):
+    """Returns (sort_value, row_id) or None for a missing or malformed cursor."""
+    if not cursor:
+        return None
+    try:
+        sort_part, id_part = cursor.rsplit('_', 1)
+        return datetime.datetime.fromisoformat(sort_part), int(id_part)
+    except ValueError:
+        return None
+
+
+def keyset_query(query, sort_column, id_column, cursor=None):
+    """Orders a query newest-first by (sort_column, id_column), starting after the cursor if given."""
+    position = decode_cursor(cursor)
+    if position is not None:
+        sort_value, row_id = position
+        query = query.filter(tuple_(sort_column, id_column) <
+                             tuple_(literal(sort_value, sort_column.type), literal(row_id, id_column.type)))
+    return query.order_by(sort_column.desc(), id_column.desc())
+
+
+def keyset_paginate(query, sort_column, id_column, cursor=None, per_page=25):
+    """
+    Pages a query newest-first by (sort_column, id_column). Instead of OFFSET, the cursor holds
+    the last row's key, so each page is an index range scan no matter how deep the user goes.
+    """
+    rows = keyset_query(query, sort_column, id_column, cursor).limit(per_page + 1).all()
+
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, sort_column.key), getattr(last, id_column.key))
+    return KeysetPage(rows, next_cursor)
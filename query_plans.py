@@ -0,0 +1,71 @@
+import datetime
+from sqlalchemy.orm import defer, joinedload
+from models import db, PDFDocument, ChatSession, ChatMessage, Contract, Dilekce, Ifade
+from pagination import keyset_query, encode_cursor
+
+
+def hot_queries():
+    """The queries behind the most-hit pages, built the same way the routes build them."""
+    cursor = encode_cursor(datetime.datetime(2024, 1, 1), 1000) # A deep listing page
+    queries = [
+        ("dashboard listing", keyset_query(PDFDocument.query.filter_by(user_id=1, is_deleted=False),
+                                           PDFDocument.upload_date, PDFDocument.id).limit(26)),
+        ("dashboard listing, later page", keyset_query(PDFDocument.query.filter_by(user_id=1, is_deleted=False),
+                                                       PDFDocument.upload_date, PDFDocument.id, cursor).limit(26)),
+        ("duplicate upload check", PDFDocument.query.filter_by(user_id=1, file_hash="0" * 64, is_deleted=False)),
+        # chat_routes._get_chat_context: the PDF and the user's live sessions in one joined query
+        ("chat page", PDFDocument.query.options(
+            joinedload(PDFDocument.chat_sessions.and_(ChatSession.user_id == 1, ChatSession.is_deleted == False))
+        ).filter_by(id=1, user_id=1, is_deleted=False)),
+        ("latest chat session", ChatSession.query.filter_by(user_id=1, pdf_document_id=1, is_deleted=False)
+            .order_by(ChatSession.updated_at.desc()).limit(1)),
+        ("chat session by uuid", ChatSession.query.join(ChatSession.pdf_document).filter(
+            ChatSession.session_uuid == "0" * 36, ChatSession.user_id == 1, ChatSession.pdf_document_id == 1,
+            ChatSession.is_deleted == False, PDFDocument.user_id == 1, PDFDocument.is_deleted == False)),
+        ("chat history", ChatMessage.query.filter_by(chat_session_id=1, is_deleted=False)
+            .order_by(ChatMessage.timestamp.asc())),
+        ("chat history, new messages", ChatMessage.query.filter_by(chat_session_id=1, is_deleted=False)
+            .filter(ChatMessage.id > 1000).order_by(ChatMessage.id.asc())),
+    ]
+    for model in (Contract, Dilekce, Ifade):
+        listing = model.query.filter_by(user_id=1, is_deleted=False).options(
+            defer(model.generated_content_html), defer(model.generated_content_text))
+        queries.append((f"{model.__tablename__} listing",
+                        keyset_query(listing, model.created_at, model.id).limit(26)))
+        queries.append((f"{model.__tablename__} listing, later page",
+                        keyset_query(listing, model.created_at, model.id, cursor).limit(26)))
+    return queries
+
+
+def _plan_lines(query):
+    compiled = query.statement.compile(dialect=db.engine.dialect)
+    connection = db.session.connection()
+    if db.engine.dialect.name == "sqlite":
+        params = tuple(compiled.params[name] for name in compiled.positiontup)
+        rows = connection.exec_driver_sql("EXPLAIN QUERY PLAN " + str(compiled), params).fetchall()
+        return [row[-1] for row in rows]
+    rows = connection.exec_driver_sql("EXPLAIN " + str(compiled), compiled.params).fetchall()
+    return [row[0] for row in rows]
+
+
+def _is_scan(line):
+    # SQLite: "SCAN t" (with or without an index) walks the whole table or index, and a temp
+    # b-tree means the rows came back in the wrong order. PostgreSQL: sequential scans.
+    return line.startswith("SCAN ") or "TEMP B-TREE" in line or "Seq Scan" in line
+
+
+def check_query_plans():
+    """Returns {query name: plan lines} for every hot query whose plan falls back to a scan."""
+    failures = {}
+    if db.engine.dialect.name == "postgresql":
+        # Empty or tiny tables make a sequential scan the cheapest plan; this asks whether an
+        # index could serve the query at all
+        db.session.connection().exec_driver_sql("SET LOCAL enable_seqscan = off")
+    try:
+        for name, query in hot_queries():
+            plan = _plan_lines(query)
+            if any(_is_scan(line) for line in plan):
+                failures[name] = plan
+    finally:
+        db.session.rollback()
+    return failures
@@ -0,0 +1,329 @@
+"""
+Deadlines, retries, hedging and circuit breaking for outbound AI calls.
+
+resilient_call(key, policy_name, fn) runs fn - an idempotent call: an LLM completion, a chain
+invocation or an embedding batch - under the named policy:
+  deadline        - the whole call, retries included, gives up after this many seconds, so a
+                    stuck upstream never holds a request worker longer
+  attempt_timeout - one attempt is abandoned after this; the client timeout is set to the same
+                    value (see ai.get_llm) so the abandoned request ends too
+  attempts        - timeouts, connection errors, 429 and 5xx are retried with full-jitter backoff
+  hedge_after     - (chat) if the first request has not answered by then, an identical second
+                    one is sent and whichever answers first wins
+Requests given up on keep running until their client timeout; inside usage.metered_call they
+keep holding its call slot until then (collect_abandoned_attempts).
+Each key (a "provider:model" spec) has a circuit breaker: after CIRCUIT_FAILURE_THRESHOLD
+consecutive failures, calls fail fast for CIRCUIT_RESET_SECONDS, then a single trial call
+decides whether it closes again. A call made inside another one (the retriever's query embedding
+within a chat chain) runs directly, under the outer call's deadline.
+
+Fault-injection run against a local stub server (see llm_providers.py):
+    python resilience.py [--fail-rate 0.2] [--slow-rate 0.05] [--requests 200]
+"""
+import contextvars
+import random
+import threading
+import time
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from config import Config
+from metrics import Counter, REGISTRY
+
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+RETRYABLE_ERROR_NAMES = {"APITimeoutError", "APIConnectionError", "ConnectError", "ConnectTimeout",
+                         "ReadTimeout", "RemoteProtocolError"}
+
+RESILIENCE_EVENTS = Counter("ai_call_resilience_events_total",
+                            "Retries, hedged requests, deadline misses and circuit breaker rejections.", ("key", "event"))
+REGISTRY.append(RESILIENCE_EVENTS)
+
+
+class AIServiceUnavailableError(Exception):
+    """The provider did not answer usably within the policy; the message is shown to the user."""
+
+    def __init__(self, message="Yapay zeka servisi şu anda yanıt vermiyor. Lütfen biraz sonra tekrar deneyin."):
+        super().__init__(message)
+
+
+class DeadlineExceededError(AIServiceUnavailableError):
+    def __init__(self):
+        super().__init__("Yapay zeka servisi zamanında yanıt vermedi. Lütfen biraz sonra tekrar deneyin.")
+
+
+class CircuitOpenError(AIServiceUnavailableError):
+    def __init__(self):
+        super().__init__("Yapay zeka servisine şu anda ulaşılamıyor. Lütfen birkaç dakika sonra tekrar deneyin.")
+
+
+class _AttemptTimeout(TimeoutError):
+    pass
+
+
+_inside_call = contextvars.ContextVar("inside_resilient_call", default=False)
+_abandoned_attempts = contextvars.ContextVar("abandoned_attempts", default=None)
+
+
+def is_retryable(error):
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    if isinstance(status, int):
+        return status in RETRYABLE_STATUS_CODES
+    return type(error).__name__ in RETRYABLE_ERROR_NAMES
+
+
+class Policy:
+    def __init__(self, deadline, attempts, attempt_timeout, hedge_after=None):
+        self.deadline = deadline
+        self.attempts = attempts
+        self.attempt_timeout = attempt_timeout
+        self.hedge_after = hedge_after
+
+
+def get_policy(name):
+    """Policies are built from Config on each call so config changes (and the benchmark) apply."""
+    if name == "chat":
+        deadline = Config.LLM_DEADLINE_CHAT_SECONDS
+        return Policy(deadline, attempts=2, attempt_timeout=deadline / 2, hedge_after=Config.LLM_HEDGE_AFTER_SECONDS)
+    if name == "title":
+        deadline = Config.LLM_DEADLINE_TITLE_SECONDS
+        return Policy(deadline, attempts=2, attempt_timeout=deadline / 2)
+    if name == "draft": # Long generations: a retry only fits after a fast failure
+        deadline = Config.LLM_DEADLINE_DRAFT_SECONDS
+        return Policy(deadline, attempts=2, attempt_timeout=deadline)
+    if name == "embedding":
+        deadline = Config.EMBEDDING_DEADLINE_SECONDS
+        return Policy(deadline, attempts=3, attempt_timeout=deadline / 2)
+    raise ValueError(f"Unknown resilience policy '{name}'")
+
+
+# --- Circuit breakers ---
+
+class CircuitBreaker:
+    def __init__(self, key, threshold, reset_seconds):
+        self.key = key
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """Raises CircuitOpenError while open; after reset_seconds lets one trial call through."""
+        with self._lock:
+            if self.opened_at is None:
+                return
+            if self.trial_in_flight or time.monotonic() - self.opened_at < self.reset_seconds:
+                RESILIENCE_EVENTS.inc(self.key, "circuit_rejected")
+                raise CircuitOpenError()
+            self.trial_in_flight = True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.trial_in_flight or (self.opened_at is None and self.failures >= self.threshold):
+                if self.opened_at is None:
+                    print(f"Circuit for {self.key} opened after {self.failures} consecutive failures.")
+                self.opened_at = time.monotonic()
+                self.trial_in_flight = False
+
+    def release_trial(self):
+        """The trial call ended without telling anything about the provider (e.g. a bad request)."""
+        with self._lock:
+            self.trial_in_flight = False
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(key):
+    breaker = _breakers.get(key)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.get(key)
+            if breaker is None:
+                breaker = _breakers[key] = CircuitBreaker(key, Config.CIRCUIT_FAILURE_THRESHOLD,
+                                                          Config.CIRCUIT_RESET_SECONDS)
+    return breaker
+
+
+# --- Calls ---
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _run_inside(fn):
+    _inside_call.set(True)
+    return fn()
+
+
+def _submit(fn):
+    """Runs fn on the shared pool in a copy of the caller's context (current trace span included)."""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=Config.AI_CALL_THREADS, thread_name_prefix="ai-call")
+    return _executor.submit(contextvars.copy_context().run, _run_inside, fn)
+
+
+@contextmanager
+def collect_abandoned_attempts():
+    """
+    Yields a list that collects the futures of requests resilient_call stopped waiting for (the
+    slower of two hedged requests, an attempt that timed out) while they still run upstream.
+    usage.FairScheduler keeps the call slot until they end.
+    """
+    futures = []
+    token = _abandoned_attempts.set(futures)
+    try:
+        yield futures
+    finally:
+        _abandoned_attempts.reset(token)
+
+
+def _attempt(key, fn, timeout, hedge_after):
+    """One attempt, hedged if it is slow; raises _AttemptTimeout when nothing answers in time."""
+    end = time.monotonic() + timeout
+    pending = {_submit(fn)}
+    try:
+        if hedge_after is not None and hedge_after < timeout:
+            done, pending = wait(pending, timeout=hedge_after)
+            if done:
+                return next(iter(done)).result()
+            RESILIENCE_EVENTS.inc(key, "hedged")
+            pending.add(_submit(fn))
+        error = None
+        while pending:
+            done, pending = wait(pending, timeout=max(0.0, end - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not done:
+                raise _AttemptTimeout()
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                error = future.exception()
+        raise error
+    finally:
+        abandoned = _abandoned_attempts.get()
+        if abandoned is not None:
+            abandoned.extend(future for future in pending if not future.done())
+
+
+def resilient_call(key, policy_name, fn):
+    """Calls fn under the policy and the circuit breaker of `key`; returns its result."""
+    if _inside_call.get():
+        return fn()
+    policy = get_policy(policy_name)
+    breaker = get_breaker(key)
+    breaker.before_call()
+    deadline = time.monotonic() + policy.deadline
+    last_error = None
+    for attempt in range(policy.attempts):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        if attempt:
+            RESILIENCE_EVENTS.inc(key, "retry")
+        try:
+            result = _attempt(key, fn, min(policy.attempt_timeout, remaining), policy.hedge_after)
+        except Exception as e:
+            if not is_retryable(e):
+                breaker.release_trial()
+                raise
+            last_error = e
+            breaker.record_failure()
+            if breaker.is_open:
+                break
+            backoff = random.uniform(0, min(Config.LLM_RETRY_MAX_SECONDS, Config.LLM_RETRY_BASE_SECONDS * 2 ** attempt))
+            time.sleep(max(0.0, min(backoff, deadline - time.monotonic())))
+            continue
+        breaker.record_success()
+        return result
+    if last_error is None or isinstance(last_error, _AttemptTimeout):
+        RESILIENCE_EVENTS.inc(key, "deadline_exceeded")
+        raise DeadlineExceededError() from last_error
+    raise AIServiceUnavailableError() from last_error
+
+
+_resilient_embeddings_class = None
+
+
+def resilient_embeddings(embeddings, key):
+    """Wraps a LangChain embeddings object so every embedding batch goes through resilient_call."""
+    global _resilient_embeddings_class
+    if _resilient_embeddings_class is None:
+        from langchain_core.embeddings import Embeddings
+
+        class ResilientEmbeddings(Embeddings):
+            def __init__(self, wrapped, key):
+                self.wrapped = wrapped
+                self.key = key
+
+            def embed_documents(self, texts):
+                return resilient_call(self.key, "embedding", lambda: self.wrapped.embed_documents(texts))
+
+            def embed_query(self, text):
+                return resilient_call(self.key, "embedding", lambda: self.wrapped.embed_query(text))
+
+        _resilient_embeddings_class = ResilientEmbeddings
+    return _resilient_embeddings_class(embeddings, key)
+
+
+if __name__ == '__main__':
+    import argparse
+    from llm_providers import create_chat_model, run_stub_server
+    parser = argparse.ArgumentParser(description="Chat calls against a fault-injecting stub, with and without this layer")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--delay-ms", type=float, default=50, help="normal stub response time")
+    parser.add_argument("--fail-rate", type=float, default=0.2, help="share of 503 responses")
+    parser.add_argument("--slow-rate", type=float, default=0.05, help="share of responses that hang")
+    parser.add_argument("--slow-seconds", type=float, default=10)
+    args = parser.parse_args()
+
+    server, Config.LOCAL_LLM_BASE_URL = run_stub_server(args.delay_ms / 1000, fail_rate=args.fail_rate,
+                                                        slow_rate=args.slow_rate, slow_seconds=args.slow_seconds)
+    # Scaled-down chat policy so the run takes seconds
+    Config.LLM_DEADLINE_CHAT_SECONDS = 3
+    Config.LLM_HEDGE_AFTER_SECONDS = 0.5
+    Config.LLM_RETRY_BASE_SECONDS = 0.05
+    Config.CIRCUIT_RESET_SECONDS = 2
+    llm = create_chat_model("local:stub", timeout=Config.LLM_DEADLINE_CHAT_SECONDS / 2, max_retries=0)
+    plain_llm = create_chat_model("local:stub", timeout=args.slow_seconds * 2, max_retries=0)
+
+    def run(label, call, requests):
+        def one(_):
+            started = time.perf_counter()
+            try:
+                call()
+                ok = True
+            except Exception:
+                ok = False
+            return time.perf_counter() - started, ok
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            results = list(pool.map(one, range(requests)))
+        latencies = sorted(seconds for seconds, _ in results)
+        successes = sum(ok for _, ok in results)
+        print(f"[faults] {label}: {successes}/{requests} ok, p50 {latencies[len(latencies) // 2] * 1000:.0f} ms, "
+              f"p95 {latencies[int(len(latencies) * 0.95)] * 1000:.0f} ms, max {latencies[-1] * 1000:.0f} ms")
+
+    prompt = "Kira sözleşmesi nedir?"
+    run("no resilience", lambda: plain_llm.invoke(prompt), args.requests)
+    run("resilient_call", lambda: resilient_call("local:stub", "chat", lambda: llm.invoke(prompt)), args.requests)
+
+    server.fail_rate, server.slow_rate = 1.0, 0.0 # Full outage: the breaker should open and fail fast
+    run("outage, resilient_call", lambda: resilient_call("local:stub", "chat", lambda: llm.invoke(prompt)), 50)
+    print("[faults] events: " + ", ".join(line for line in RESILIENCE_EVENTS.render() if not line.startswith("#")))
@@ -0,0 +1,210 @@
+"""
+Retrieval for PDF chat: retrieve many, re-rank, keep few, fit a token budget.
+
+  search  - RETRIEVAL_CANDIDATES chunks by vector similarity (cheap, recall-oriented)
+  rerank  - a cross-encoder (RERANK_MODEL, run locally on the CPU in RERANK_BATCH_SIZE batches)
+            scores each (question, chunk) pair; the best RETRIEVAL_KEEP are kept
+  trim    - chunks are added best first until RETRIEVAL_CONTEXT_TOKENS; the one that crosses
+            the budget is cut, the rest dropped
+Each stage is a span and a retrieval_stage_duration_seconds observation. The cross-encoder is
+loaded in a background thread started by the first retrieval of the process; with RERANK_MODEL
+empty, while it is loading or when it cannot be loaded (sentence-transformers missing, no access
+to the Hugging Face Hub) the rerank stage is skipped and the first RETRIEVAL_KEEP search results
+are kept.
+
+Offline evaluation of prompt tokens, retrieval hit rate and answer latency, against the old
+k=3 retrieval:
+    python retrieval.py file.pdf [--questions questions.txt] [--answer-spec openai:gpt-4.1-nano]
+"""
+import threading
+import time
+from contextlib import contextmanager
+from config import Config
+from metrics import Histogram, REGISTRY
+from tracing import span
+from usage import count_tokens, truncate_tokens
+
+RETRIEVAL_STAGE_LATENCY = Histogram("retrieval_stage_duration_seconds", "PDF chat retrieval time by stage.", ("stage",))
+RETRIEVAL_CONTEXT_TOKENS = Histogram("retrieval_context_tokens", "Tokens of retrieved context put into the prompt.",
+                                     buckets=(250, 500, 1000, 1500, 2000, 3000, 4000, 6000, 8000))
+REGISTRY.extend([RETRIEVAL_STAGE_LATENCY, RETRIEVAL_CONTEXT_TOKENS])
+
+
+@contextmanager
+def _stage(name, **attributes):
+    started = time.perf_counter()
+    with span(f"retrieval.{name}", **attributes) as stage_span:
+        yield stage_span
+    RETRIEVAL_STAGE_LATENCY.observe(time.perf_counter() - started, name)
+
+
+_reranker = None
+_reranker_unavailable = False
+_reranker_loading = False
+_reranker_lock = threading.Lock()
+
+
+def load_reranker():
+    """The process-wide cross-encoder, or None if it cannot be loaded (chat then keeps similarity order)."""
+    global _reranker, _reranker_unavailable, _reranker_loading
+    with _reranker_lock:
+        if _reranker is None and not _reranker_unavailable:
+            try:
+                from sentence_transformers import CrossEncoder
+                _reranker = CrossEncoder(Config.RERANK_MODEL, device="cpu", max_length=Config.RERANK_MAX_LENGTH)
+            except Exception as e: # sentence-transformers not installed, or the model not downloadable
+                _reranker_unavailable = True
+                print(f"Re-ranking model '{Config.RERANK_MODEL}' could not be loaded, "
+                      f"PDF chat keeps similarity order: {e}")
+        _reranker_loading = False
+    return _reranker
+
+
+def _available_reranker():
+    """The cross-encoder if loaded; otherwise starts loading it in the background and returns None."""
+    # Started by PDF chat rather than create_app, so CLI commands and workers that never serve a
+    # chat do not import torch or download the model, and no request waits for either
+    global _reranker_loading
+    if _reranker is None and not _reranker_unavailable and not _reranker_loading:
+        with _reranker_lock:
+            if _reranker is None and not _reranker_unavailable and not _reranker_loading:
+                _reranker_loading = True
+                threading.Thread(target=load_reranker, name="reranker-load", daemon=True).start()
+    return _reranker
+
+
+def rerank(query, documents, reranker):
+    """documents sorted by cross-encoder relevance to the query, best first."""
+    scores = reranker.predict([(query, document.page_content) for document in documents],
+                              batch_size=Config.RERANK_BATCH_SIZE, show_progress_bar=False)
+    return [document for _, document in sorted(zip(scores, documents), key=lambda pair: pair[0], reverse=True)]
+
+
+def trim_to_budget(documents, token_budget):
+    """Keeps documents in order while they fit in token_budget; the first one that does not is cut to fit."""
+    from langchain_core.documents import Document
+    kept, used = [], 0
+    for document in documents:
+        tokens = count_tokens(document.page_content)
+        if used + tokens <= token_budget:
+            kept.append(document)
+            used += tokens
+            continue
+        if token_budget - used > 50: # A shorter tail is not worth a chunk
+            kept.append(Document(page_content=truncate_tokens(document.page_content, token_budget - used),
+                                 metadata=document.metadata))
+        break
+    return kept
+
+
+def retrieve(store, query, candidates=None, keep=None, token_budget=None):
+    """The context chunks for `query` from a LangChain vector store."""
+    candidates = candidates or Config.RETRIEVAL_CANDIDATES
+    keep = keep or Config.RETRIEVAL_KEEP
+    token_budget = token_budget or Config.RETRIEVAL_CONTEXT_TOKENS
+    with _stage("search", candidates=candidates) as stage_span:
+        documents = store.similarity_search(query, k=candidates)
+        stage_span.set_attribute("documents", len(documents))
+    reranker = _available_reranker() if Config.RERANK_MODEL else None
+    if reranker is not None and len(documents) > 1:
+        with _stage("rerank", model=Config.RERANK_MODEL, documents=len(documents)):
+            documents = rerank(query, documents, reranker)
+    with _stage("trim", token_budget=token_budget) as stage_span:
+        documents = trim_to_budget(documents[:keep], token_budget)
+        context_tokens = count_tokens([document.page_content for document in documents])
+        stage_span.set_attribute("documents", len(documents))
+        stage_span.set_attribute("context_tokens", context_tokens)
+    RETRIEVAL_CONTEXT_TOKENS.observe(context_tokens)
+    return documents
+
+
+_retriever_class = None
+
+
+def reranking_retriever(store):
+    """A LangChain retriever running retrieve() on the store, for ConversationalRetrievalChain."""
+    global _retriever_class
+    if _retriever_class is None:
+        from typing import Any
+        from langchain_core.retrievers import BaseRetriever
+
+        class RerankingRetriever(BaseRetriever):
+            store: Any
+
+            def _get_relevant_documents(self, query, *, run_manager=None):
+                return retrieve(self.store, query)
+
+        _retriever_class = RerankingRetriever
+    return _retriever_class(store=store)
+
+
+if __name__ == '__main__':
+    import argparse
+    import random
+    import shutil
+    import tempfile
+    from langchain_core.documents import Document
+    from ai import QA_PROMPT_TEMPLATE
+    from embedding_dimensions_report import load_chunks, sample_questions
+    from llm_providers import create_chat_model, create_embeddings
+    import vector_store
+
+    parser = argparse.ArgumentParser(description="Retrieve-rerank-trim against plain k=3 retrieval")
+    parser.add_argument("pdfs", nargs="+")
+    parser.add_argument("--questions", help="file with one question per line, instead of sampled sentences")
+    parser.add_argument("--queries", type=int, default=30, help="sampled questions when --questions is not given")
+    parser.add_argument("--embedding-spec", default=Config.EMBEDDING_MODEL)
+    parser.add_argument("--answer-spec", help="also generate answers with this provider:model to time them")
+    args = parser.parse_args()
+
+    chunks = load_chunks(args.pdfs)
+    if args.questions:
+        with open(args.questions, encoding="utf-8") as questions_file:
+            questions = [(None, line.strip()) for line in questions_file if line.strip()]
+    else: # Known-item questions: a hit means the chunk a sentence came from reached the prompt
+        questions = sample_questions(chunks, args.queries, random.Random(0))
+    llm = create_chat_model(args.answer_spec, temperature=0.2, max_tokens=400) if args.answer_spec else None
+
+    Config.CHROMA_MODE = "embedded"
+    Config.CHROMA_DB_PATH = tempfile.mkdtemp(prefix="chroma_eval_")
+    try:
+        store = vector_store.add_documents("eval", create_embeddings(args.embedding_spec),
+                                           [Document(page_content=text, metadata={"chunk": i})
+                                            for i, text in enumerate(chunks)])
+        pipelines = [
+            ("k=3 similarity", lambda query: store.similarity_search(query, k=3)),
+            (f"{Config.RETRIEVAL_CANDIDATES} -> rerank -> {Config.RETRIEVAL_KEEP}, "
+             f"{Config.RETRIEVAL_CONTEXT_TOKENS} token budget", lambda query: retrieve(store, query)),
+        ]
+        if Config.RERANK_MODEL:
+            load_reranker() # Model load is not part of the timings
+        for label, pipeline in pipelines:
+            retrieval_seconds, context_tokens, answer_seconds, hits, known = [], [], [], 0, 0
+            for source_chunk, question in questions:
+                started = time.perf_counter()
+                documents = pipeline(question)
+                retrieval_seconds.append(time.perf_counter() - started)
+                context = "\n\n".join(document.page_content for document in documents)
+                context_tokens.append(count_tokens(context))
+                if source_chunk is not None:
+                    known += 1
+                    hits += any(document.metadata.get("chunk") == source_chunk for document in documents)
+                if llm:
+                    started = time.perf_counter()
+                    llm.invoke(QA_PROMPT_TEMPLATE.format(context=context, question=question))
+                    answer_seconds.append(time.perf_counter() - started)
+            retrieval_seconds.sort()
+            answer_seconds.sort()
+            line = (f"[eval] {label}: context {sum(context_tokens) / len(context_tokens):.0f} tokens avg, "
+                    f"retrieval p50 {retrieval_seconds[len(retrieval_seconds) // 2] * 1000:.0f} ms, "
+                    f"p95 {retrieval_seconds[int(len(retrieval_seconds) * 0.95)] * 1000:.0f} ms")
+            if known:
+                line += f", hit rate {hits / known:.2f}"
+            if answer_seconds:
+                line += (f", answer p50 {answer_seconds[len(answer_seconds) // 2] * 1000:.0f} ms, "
+                         f"p95 {answer_seconds[int(len(answer_seconds) * 0.95)] * 1000:.0f} ms")
+            print(line)
+        print("[eval] stage timings: " + ", ".join(line for line in RETRIEVAL_STAGE_LATENCY.render()
+                                                   if line.startswith("retrieval_stage_duration_seconds_sum")))
+    finally:
+        shutil.rmtree(Config.CHROMA_DB_PATH, ignore_errors=True)
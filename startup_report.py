@@ -0,0 +1,74 @@
+"""
+Startup cost report: imports a module in a fresh interpreter with `python -X importtime`,
+prints the slowest imports and appends the totals to a history file so cold start can be
+tracked across commits.
+
+Usage: python startup_report.py [module] [--top N]   (module defaults to "app")
+"""
+import datetime
+import json
+import os
+import subprocess
+import sys
+
+basedir = os.path.abspath(os.path.dirname(__file__))
+HISTORY_PATH = os.path.join(basedir, 'instance', 'startup_history.jsonl')
+
+
+def measure_imports(module):
+    """Returns (wall seconds, [(cumulative_us, self_us, module_name), ...]) for importing module."""
+    code = f"import time; _t = time.perf_counter(); import {module}; print(time.perf_counter() - _t)"
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                            cwd=basedir, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+    wall_seconds = float(result.stdout.strip().splitlines()[-1])
+    imports = []
+    for line in result.stderr.splitlines():
+        # "import time:  self [us] | cumulative | imported package"
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        imports.append((int(cumulative_us), int(self_us), name.rstrip()))
+    return wall_seconds, imports
+
+
+def _git_commit():
+    result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=basedir, capture_output=True, text=True)
+    return result.stdout.strip() or None
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    top = 15
+    if "--top" in args:
+        index = args.index("--top")
+        top = int(args[index + 1])
+        del args[index:index + 2]
+    module = args[0] if args else "app"
+
+    wall_seconds, imports = measure_imports(module)
+    total_self_us = sum(self_us for _, self_us, _ in imports)
+    print(f"[startup] import {module}: {wall_seconds * 1000:.0f} ms wall, "
+          f"{total_self_us / 1000:.0f} ms in {len(imports)} module imports")
+    print(f"{'cumulative ms':>14} {'self ms':>8}  module")
+    for cumulative_us, self_us, name in sorted(imports, reverse=True)[:top]:
+        print(f"{cumulative_us / 1000:>14.1f} {self_us / 1000:>8.1f}  {name}")
+
+    heavy = sorted({name.strip().split(".")[0] for _, _, name in imports}
+                   & {"langchain", "langchain_community", "langchain_openai", "chromadb", "openai",
+                      "weasyprint", "docx", "tiktoken"})
+    if heavy:
+        print(f"[startup] heavy packages imported at startup: {', '.join(heavy)}")
+
+    os.makedirs(os.path.dirname(HISTORY_PATH), exist_ok=True)
+    with open(HISTORY_PATH, "a", encoding="utf-8") as history:
+        history.write(json.dumps({
+            "measured_at": datetime.datetime.utcnow().isoformat(timespec="seconds"),
+            "commit": _git_commit(),
+            "module": module,
+            "wall_ms": round(wall_seconds * 1000, 1),
+            "module_count": len(imports),
+            "heavy_packages": heavy,
+        }) + "\n")
+    print(f"[startup] appended to {HISTORY_PATH}")
@@ -0,0 +1,17 @@
+import os
+import pytest
+
+os.environ["FLASK_ENV"] = "test" # TestingConfig: in-memory SQLite
+
+from app import create_app
+from models import db
+
+
+@pytest.fixture
+def app():
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
@@ -0,0 +1,90 @@
+import uuid
+import datetime
+import pytest
+from sqlalchemy import event
+import chat_routes
+from models import db, User, PDFDocument, ChatSession, ChatMessage
+
+
+@pytest.fixture
+def chat_data(app):
+    user = User(full_name="Test Kullanıcı", email="test@example.com")
+    user.set_password("parola")
+    pdf = PDFDocument(user=user, filename="ornek.pdf", original_filename="ornek.pdf", file_hash="0" * 64,
+                      filepath="/tmp/ornek.pdf", processed=True)
+    sessions = []
+    for n in range(3):
+        chat_session = ChatSession(session_uuid=str(uuid.uuid4()), user=user, pdf_document=pdf, title=f"Sohbet {n}")
+        for i in range(6):
+            chat_session.messages.append(ChatMessage(user=user, pdf_document=pdf, message_content=f"Mesaj {i}",
+                                                     sender_type='user' if i % 2 == 0 else 'ai'))
+        sessions.append(chat_session)
+    db.session.add_all([user, pdf, *sessions])
+    db.session.commit()
+    return user.id, pdf.id, [chat_session.session_uuid for chat_session in sessions]
+
+
+@pytest.fixture
+def client(app, chat_data):
+    client = app.test_client()
+    with client.session_transaction() as session: # Logged in as the chat_data user (Flask-Login)
+        session['_user_id'] = str(chat_data[0])
+        session['_fresh'] = True
+    return client
+
+
+@pytest.fixture
+def rendered(monkeypatch):
+    """The context chat_with_pdf renders with; the template only reads columns the route loaded."""
+    context = {}
+
+    def render_template(template_name, **template_context):
+        context.update(template_context)
+        return ""
+
+    monkeypatch.setattr(chat_routes, 'render_template', render_template)
+    return context
+
+
+def _count_statements(request):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        response = request()
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+    return response, statements
+
+
+@pytest.mark.parametrize('pick_session', [False, True])
+def test_chat_page_get_query_count(client, chat_data, rendered, pick_session):
+    _, pdf_id, session_uuids = chat_data
+    url = f"/chat/pdf/{pdf_id}" + (f"?session_uuid={session_uuids[0]}" if pick_session else "")
+
+    response, statements = _count_statements(lambda: client.get(url))
+
+    assert response.status_code == 200
+    # The logged-in user, the PDF with its chat sessions, and the current session's messages
+    assert len(statements) == 3, "\n\n".join(statements)
+    assert len(rendered['all_chat_sessions']) == 3
+    assert len(rendered['chat_history']) == 6
+
+
+@pytest.mark.parametrize('offset, expected_count', [("", 3), ("Z", 3), ("+00:00", 3), ("+03:00", 6), ("-03:00", 0)])
+def test_chat_history_since_offsets(app, client, chat_data, offset, expected_count):
+    _, pdf_id, session_uuids = chat_data
+    chat_session = ChatSession.query.filter_by(session_uuid=session_uuids[0]).one()
+    for n, message in enumerate(sorted(chat_session.messages, key=lambda message: message.id)):
+        message.timestamp = datetime.datetime(2024, 5, 1, 12, n) # Naive UTC, as stored
+    db.session.commit()
+
+    # 12:02 in the given offset; with +03:00 that is 09:02 UTC, before every message
+    response = client.get(f"/chat/pdf/{pdf_id}/history?session_uuid={session_uuids[0]}"
+                          f"&since=2024-05-01T12:02:00{offset.replace('+', '%2B')}")
+
+    assert response.status_code == 200
+    assert len(response.get_json()) == expected_count
@@ -0,0 +1,20 @@
+import pytest
+from html_text import html_to_text
+
+
+@pytest.mark.parametrize('html_content, expected', [
+    ("<h1>Başlık</h1>\n<p>Birinci paragraf.</p>\n<p>İkinci\n   paragraf.</p>",
+     "Başlık\n\nBirinci paragraf.\n\nİkinci paragraf."),
+    ("<p>Taraflar &amp; kefil &lt;p&gt; &quot;aynen&quot; &#39;kabul&#39;&nbsp;eder &copy;</p>",
+     "Taraflar & kefil <p> \"aynen\" 'kabul' eder ©"),
+    ("<p>&amp;lt; yazılır</p>", "&lt; yazılır"),
+    ("<p><strong>Madde 1:</strong>\n<em>Konu</em></p>", "Madde 1: Konu"),
+    ("<ol>\n<li>Bir</li>\n<li>İki\n<ul><li>alt</li></ul></li>\n</ol>\n<p>Son</p>",
+     "1. Bir\n2. İki\n  - alt\n\nSon"),
+    ("satır 1<br>satır 2<BR/>satır 3", "satır 1\nsatır 2\nsatır 3"),
+    ("<style>p > span { color: red; }</style><!-- not > metin --><P CLASS=\"x\">Metin</P>", "Metin"),
+    ("<table><tr><td>A</td><td>B</td></tr><tr><td>C</td><td>D</td></tr></table>", "A B\nC D"),
+    ("", ""),
+])
+def test_html_to_text(html_content, expected):
+    assert html_to_text(html_content) == expected
@@ -0,0 +1,28 @@
+import os
+from flask_migrate import upgrade
+from models import db
+from query_plans import check_query_plans
+
+MIGRATIONS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'migrations')
+
+
+def _report(failures):
+    return "\n".join(f"{name}: {' | '.join(plan)}" for name, plan in failures.items())
+
+
+def test_hot_queries_use_an_index(app):
+    failures = check_query_plans()
+    assert not failures, _report(failures)
+
+
+def test_migrations_create_the_indexes(app):
+    # A database from before the live-row indexes: the same tables without them
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            if index.dialect_options['sqlite']['where'] is not None: # models.live_rows_index
+                index.drop(db.engine)
+    assert check_query_plans()
+
+    upgrade(directory=MIGRATIONS)
+    failures = check_query_plans()
+    assert not failures, _report(failures)
@@ -0,0 +1,350 @@
+"""
+Span-based tracing for the AI pipeline (ingestion, retrieval, condense, generation).
+
+A trace starts at the outermost span() and is kept or dropped as a whole according to
+TRACE_SAMPLE_RATE, so unsampled calls only pay for a random() and a no-op object. Finished
+traces go to the exporters named in TRACE_EXPORTERS:
+  jsonl - one JSON object per span in TRACE_JSONL_PATH
+  otlp  - OpenTelemetry OTLP/JSON ExportTraceServiceRequest, POSTed to TRACE_OTLP_ENDPOINT
+          (e.g. http://localhost:4318/v1/traces) or appended to TRACE_OTLP_PATH
+More exporters can be added with register_exporter().
+"""
+import contextvars
+import functools
+import json
+import os
+import queue
+import random
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from config import Config
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class _Trace:
+    def __init__(self):
+        self.trace_id = os.urandom(16).hex()
+        self.finished_spans = []
+
+
+class Span:
+    sampled = True
+
+    def __init__(self, name, trace, parent_id=None, attributes=None):
+        self.name = name
+        self.trace = trace
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.attributes = dict(attributes or {})
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.error = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def end(self, error=None):
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        self.trace.finished_spans.append(self)
+        if self.parent_id is None: # Root span: the trace is complete
+            _export(self.trace.finished_spans)
+
+    @property
+    def duration_ms(self):
+        return (self.end_ns - self.start_ns) / 1e6
+
+
+class _NoopSpan:
+    sampled = False
+
+    def set_attribute(self, key, value):
+        pass
+
+    def end(self, error=None):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def current_span():
+    return _current_span.get()
+
+
+def start_span(name, parent=None, **attributes):
+    """
+    Starts a span that the caller must end(); for code whose start and end are separate
+    callbacks. Without a parent it continues the current span, or starts a (sampled or not) trace.
+    """
+    parent = parent if parent is not None else _current_span.get()
+    if parent is None:
+        if random.random() >= Config.TRACE_SAMPLE_RATE:
+            return NOOP_SPAN
+        return Span(name, _Trace(), None, attributes)
+    if not parent.sampled:
+        return NOOP_SPAN
+    return Span(name, parent.trace, parent.span_id, attributes)
+
+
+@contextmanager
+def span(name, **attributes):
+    """Times the enclosed block as a child of the current span (or as a new trace)."""
+    new_span = start_span(name, **attributes)
+    token = _current_span.set(new_span)
+    try:
+        yield new_span
+    except BaseException as e:
+        new_span.end(error=e)
+        raise
+    else:
+        new_span.end()
+    finally:
+        _current_span.reset(token)
+
+
+def traced(name):
+    """Decorator form of span() for whole functions."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# --- Exporters ---
+
+class JsonlExporter:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, spans):
+        lines = "".join(json.dumps({
+            "trace_id": s.trace.trace_id,
+            "span_id": s.span_id,
+            "parent_id": s.parent_id,
+            "name": s.name,
+            "start_unix_ms": s.start_ns // 1_000_000,
+            "duration_ms": round(s.duration_ms, 3),
+            "attributes": s.attributes,
+            "error": s.error,
+        }, ensure_ascii=False, default=str) + "\n" for s in spans)
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as trace_file:
+                trace_file.write(lines)
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class OtlpJsonExporter:
+    """OTLP/JSON, sent from a background thread so exporting never adds request latency."""
+
+    def __init__(self, endpoint=None, path=None, service_name="emsalkarar"):
+        self.endpoint = endpoint
+        self.path = path
+        self.service_name = service_name
+        self._queue = queue.Queue(maxsize=1000)
+        self._lock = threading.Lock()
+        self._worker = None
+
+    def to_request(self, spans):
+        return {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": self.service_name}}]},
+            "scopeSpans": [{
+                "scope": {"name": "emsalkarar.tracing"},
+                "spans": [{
+                    "traceId": s.trace.trace_id,
+                    "spanId": s.span_id,
+                    **({"parentSpanId": s.parent_id} if s.parent_id else {}),
+                    "name": s.name,
+                    "kind": 1, # SPAN_KIND_INTERNAL
+                    "startTimeUnixNano": str(s.start_ns),
+                    "endTimeUnixNano": str(s.end_ns),
+                    "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in s.attributes.items()],
+                    "status": {"code": 2, "message": s.error} if s.error else {"code": 1},
+                } for s in spans],
+            }],
+        }]}
+
+    def export(self, spans):
+        try:
+            self._queue.put_nowait(self.to_request(spans))
+        except queue.Full:
+            return # Drop rather than block the caller when the collector is down
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="otlp-exporter", daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            payload = json.dumps(self._queue.get()).encode("utf-8")
+            try:
+                if self.endpoint:
+                    request = urllib.request.Request(self.endpoint, data=payload, method="POST",
+                                                     headers={"Content-Type": "application/json"})
+                    urllib.request.urlopen(request, timeout=5).close()
+                else:
+                    os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                    with open(self.path, "ab") as trace_file:
+                        trace_file.write(payload + b"\n")
+            except Exception as e:
+                print(f"Error exporting traces: {e}")
+
+
+_exporters = None
+_exporters_lock = threading.Lock()
+
+
+def _configured_exporters():
+    exporters = []
+    for name in (n.strip() for n in Config.TRACE_EXPORTERS.split(",")):
+        if name == "jsonl":
+            exporters.append(JsonlExporter(Config.TRACE_JSONL_PATH))
+        elif name == "otlp":
+            exporters.append(OtlpJsonExporter(endpoint=Config.TRACE_OTLP_ENDPOINT, path=Config.TRACE_OTLP_PATH))
+        elif name:
+            print(f"Unknown trace exporter '{name}' in TRACE_EXPORTERS, ignoring it.")
+    return exporters
+
+
+def register_exporter(exporter):
+    """Adds an exporter: any object with export(spans)."""
+    global _exporters
+    with _exporters_lock:
+        if _exporters is None:
+            _exporters = _configured_exporters()
+        _exporters.append(exporter)
+
+
+def _export(spans):
+    global _exporters
+    if _exporters is None:
+        with _exporters_lock:
+            if _exporters is None:
+                _exporters = _configured_exporters()
+    for exporter in _exporters:
+        try:
+            exporter.export(spans)
+        except Exception as e:
+            print(f"Error exporting traces with {type(exporter).__name__}: {e}")
+
+
+# --- LangChain integration ---
+
+def langchain_callback():
+    """
+    Callback handler that turns the runs inside a LangChain chain into child spans of the
+    current span: chains, the retriever and each LLM call. In ConversationalRetrievalChain the
+    LLM call fed with retrieved 'context' is the answer generation; the earlier one condenses
+    the follow-up question with the chat history.
+    """
+    from langchain_core.callbacks import BaseCallbackHandler
+    root = current_span()
+
+    class _TracingHandler(BaseCallbackHandler):
+        def __init__(self):
+            self.spans = {}
+            self.stages = {}
+
+        def _start(self, run_id, parent_run_id, name, **attributes):
+            parent = self.spans.get(parent_run_id, root)
+            self.spans[run_id] = start_span(name, parent=parent, **attributes)
+
+        def _end(self, run_id, error=None):
+            run_span = self.spans.pop(run_id, None)
+            if run_span is not None:
+                run_span.end(error=error)
+
+        def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, **kwargs):
+            chain_name = kwargs.get("name") or ((serialized or {}).get("id") or ["chain"])[-1]
+            if isinstance(inputs, dict) and "context" in inputs:
+                self.stages[run_id] = "generate_answer"
+            elif isinstance(inputs, dict) and "chat_history" in inputs and parent_run_id in self.spans:
+                self.stages[run_id] = "condense_question"
+            self._start(run_id, parent_run_id, f"chain.{chain_name}")
+
+        def on_chain_end(self, outputs, *, run_id, **kwargs):
+            self._end(run_id)
+
+        def on_chain_error(self, error, *, run_id, **kwargs):
+            self._end(run_id, error)
+
+        def on_retriever_start(self, serialized, query, *, run_id, parent_run_id=None, **kwargs):
+            self._start(run_id, parent_run_id, "retrieval")
+
+        def on_retriever_end(self, documents, *, run_id, **kwargs):
+            run_span = self.spans.get(run_id)
+            if run_span is not None:
+                run_span.set_attribute("documents", len(documents))
+            self._end(run_id)
+
+        def on_retriever_error(self, error, *, run_id, **kwargs):
+            self._end(run_id, error)
+
+        def _llm_start(self, serialized, run_id, parent_run_id):
+            stage = self.stages.get(parent_run_id, "call")
+            model = ((serialized or {}).get("kwargs") or {}).get("model_name", "")
+            self._start(run_id, parent_run_id, f"llm.{stage}", model=model)
+
+        def on_llm_start(self, serialized, prompts, *, run_id, parent_run_id=None, **kwargs):
+            self._llm_start(serialized, run_id, parent_run_id)
+
+        def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, **kwargs):
+            self._llm_start(serialized, run_id, parent_run_id)
+
+        def on_llm_end(self, response, *, run_id, **kwargs):
+            run_span = self.spans.get(run_id)
+            token_usage = (response.llm_output or {}).get("token_usage") or {}
+            if run_span is not None and token_usage:
+                run_span.set_attribute("prompt_tokens", token_usage.get("prompt_tokens", 0))
+                run_span.set_attribute("completion_tokens", token_usage.get("completion_tokens", 0))
+            self._end(run_id)
+
+        def on_llm_error(self, error, *, run_id, **kwargs):
+            self._end(run_id, error)
+
+    return _TracingHandler()
+
+
+_traced_embeddings_class = None
+
+
+def traced_embeddings(embeddings):
+    """Wraps a LangChain embeddings object so document and query embedding show up as spans."""
+    global _traced_embeddings_class
+    if _traced_embeddings_class is None:
+        from langchain_core.embeddings import Embeddings
+
+        class TracedEmbeddings(Embeddings):
+            def __init__(self, wrapped):
+                self.wrapped = wrapped
+
+            def embed_documents(self, texts):
+                with span("embeddings.embed_documents", texts=len(texts)):
+                    return self.wrapped.embed_documents(texts)
+
+            def embed_query(self, text):
+                with span("embeddings.embed_query"):
+                    return self.wrapped.embed_query(text)
+
+        _traced_embeddings_class = TracedEmbeddings
+    return _traced_embeddings_class(embeddings)
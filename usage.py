@@ -0,0 +1,329 @@
+"""
+Token accounting, per-user quotas and fair scheduling of outbound LLM/embedding calls.
+
+Every call goes through metered_call(), which
+  1. counts the input tokens with tiktoken and estimates the output,
+  2. checks the user's daily token budget (TokenUsage rows) and token bucket (tokens per minute),
+  3. waits for a call slot from the fair-share scheduler: interactive features (chat) are served
+     before batch ones (generation, ingestion), and users take turns within each class,
+  4. records the actual tokens as a TokenUsage row and settles the bucket with the difference.
+     The row is written in its own transaction, so a route that rolls back still pays for the
+     call; inside a request it is written when the request ends (see init_app).
+
+Buckets and the scheduler live in the worker process, like the metrics; limits are per worker.
+The daily budget is read from the database, so it holds across workers.
+"""
+import datetime
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from flask import g, has_request_context
+from config import Config
+from resilience import collect_abandoned_attempts
+
+CHAT_MODEL = "gpt-4.1-nano" # Tokenizer used when a call does not name its model
+
+# Expected output tokens per feature, reserved from the bucket before the call and settled after
+EXPECTED_OUTPUT_TOKENS = {
+    "chat": 800,
+    "chat_title": 20,
+    "contract": 3000,
+    "dilekce": 2500,
+    "ifade": 2500,
+    "embedding": 0,
+}
+INTERACTIVE_FEATURES = {"chat", "chat_title"}
+
+
+class QuotaExceededError(Exception):
+    """Raised before an LLM call when the user's budget or rate does not allow it."""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class LLMBusyError(Exception):
+    """Raised when no LLM call slot frees up within LLM_QUEUE_WAIT_SECONDS."""
+
+
+# --- Token counting ---
+
+_encodings = {}
+
+
+def _encoding_for(model):
+    encoding = _encodings.get(model)
+    if encoding is None:
+        import tiktoken
+        try:
+            encoding = tiktoken.encoding_for_model(model)
+        except KeyError: # Model newer than the installed tiktoken
+            encoding = tiktoken.get_encoding("o200k_base")
+        _encodings[model] = encoding
+    return encoding
+
+
+def count_tokens(texts, model=CHAT_MODEL):
+    """Token count of a string or a list of strings for the given model."""
+    if isinstance(texts, str):
+        texts = [texts]
+    encoding = _encoding_for(model)
+    return sum(len(tokens) for tokens in encoding.encode_batch(list(texts), disallowed_special=())) if texts else 0
+
+
+def truncate_tokens(text, max_tokens, model=CHAT_MODEL):
+    """The longest prefix of `text` that fits in max_tokens for the given model."""
+    encoding = _encoding_for(model)
+    tokens = encoding.encode(text, disallowed_special=())
+    return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max(0, max_tokens)])
+
+
+# --- Quotas ---
+
+class TokenBucket:
+    """Refills at `rate` tokens/second up to `capacity`. A call larger than the capacity is let
+    through when the bucket is full and leaves it in debt, so big calls are slowed, not refused."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_consume(self, amount):
+        """Consumes `amount` and returns 0, or returns the seconds to wait before it would fit."""
+        with self._lock:
+            self._refill()
+            needed = min(amount, self.capacity)
+            if self.tokens >= needed:
+                self.tokens -= amount
+                return 0
+            return (needed - self.tokens) / self.rate if self.rate else float("inf")
+
+    def settle(self, difference):
+        """Gives back (positive) or charges (negative) the gap between the estimate and actual use."""
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens + difference)
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def _bucket_for(user_id):
+    bucket = _buckets.get(user_id)
+    if bucket is None:
+        with _buckets_lock:
+            bucket = _buckets.get(user_id)
+            if bucket is None:
+                bucket = _buckets[user_id] = TokenBucket(Config.USER_TOKENS_PER_MINUTE / 60.0,
+                                                         Config.USER_TOKEN_BURST)
+    return bucket
+
+
+def tokens_used_today(user_id):
+    from models import db, TokenUsage
+    midnight = datetime.datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    saved = db.session.query(db.func.coalesce(db.func.sum(TokenUsage.input_tokens + TokenUsage.output_tokens), 0)) \
+        .filter(TokenUsage.user_id == user_id, TokenUsage.created_at >= midnight).scalar()
+    pending = g.get("token_usage_rows", ()) if has_request_context() else () # Not written until the request ends
+    return saved + sum(row["input_tokens"] + row["output_tokens"] for row in pending if row["user_id"] == user_id)
+
+
+def check_quota(user_id, estimated_tokens, rate_limited=True):
+    """Raises QuotaExceededError if the user may not spend `estimated_tokens` now; otherwise reserves them."""
+    if Config.USER_DAILY_TOKEN_BUDGET and tokens_used_today(user_id) + estimated_tokens > Config.USER_DAILY_TOKEN_BUDGET:
+        raise QuotaExceededError("Günlük yapay zeka kullanım limitinize ulaştınız. Lütfen yarın tekrar deneyin.")
+    if rate_limited and Config.USER_TOKENS_PER_MINUTE:
+        wait = _bucket_for(user_id).try_consume(estimated_tokens)
+        if wait:
+            raise QuotaExceededError(
+                f"Kısa sürede çok fazla istek gönderdiniz. Lütfen yaklaşık {max(1, round(wait))} saniye sonra tekrar deneyin.",
+                retry_after=wait)
+
+
+# --- Fair-share scheduling ---
+
+class FairScheduler:
+    """
+    At most `slots` concurrent calls. Waiting calls are served interactive class first, and
+    round-robin across users within a class, so a user with many queued calls gets one slot
+    in turn rather than all of them.
+    """
+
+    def __init__(self, slots):
+        self._free = slots
+        self._cond = threading.Condition()
+        self._waiting = {True: OrderedDict(), False: OrderedDict()} # interactive -> user_id -> deque of tickets
+
+    def _next_ticket(self):
+        for interactive in (True, False):
+            queues = self._waiting[interactive]
+            if queues:
+                return queues[next(iter(queues))][0]
+        return None
+
+    def _remove(self, interactive, user_id, ticket):
+        user_queue = self._waiting[interactive][user_id]
+        user_queue.remove(ticket)
+        if user_queue:
+            self._waiting[interactive].move_to_end(user_id) # The user's turn is used up
+        else:
+            del self._waiting[interactive][user_id]
+
+    def acquire(self, user_id, interactive, timeout):
+        ticket = object()
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self._waiting[interactive].setdefault(user_id, deque()).append(ticket)
+            while not (self._free > 0 and self._next_ticket() is ticket):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._remove(interactive, user_id, ticket)
+                    self._cond.notify_all()
+                    raise LLMBusyError("Yapay zeka servisi şu anda yoğun. Lütfen biraz sonra tekrar deneyin.")
+                self._cond.wait(remaining)
+            self._remove(interactive, user_id, ticket)
+            self._free -= 1
+
+    def release(self):
+        with self._cond:
+            self._free += 1
+            self._cond.notify_all()
+
+    def release_when_done(self, futures):
+        """Releases the slot once every future is done, without waiting for them."""
+        remaining = [future for future in futures if not future.done()]
+        if not remaining:
+            self.release()
+            return
+        count = [len(remaining)]
+        count_lock = threading.Lock()
+
+        def _done(_):
+            with count_lock:
+                count[0] -= 1
+                last = count[0] == 0
+            if last:
+                self.release()
+
+        for future in remaining:
+            future.add_done_callback(_done)
+
+    @contextmanager
+    def slot(self, user_id, interactive):
+        # Requests the call abandoned but that still run upstream (a losing hedge, a timed-out
+        # attempt) keep the slot, so the concurrency caps hold for what the provider sees
+        self.acquire(user_id, interactive, Config.LLM_QUEUE_WAIT_SECONDS)
+        with collect_abandoned_attempts() as abandoned:
+            try:
+                yield
+            finally:
+                self.release_when_done(abandoned)
+
+
+scheduler = FairScheduler(Config.LLM_MAX_CONCURRENT_CALLS)
+
+
+# --- Metering ---
+
+class Meter:
+    """Collects the tokens of one metered call; LLM output is added after the call returns."""
+
+    def __init__(self, model, input_tokens):
+        self.model = model
+        self.input_tokens = input_tokens
+        self.output_tokens = 0
+
+    def add_input(self, texts):
+        self.input_tokens += count_tokens(texts, self.model)
+
+    def add_output(self, texts):
+        self.output_tokens += count_tokens(texts, self.model)
+
+    def callback(self):
+        """LangChain callback counting every prompt and completion inside a chain."""
+        from langchain_core.callbacks import BaseCallbackHandler
+        meter = self
+
+        class _TokenCounter(BaseCallbackHandler):
+            def on_llm_start(self, serialized, prompts, **kwargs):
+                meter.add_input(prompts)
+
+            def on_chat_model_start(self, serialized, messages, **kwargs):
+                meter.add_input([str(message.content) for batch in messages for message in batch])
+
+            def on_llm_end(self, response, **kwargs):
+                meter.add_output([generation.text for batch in response.generations for generation in batch])
+
+        return _TokenCounter()
+
+
+@contextmanager
+def metered_call(user_id, feature, input_texts=(), model=CHAT_MODEL, extra_input_tokens=0, counted_by_callback=False,
+                 rate_limited=True):
+    """
+    Wraps one outbound call for `user_id`. input_texts are counted up front; with
+    counted_by_callback the meter's callback() counts the real prompts instead (chains whose
+    prompts are only known inside), and the up-front count is just the quota estimate.
+    With rate_limited=False (the batches of one PDF upload) only the daily budget is checked up
+    front; the tokens still come out of the bucket afterwards, so the upload slows the user's
+    next calls instead of being refused halfway.
+    """
+    estimated_input = count_tokens(input_texts, model) + extra_input_tokens
+    estimate = estimated_input + EXPECTED_OUTPUT_TOKENS.get(feature, 0)
+    reserved = estimate if rate_limited else 0
+    if user_id is not None:
+        check_quota(user_id, estimate, rate_limited)
+    meter = Meter(model, 0 if counted_by_callback else estimated_input)
+    try:
+        with scheduler.slot(user_id, feature in INTERACTIVE_FEATURES):
+            yield meter
+    except BaseException:
+        if user_id is not None and Config.USER_TOKENS_PER_MINUTE and reserved:
+            _bucket_for(user_id).settle(reserved) # Failed calls are not charged
+        raise
+    if user_id is not None:
+        if Config.USER_TOKENS_PER_MINUTE:
+            _bucket_for(user_id).settle(reserved - meter.input_tokens - meter.output_tokens)
+        record_usage(dict(user_id=user_id, feature=feature, model=model, input_tokens=meter.input_tokens,
+                          output_tokens=meter.output_tokens, created_at=datetime.datetime.utcnow()))
+
+
+def _save_usage(rows):
+    from models import db, TokenUsage
+    try:
+        with db.engine.begin() as connection: # Not the caller's session: its rollback must not drop these
+            connection.execute(TokenUsage.__table__.insert(), rows)
+    except Exception as e:
+        print(f"Error saving token usage ({len(rows)} rows): {e}")
+
+
+def record_usage(row):
+    """Saves a TokenUsage row (as a dict of columns) outside the caller's transaction."""
+    if has_request_context():
+        # A request may hold an SQLite write lock until it commits, so its rows wait for teardown
+        g.setdefault("token_usage_rows", []).append(row)
+    else:
+        _save_usage([row])
+
+
+def init_app(app):
+    @app.teardown_request
+    def _save_request_usage(exc):
+        rows = g.pop("token_usage_rows", None)
+        if rows:
+            from models import db
+            # Anything the request left uncommitted is discarded at teardown anyway; ending the
+            # session first releases its locks before the usage rows are written
+            db.session.remove()
+            _save_usage(rows)
@@ -0,0 +1,89 @@
+"""
+Garbage collection of the vector store, run as `flask vector-gc` (safe to schedule nightly).
+
+A collection is an orphan when no live PDFDocument row names it: the PDF was deleted but
+dropping its collection failed, or the ingestion failed half way through. Orphans are dropped
+in batches until the time budget is used up (the next run picks up the rest), then the
+on-disk store is compacted. To keep scheduled runs safe:
+  - only collections named user_<id>_pdf_<id> are considered; anything else is left alone
+  - a collection whose PDF row still exists and is not deleted is kept for
+    VECTOR_GC_GRACE_SECONDS after upload, so an ingestion in progress is never touched
+"""
+import datetime
+import re
+import time
+from config import Config
+from models import db, PDFDocument
+import vector_store
+
+COLLECTION_NAME_PATTERN = re.compile(r"user_(\d+)_pdf_(\d+)")
+
+
+def find_orphans(names):
+    """The names among `names` that no live PDFDocument uses and that are past the grace period."""
+    live = {name for (name,) in db.session.query(PDFDocument.vector_db_collection_name).filter(
+        PDFDocument.is_deleted == False, PDFDocument.vector_db_collection_name.isnot(None))}
+    candidates = {}
+    for name in names:
+        match = COLLECTION_NAME_PATTERN.fullmatch(name)
+        if match and name not in live:
+            candidates[name] = int(match.group(2))
+
+    pdf_ids = sorted(set(candidates.values()))
+    rows = {}
+    for start in range(0, len(pdf_ids), 500): # Stays under SQLite's bound-parameter limit
+        for pdf_id, is_deleted, upload_date in db.session.query(
+                PDFDocument.id, PDFDocument.is_deleted, PDFDocument.upload_date).filter(
+                PDFDocument.id.in_(pdf_ids[start:start + 500])):
+            rows[pdf_id] = (is_deleted, upload_date)
+
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=Config.VECTOR_GC_GRACE_SECONDS)
+    orphans = []
+    for name, pdf_id in candidates.items():
+        row = rows.get(pdf_id)
+        if row is None or row[0] or row[1] is None or row[1] < cutoff:
+            orphans.append(name)
+    return sorted(orphans)
+
+
+def collect_garbage(batch_size=None, time_budget_seconds=None, dry_run=False, vacuum=True):
+    """Drops orphan collections and compacts the store; returns a report dict."""
+    batch_size = batch_size or Config.VECTOR_GC_BATCH_SIZE
+    time_budget_seconds = time_budget_seconds or Config.VECTOR_GC_TIME_BUDGET_SECONDS
+    started = time.monotonic()
+    bytes_before = vector_store.storage_bytes()
+    names = vector_store.collection_names()
+    orphans = find_orphans(names)
+    report = {"collections": len(names), "orphans": len(orphans), "deleted": 0, "failed": 0,
+              "remaining": len(orphans), "compacted": False, "bytes_before": bytes_before,
+              "bytes_after": bytes_before, "reclaimed_bytes": None, "seconds": 0.0}
+    if dry_run:
+        report["seconds"] = time.monotonic() - started
+        return report
+
+    for start in range(0, len(orphans), batch_size):
+        if time.monotonic() - started >= time_budget_seconds:
+            print(f"Vector GC time budget of {time_budget_seconds:.0f}s used up; {report['remaining']} orphans left for the next run.")
+            break
+        for name in orphans[start:start + batch_size]:
+            if vector_store.delete_collection(name):
+                report["deleted"] += 1
+            else:
+                report["failed"] += 1
+            report["remaining"] -= 1
+
+    if vacuum and Config.CHROMA_MODE == "embedded" and bytes_before is not None:
+        if time.monotonic() - started < time_budget_seconds:
+            try:
+                vector_store.compact()
+                report["compacted"] = True
+            except Exception as e: # e.g. "database is locked" while an ingestion is writing
+                print(f"Vector GC compaction failed, will retry on the next run: {e}")
+        else:
+            print("Vector GC skipped compaction: no time budget left.")
+
+    report["bytes_after"] = vector_store.storage_bytes()
+    if bytes_before is not None and report["bytes_after"] is not None:
+        report["reclaimed_bytes"] = bytes_before - report["bytes_after"]
+    report["seconds"] = time.monotonic() - started
+    return report
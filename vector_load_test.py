@@ -0,0 +1,121 @@
+"""
+Multi-worker load test of the vector store modes (CHROMA_MODE): W worker processes, like
+gunicorn workers, each run similarity searches on random collections; the report gives the
+p50/p95 query latency and the resident memory of the workers (plus the server in http mode).
+The http mode starts its own `chroma run` server on the same seeded data.
+
+Usage: python vector_load_test.py [--workers 4] [--queries 200] [--collections 20] [--chunks 200]
+                                  [--modes embedded,http] [--port 8765]
+"""
+import argparse
+import multiprocessing
+import random
+import shutil
+import subprocess
+import tempfile
+import time
+
+
+def _rss_bytes(pid="self"):
+    """Resident memory of a process from /proc (Linux); None elsewhere."""
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+def _configure(mode, path, port):
+    from config import Config
+    Config.CHROMA_MODE = mode
+    Config.CHROMA_DB_PATH = path
+    Config.CHROMA_HOST = "127.0.0.1"
+    Config.CHROMA_PORT = port
+
+
+def _seed(path, collections, chunks):
+    _configure("embedded", path, 0)
+    import vector_store
+    return vector_store.seed_benchmark_collections(collections, chunks, vector_store.hash_embeddings())
+
+
+def _worker(mode, path, port, names, queries, seed):
+    """One worker process: returns (query latencies in seconds, RSS bytes after the run)."""
+    _configure(mode, path, port)
+    import vector_store
+    embeddings = vector_store.hash_embeddings()
+    rng = random.Random(seed)
+    for name in names: # Warm-up: open every collection once, as a long-running worker would have
+        vector_store.get_store(name, embeddings).similarity_search("kira bedeli", k=3)
+    latencies = []
+    for _ in range(queries):
+        started = time.perf_counter()
+        vector_store.get_store(rng.choice(names), embeddings).similarity_search("kira bedeli", k=3)
+        latencies.append(time.perf_counter() - started)
+    return latencies, _rss_bytes()
+
+
+def _start_server(path, port):
+    command = [shutil.which("chroma") or "chroma", "run", "--path", path, "--host", "127.0.0.1", "--port", str(port)]
+    server = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    import chromadb
+    deadline = time.monotonic() + 60
+    while True:
+        try:
+            chromadb.HttpClient(host="127.0.0.1", port=port).heartbeat()
+            return server
+        except Exception:
+            if server.poll() is not None or time.monotonic() > deadline:
+                server.kill()
+                raise RuntimeError(f"Chroma server did not start: {' '.join(command)}")
+            time.sleep(0.5)
+
+
+def _megabytes(value):
+    return f"{value / 1024 / 1024:.0f} MB" if value is not None else "n/a"
+
+
+def run_mode(mode, path, args, names, context):
+    server = _start_server(path, args.port) if mode == "http" else None
+    try:
+        with context.Pool(args.workers) as pool:
+            results = pool.starmap(_worker, [(mode, path, args.port, names, args.queries, seed)
+                                             for seed in range(args.workers)])
+        server_rss = _rss_bytes(server.pid) if server else None
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+    latencies = sorted(seconds for worker_latencies, _ in results for seconds in worker_latencies)
+    worker_rss = [rss for _, rss in results]
+    workers_total = sum(worker_rss) if None not in worker_rss else None
+    total = workers_total + (server_rss or 0) if workers_total is not None else None
+    print(f"[load] {mode}: p50 {latencies[len(latencies) // 2] * 1000:.2f} ms, "
+          f"p95 {latencies[int(len(latencies) * 0.95)] * 1000:.2f} ms over {len(latencies)} queries; "
+          f"memory: workers {_megabytes(workers_total)} ({args.workers} x ~"
+          f"{_megabytes(workers_total / args.workers if workers_total is not None else None)}), "
+          f"server {_megabytes(server_rss) if server else '-'}, total {_megabytes(total)}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Memory and query latency of CHROMA_MODE=embedded vs http")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--queries", type=int, default=200, help="queries per worker")
+    parser.add_argument("--collections", type=int, default=20)
+    parser.add_argument("--chunks", type=int, default=200, help="chunks per collection")
+    parser.add_argument("--modes", default="embedded,http")
+    parser.add_argument("--port", type=int, default=8765, help="port of the test server in http mode")
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn") # Fresh interpreters, no client inherited from the parent
+    path = tempfile.mkdtemp(prefix="chroma_load_")
+    try:
+        with context.Pool(1) as pool: # Seeded in a child so the parent never holds the store open
+            names = pool.apply(_seed, (path, args.collections, args.chunks))
+        for mode in (m.strip() for m in args.modes.split(",")):
+            run_mode(mode, path, args, names, context)
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
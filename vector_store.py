@@ -0,0 +1,217 @@
+"""
+Shared access to the Chroma vector store.
+
+One Chroma client per process, and a bounded LRU pool of LangChain collection handles so
+repeated questions on the same PDF do not rebuild them. CHROMA_MODE picks the client:
+  embedded - the worker opens CHROMA_DB_PATH itself (development, single worker)
+  http     - the worker talks to one Chroma server at CHROMA_HOST:CHROMA_PORT, started with
+             `chroma run --path chroma_data --port 8000`; the client keeps its HTTP connections
+             alive, so gunicorn workers share one copy of the indexes and one writer
+Documents are added in batches: each batch is one embedding request and one Chroma write.
+Chroma persists on every write, so there is no separate persist step.
+
+Micro-benchmark of per-call open + query against the shared client and pool:
+    python vector_store.py [--collections N] [--chunks N] [--queries N]
+Multi-worker memory and latency of the two modes: vector_load_test.py
+"""
+import os
+import threading
+from collections import OrderedDict
+from config import Config
+
+_client = None
+_client_lock = threading.Lock()
+_handles = OrderedDict() # collection name -> (embeddings, LangChain Chroma), least recently used first
+_handles_lock = threading.Lock()
+
+
+def get_client():
+    """The process-wide Chroma client."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                import chromadb
+                from chromadb.config import Settings
+                settings = Settings(anonymized_telemetry=False)
+                if Config.CHROMA_MODE == "http":
+                    _client = chromadb.HttpClient(host=Config.CHROMA_HOST, port=Config.CHROMA_PORT,
+                                                  ssl=Config.CHROMA_SSL, settings=settings)
+                elif Config.CHROMA_MODE == "embedded":
+                    os.makedirs(Config.CHROMA_DB_PATH, exist_ok=True)
+                    _client = chromadb.PersistentClient(path=Config.CHROMA_DB_PATH, settings=settings)
+                else:
+                    raise ValueError(f"Unknown CHROMA_MODE '{Config.CHROMA_MODE}', expected embedded or http")
+    return _client
+
+
+def get_store(collection_name, embeddings, collection_metadata=None):
+    """A LangChain Chroma for the collection, reused from the pool while it was opened with the same embeddings."""
+    with _handles_lock:
+        handle = _handles.get(collection_name)
+        if handle is not None and handle[0] is embeddings:
+            _handles.move_to_end(collection_name)
+            return handle[1]
+    from langchain_community.vectorstores import Chroma
+    store = Chroma(client=get_client(), collection_name=collection_name, embedding_function=embeddings,
+                   collection_metadata=collection_metadata)
+    with _handles_lock:
+        _handles[collection_name] = (embeddings, store)
+        _handles.move_to_end(collection_name)
+        while len(_handles) > Config.CHROMA_HANDLE_POOL_SIZE:
+            _handles.popitem(last=False)
+    return store
+
+
+def add_documents(collection_name, embeddings, documents, collection_metadata=None, batch_context=None):
+    """
+    Embeds and stores documents in CHROMA_ADD_BATCH_SIZE batches; returns the store.
+    batch_context(batch), if given, returns a context manager each batch runs in (e.g. metering).
+    """
+    store = get_store(collection_name, embeddings, collection_metadata)
+    batch_size = Config.CHROMA_ADD_BATCH_SIZE
+    max_batch_size = getattr(get_client(), "get_max_batch_size", None)
+    if max_batch_size is not None: # SQLite's variable limit caps one Chroma write
+        batch_size = min(batch_size, max_batch_size())
+    for start in range(0, len(documents), batch_size):
+        batch = documents[start:start + batch_size]
+        if batch_context is None:
+            store.add_documents(batch)
+        else:
+            with batch_context(batch):
+                store.add_documents(batch)
+    return store
+
+
+def delete_collection(collection_name):
+    """Drops the collection and its pooled handle; returns False if it did not exist."""
+    with _handles_lock:
+        _handles.pop(collection_name, None)
+    try:
+        get_client().delete_collection(collection_name)
+        return True
+    except Exception as e: # ValueError or NotFoundError depending on the Chroma version
+        print(f"Could not delete ChromaDB collection '{collection_name}': {e}")
+        return False
+
+
+# --- Storage maintenance (see vector_gc.py) ---
+
+def collection_names():
+    # list_collections returns Collection objects before Chroma 0.6 and names after
+    return [getattr(collection, "name", collection) for collection in get_client().list_collections()]
+
+
+def storage_bytes():
+    """Size of CHROMA_DB_PATH on disk; None when it is not here (http mode on another host)."""
+    if not os.path.isdir(Config.CHROMA_DB_PATH):
+        return None
+    total = 0
+    for root, _, files in os.walk(Config.CHROMA_DB_PATH):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError: # Removed while walking
+                pass
+    return total
+
+
+def compact():
+    """
+    Embedded mode only: removes vector index folders of segments that no longer exist (older
+    Chroma versions leave them behind on delete_collection) and VACUUMs chroma.sqlite3.
+    In http mode run `chroma vacuum --path <data dir>` on the server host instead.
+    """
+    import re
+    import shutil
+    import sqlite3
+    sqlite_path = os.path.join(Config.CHROMA_DB_PATH, "chroma.sqlite3")
+    # Folders are listed before the segments are read: a collection created in between has its
+    # segment row written before its folder, so it cannot be mistaken for a leftover
+    folders = [name for name in os.listdir(Config.CHROMA_DB_PATH)
+               if re.fullmatch(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}", name)]
+    connection = sqlite3.connect(sqlite_path, timeout=30)
+    try:
+        segment_ids = {row[0] for row in connection.execute("SELECT id FROM segments")}
+        for name in folders:
+            if name not in segment_ids:
+                shutil.rmtree(os.path.join(Config.CHROMA_DB_PATH, name), ignore_errors=True)
+        connection.execute("VACUUM")
+    finally:
+        connection.close()
+
+
+# --- Benchmark ---
+
+_hash_embeddings_class = None
+
+
+def hash_embeddings():
+    """Deterministic offline 384-dimension vectors, so benchmarks measure only Chroma."""
+    global _hash_embeddings_class
+    if _hash_embeddings_class is None:
+        import hashlib
+        from langchain_core.embeddings import Embeddings
+
+        class HashEmbeddings(Embeddings):
+            def _vector(self, text):
+                digest = hashlib.sha256(text.encode("utf-8")).digest()
+                return [byte / 255.0 for byte in digest * 12]
+
+            def embed_documents(self, texts):
+                return [self._vector(text) for text in texts]
+
+            def embed_query(self, text):
+                return self._vector(text)
+
+        _hash_embeddings_class = HashEmbeddings
+    return _hash_embeddings_class()
+
+
+def seed_benchmark_collections(collections, chunks, embeddings):
+    """Creates `collections` collections of `chunks` short contract-like chunks; returns their names."""
+    from langchain_core.documents import Document
+    names = [f"bench_{i}" for i in range(collections)]
+    for name in names:
+        add_documents(name, embeddings, [Document(page_content=f"{name} madde {j}: kira bedeli ve süre")
+                                         for j in range(chunks)])
+    return names
+
+
+if __name__ == '__main__':
+    import argparse
+    import random
+    import shutil
+    import tempfile
+    import time
+    from langchain_community.vectorstores import Chroma
+
+    parser = argparse.ArgumentParser(description="Per-call Chroma open + query, before and after the shared client")
+    parser.add_argument("--collections", type=int, default=20)
+    parser.add_argument("--chunks", type=int, default=200, help="chunks per collection")
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    Config.CHROMA_MODE = "embedded"
+    Config.CHROMA_DB_PATH = tempfile.mkdtemp(prefix="chroma_bench_")
+    embeddings = hash_embeddings()
+    try:
+        names = seed_benchmark_collections(args.collections, args.chunks, embeddings)
+        queries = [random.choice(names) for _ in range(args.queries)]
+
+        def measure(label, open_store):
+            timings = []
+            for name in queries:
+                started = time.perf_counter()
+                open_store(name).similarity_search("kira bedeli", k=3)
+                timings.append(time.perf_counter() - started)
+            timings.sort()
+            print(f"[bench] {label}: mean {sum(timings) / len(timings) * 1000:.2f} ms, "
+                  f"p95 {timings[int(len(timings) * 0.95)] * 1000:.2f} ms per open + query")
+
+        measure("before: Chroma(persist_directory=...) per call",
+                lambda name: Chroma(persist_directory=Config.CHROMA_DB_PATH, embedding_function=embeddings,
+                                    collection_name=name))
+        measure("after: shared client + handle pool", lambda name: get_store(name, embeddings))
+    finally:
+        shutil.rmtree(Config.CHROMA_DB_PATH, ignore_errors=True)